@@ -39,16 +39,15 @@ under the License.
 from __future__ import division
 
 import cuda4py.blas as cublas
-import math
 from math import pi
 import numpy
+from numpy.lib.stride_tricks import as_strided
 import time
 from zope.interface import implementer
 
 from veles.accelerated_units import IOpenCLUnit, ICUDAUnit, INumpyUnit
 from veles.compat import from_none
 import veles.error as error
-from veles.memory import reshape_transposed
 from veles.units import Unit
 import veles.ocl_blas as ocl_blas
 import veles.znicz.nn_units as nn_units
@@ -62,10 +61,103 @@ class ConvolutionalBase(Unit):
         super(ConvolutionalBase, self).__init__(workflow, **kwargs)
         self.demand(*self.CONV_ATTRS)
 
+    def init_unpickled(self):
+        super(ConvolutionalBase, self).init_unpickled()
+        self._numpy_buffers_ = {}
+
     def link_conv_attrs(self, other):
         self.link_attrs(other, *self.CONV_ATTRS)
         return self
 
+    @property
+    def numpy_kernel_app(self):
+        """Returns the number of kernel applications along (y, x) axes.
+        """
+        return (
+            1 + (self._sy - self.ky + self.padding[1] + self.padding[3]) //
+            self.sliding[1],
+            1 + (self._sx - self.kx + self.padding[0] + self.padding[2]) //
+            self.sliding[0])
+
+    def numpy_buffer(self, name, shape, dtype):
+        """Returns the scratch array which is reused between the calls.
+
+        The array is zero filled on allocation and may be larger than
+        requested along the first axis, so the view of the first shape[0]
+        elements is returned.
+        """
+        buf = self._numpy_buffers_.get(name)
+        if (buf is None or buf.dtype != dtype or buf.shape[0] < shape[0] or
+                buf.shape[1:] != tuple(shape[1:])):
+            buf = numpy.zeros(shape, dtype=dtype)
+            self._numpy_buffers_[name] = buf
+        return buf[:shape[0]]
+
+    def _numpy_windows(self, padded):
+        """Returns the (count, ky_app, kx_app, ky, kx, n_channels) view
+        of the padded images, no data is copied.
+        """
+        ky_app, kx_app = self.numpy_kernel_app
+        sn, sy, sx, sc = padded.strides
+        return as_strided(
+            padded, shape=(padded.shape[0], ky_app, kx_app,
+                           self.ky, self.kx, self._n_channels),
+            strides=(sn, sy * self.sliding[1], sx * self.sliding[0],
+                     sy, sx, sc), writeable=False)
+
+    def numpy_unpack(self, data, unpack_data):
+        """Unpacks the images into the matrix of kernel applications
+        (im2col), the same way Unpack1D kernel does.
+
+        Parameters:
+            data: images of shape (count, sy, sx, n_channels).
+            unpack_data: contiguous matrix of shape
+                (count * ky_app * kx_app, ky * kx * n_channels).
+        """
+        count = data.shape[0]
+        data = data.reshape(count, self._sy, self._sx, self._n_channels)
+        if any(self.padding):
+            left, top, right, bottom = self.padding
+            # The border is never written, so it stays zero filled
+            padded = self.numpy_buffer(
+                "padded_input", (count, top + self._sy + bottom,
+                                 left + self._sx + right, self._n_channels),
+                data.dtype)
+            padded[:, top:top + self._sy, left:left + self._sx] = data
+            data = padded
+        ky_app, kx_app = self.numpy_kernel_app
+        numpy.copyto(
+            unpack_data.reshape(count, ky_app, kx_app, self.ky, self.kx,
+                                self._n_channels),
+            self._numpy_windows(data))
+
+    def numpy_pack(self, unpack_data, data):
+        """Sums the matrix of kernel applications back into the images
+        (col2im), the same way DirectPack kernel does.
+
+        Parameters:
+            unpack_data: matrix of shape
+                (count * ky_app * kx_app, ky * kx * n_channels).
+            data: images of shape (count, sy, sx, n_channels) to add to.
+        """
+        count = data.shape[0]
+        left, top, right, bottom = self.padding
+        ky_app, kx_app = self.numpy_kernel_app
+        sly, slx = self.sliding[1], self.sliding[0]
+        padded = self.numpy_buffer(
+            "padded_pack", (count, top + self._sy + bottom,
+                            left + self._sx + right, self._n_channels),
+            unpack_data.dtype)
+        padded[:] = 0
+        cols = unpack_data.reshape(count, ky_app, kx_app, self.ky, self.kx,
+                                   self._n_channels)
+        for i in range(self.ky):
+            for j in range(self.kx):
+                padded[:, i:i + sly * ky_app:sly,
+                       j:j + slx * kx_app:slx] += cols[:, :, :, i, j]
+        data = data.reshape(count, self._sy, self._sx, self._n_channels)
+        data += padded[:, top:top + self._sy, left:left + self._sx]
+
 
 @implementer(IOpenCLUnit, ICUDAUnit, INumpyUnit)
 class Conv(ConvolutionalBase, nn_units.NNLayerBase):
@@ -320,44 +412,21 @@ class Conv(ConvolutionalBase, nn_units.NNLayerBase):
         self.bias.map_read()
         self.output.map_invalidate()
 
-        sx_full = self.padding[0] + self._sx + self.padding[2]
-        sy_full = self.padding[1] + self._sy + self.padding[3]
-        nx = (sx_full - self.kx) // self.sliding[0] + 1
-        ny = (sy_full - self.ky) // self.sliding[1] + 1
-
-        weights = (reshape_transposed(self.weights.mem)
-                   if self.weights_transposed else self.weights.mem)
-
-        assert self.kx >= 0 and self.ky >= 0
-        for batch, _ in ((batch, ch)
-                         for batch in range(self._batch_size)
-                         for ch in range(self._n_channels)):
-            for k, kernel in enumerate(weights):
-                for i, j in ((i, j) for i in range(ny) for j in range(nx)):
-                    full_i1 = i * self.sliding[1]
-                    full_i2 = full_i1 + self.ky
-                    full_j1 = j * self.sliding[0]
-                    full_j2 = full_j1 + self.kx
-                    in_i1 = min(max(full_i1 - self.padding[1], 0), self._sy)
-                    in_i2 = min(max(full_i2 - self.padding[1], 0), self._sy)
-                    in_j1 = min(max(full_j1 - self.padding[0], 0), self._sx)
-                    in_j2 = min(max(full_j2 - self.padding[0], 0), self._sx)
-                    cut_i1, cut_i2 = (in_i1 - full_i1 + self.padding[1],
-                                      in_i2 - full_i1 + self.padding[1])
-                    cut_j1, cut_j2 = (in_j1 - full_j1 + self.padding[0],
-                                      in_j2 - full_j1 + self.padding[0])
-                    if in_i2 - in_i1 > 0 or in_j2 - in_j1 > 0:
-                        cut = self.input.mem[batch, in_i1:in_i2, in_j1:in_j2]
-                        kernel_3d = kernel.reshape(self.ky, self.kx,
-                                                   self._n_channels)
-                        cutted_kernel = kernel_3d[cut_i1:cut_i2,
-                                                  cut_j1:cut_j2, :]
-                        assert cut.size == cutted_kernel.size
-                        conv = numpy.sum(numpy.multiply(cut.ravel(),
-                                                        cutted_kernel.ravel()))
-                        self.output.mem[batch, i, j, k] = conv
-        # add bias and apply activation function
-        self.apply_activation()
+        weights = (self.weights.mem if self.weights_transposed
+                   else self.weights.mem.transpose())
+        output = self.output.mem.reshape(
+            self._batch_size * self._kernel_app_per_image, self.n_kernels)
+        for i in range(0, self._batch_size, self.unpack_size):
+            count = min(self._batch_size - i, self.unpack_size)
+            unpack_data = self.numpy_buffer(
+                "unpack_data", (count * self._kernel_app_per_image,
+                                self._kernel_size), self.input.dtype)
+            self.numpy_unpack(self.input.mem[i:i + count], unpack_data)
+            mem = output[i * self._kernel_app_per_image:
+                         (i + count) * self._kernel_app_per_image]
+            numpy.dot(unpack_data, weights, mem)
+            # add bias and apply activation function while mem is hot
+            self.apply_activation(mem)
 
     def run(self):
         t1 = time.time()
@@ -366,12 +435,21 @@ class Conv(ConvolutionalBase, nn_units.NNLayerBase):
             return retval
         self.print_debug_data(t1)
 
-    def apply_activation(self):
+    def apply_activation(self, mem=None):
         """Add bias and apply linear activation function.
+
+        Parameters:
+            mem: part of the output to process, the whole output if None.
         """
         assert self.activation_mode == "ACTIVATION_LINEAR"
+        self._add_bias(mem)
+
+    def _add_bias(self, mem):
+        if mem is None:
+            mem = self.output.mem
         if self.include_bias:
-            self.output.mem += self.bias.mem
+            mem += self.bias.mem
+        return mem
 
     def _fill_array(self, filling_type, mem, stddev):
         if filling_type == "uniform":
@@ -487,14 +565,14 @@ class ConvTanh(Conv):
         super(ConvTanh, self).initialize(device=device, **kwargs)
         self.output.max_supposed = 1.7159
 
-    def apply_activation(self):
+    def apply_activation(self, mem=None):
         """Add bias and apply tanh activation function.
         """
         assert self.activation_mode == "ACTIVATION_TANH"
-        for k in range(self.n_kernels):
-            for x in numpy.nditer(self.output.mem[:, :, :, k],
-                                  op_flags=['readwrite']):
-                x[...] = math.tanh((x + self.bias.mem[k]) * 0.6666) * 1.7159
+        mem = self._add_bias(mem)
+        mem *= 0.6666
+        numpy.tanh(mem, mem)
+        mem *= 1.7159
 
 
 class ConvSigmoid(Conv):
@@ -509,14 +587,15 @@ class ConvSigmoid(Conv):
         super(ConvSigmoid, self).initialize(device=device, **kwargs)
         self.output.max_supposed = 1.0
 
-    def apply_activation(self):
+    def apply_activation(self, mem=None):
         """Add bias and apply sigmoid activation function.
         """
         assert self.activation_mode == "ACTIVATION_SIGMOID"
-        for k in range(self.n_kernels):
-            for x in numpy.nditer(self.output.mem[:, :, :, k],
-                                  op_flags=['readwrite']):
-                x[...] = 1.0 / (1.0 + math.exp(-(x + self.bias.mem[k])))
+        mem = self._add_bias(mem)
+        numpy.negative(mem, mem)
+        numpy.exp(mem, mem)
+        mem += 1.0
+        numpy.reciprocal(mem, mem)
 
 
 class ConvRELU(Conv):
@@ -530,18 +609,15 @@ class ConvRELU(Conv):
         super(ConvRELU, self).initialize(device=device, **kwargs)
         self.output.max_supposed = 10
 
-    def apply_activation(self):
+    def apply_activation(self, mem=None):
         """Add bias and apply RELU activation function.
         """
         assert self.activation_mode == "ACTIVATION_RELU"
-        for k in range(self.n_kernels):
-            for x in numpy.nditer(self.output.mem[:, :, :, k],
-                                  op_flags=['readwrite']):
-                tmp_val = x + self.bias.mem[k]
-                if tmp_val > 15:
-                    x[...] = tmp_val
-                else:
-                    x[...] = math.log(math.exp(tmp_val) + 1)
+        mem = self._add_bias(mem)
+        smooth = numpy.minimum(mem, 15)
+        numpy.exp(smooth, smooth)
+        numpy.log1p(smooth, smooth)
+        numpy.copyto(mem, smooth, where=mem <= 15)
 
 
 class ConvStrictRELU(Conv):
@@ -557,12 +633,9 @@ class ConvStrictRELU(Conv):
         super(ConvStrictRELU, self).initialize(device=device, **kwargs)
         self.output.max_supposed = 10
 
-    def apply_activation(self):
+    def apply_activation(self, mem=None):
         """Add bias and apply STRICT_RELU activation function.
         """
         assert self.activation_mode == "ACTIVATION_STRICT_RELU"
-        for k in range(self.n_kernels):
-            for x in numpy.nditer(self.output.mem[:, :, :, k],
-                                  op_flags=['readwrite']):
-                tmp_val = x + self.bias.mem[k]
-                x[...] = numpy.where(numpy.greater(tmp_val, 0), tmp_val, 0)
+        mem = self._add_bias(mem)
+        numpy.maximum(mem, 0, mem)
@@ -22,6 +22,14 @@ __global__ void weights_update(dtype          *weights,
 #if USE_ORTHO > 0
                              , const dtype    factor_ortho,
                                const dtype    *col_sums
+#endif
+#if USE_ADAM > 0
+                             , dtype          *adam_first,
+                               dtype          *adam_second,
+                               const dtype    adam_beta1,
+                               const dtype    adam_beta2,
+                               const dtype    adam_epsilon,
+                               const dtype    adam_lr
 #endif
                     ) {
   size_t idx = blockIdx.x * blockDim.x + threadIdx.x;
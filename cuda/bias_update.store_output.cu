@@ -1,5 +1,9 @@
 if (!tx) {
+#if PRECOMPUTED_GRADIENT > 0
+  dtype sum = gradient[bx];
+#else
   sum += AS[0];
+#endif
   dtype weight = bias[bx];
   dtype gd = -lr * (sum + gradient_step_l12(weight, factor_l12, l1_vs_l2));
   #define weights bias
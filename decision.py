@@ -340,6 +340,12 @@ class DecisionGD(DecisionBase):
 
     Attributes:
         gd_skip: skip gradient descent or not.
+        accumulate_steps: the number of train minibatches the gradient is
+                          averaged over before it is applied.
+        gd_accumulated_steps: the number of the current minibatch in the
+                              accumulation window (starting from 1).
+        gd_apply: the accumulated gradient is applied after the current
+                  minibatch (at least on the last train minibatch).
         minibatch_n_err: number of errors for a minibatch.
         epoch_n_err: number of errors for an epoch.
         epoch_n_err_pt: number of errors for an epoch in percents.
@@ -357,6 +363,13 @@ class DecisionGD(DecisionBase):
         super(DecisionGD, self).__init__(workflow, **kwargs)
         self.fail_iterations = kwargs.get("fail_iterations", 100)
         self.gd_skip = Bool()
+        self.accumulate_steps = kwargs.get("accumulate_steps", 1)
+        if self.accumulate_steps < 1:
+            raise ValueError(
+                "accumulate_steps must be greater than 0 (got %d)" %
+                self.accumulate_steps)
+        self.gd_accumulated_steps = 0
+        self.gd_apply = Bool(True)
 
         # Values for the current epoch
         self.epoch_n_err = [None] * 3
@@ -388,6 +401,16 @@ class DecisionGD(DecisionBase):
 
         self.demand("minibatch_size")
 
+    def init_unpickled(self):
+        super(DecisionGD, self).init_unpickled()
+        # Snapshots taken before the gradient accumulation was added
+        if not hasattr(self, "accumulate_steps"):
+            self.accumulate_steps = 1
+        if not hasattr(self, "gd_accumulated_steps"):
+            self.gd_accumulated_steps = 0
+        if not hasattr(self, "gd_apply"):
+            self.gd_apply = Bool(True)
+
     def initialize(self, **kwargs):
         super(DecisionGD, self).initialize(**kwargs)
         # Reset errors
@@ -439,6 +462,16 @@ class DecisionGD(DecisionBase):
     def on_run(self):
         # Check skip gradient descent or not
         self.gd_skip <<= (self.minibatch_class != TRAIN)
+        if self.gd_skip:
+            return
+        # Count the minibatches of the accumulation window, the gradient is
+        # flushed at the end of the train set
+        if self.gd_apply:
+            self.gd_accumulated_steps = 0
+        self.gd_accumulated_steps += 1
+        self.gd_apply <<= (
+            self.gd_accumulated_steps >= self.accumulate_steps or
+            bool(self.last_minibatch))
 
     def on_last_minibatch(self):
         minibatch_class = self.minibatch_class
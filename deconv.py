@@ -345,4 +345,43 @@ class Deconv(TriviallyDistributable, ConvolutionalBase, nn_units.Forward):
                             self._local_size_pack, self.krn_pack_)
 
     def numpy_run(self):
-        raise NotImplementedError()
+        """Deconvolution on CPU: GEMM of the input with the weights followed
+        by col2im (the same what _process_subblock does on GPU).
+        """
+        self.input.map_read()
+        self.weights.map_read()
+        self.output.map_invalidate()
+
+        self.output.mem[:] = 0
+        weights = (self.weights.mem.transpose() if self.weights_transposed
+                   else self.weights.mem)
+        inp = self.input.mem.reshape(self._kernel_app_total, self.n_kernels)
+        batch_size = self.output.shape[0]
+        for i in range(0, batch_size, self.unpack_size):
+            count = min(batch_size - i, self.unpack_size)
+            unpack_side = self._kernel_app_per_image * count
+            unpack_data = self.numpy_buffer(
+                "unpack_data", (unpack_side, self._kernel_size), self._dtype)
+            numpy.dot(inp[i * self._kernel_app_per_image:
+                          i * self._kernel_app_per_image + unpack_side],
+                      weights, unpack_data)
+            self.numpy_pack(unpack_data, self.output.mem[i:i + count])
+
+        if self.hits:
+            self.numpy_fill_hits()
+            self.output.mem /= numpy.maximum(self.hits.mem, 1)
+        else:
+            self.output.mem /= ((self.kx // self.sliding[0]) *
+                                (self.ky // self.sliding[1]))
+
+    def numpy_fill_hits(self):
+        """Counts how many kernel applications cover each output element.
+        """
+        self.hits.map_invalidate()
+        ones = self.numpy_buffer(
+            "ones", (self._kernel_app_per_image, self._kernel_size),
+            self._dtype)
+        ones[:] = 1
+        hits = numpy.zeros((1,) + self._output_shape[1:], dtype=self._dtype)
+        self.numpy_pack(ones, hits)
+        self.hits.mem[:] = hits
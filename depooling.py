@@ -135,7 +135,11 @@ class Depooling(nn_units.Forward):
         self.execute_kernel(self._global_size, self._local_size)
 
     def numpy_run(self):
-        raise NotImplementedError()
+        self.input.map_read()
+        self.output_offset.map_read()
+        self.output.map_invalidate()
+        self.output.mem.fill(0)
+        numpy.put(self.output.mem, self.output_offset.mem, self.input.mem)
 
     def generate_data_for_slave(self):
         pass
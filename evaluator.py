@@ -38,6 +38,7 @@ under the License.
 
 from __future__ import division
 
+import json
 import numpy
 import six
 from zope.interface import implementer
@@ -45,7 +46,7 @@ from zope.interface import implementer
 from veles.distributable import TriviallyDistributable, IDistributable
 import veles.error as error
 from veles.loader import TEST
-from veles.memory import assert_addr, ravel, Array
+from veles.memory import assert_addr, Array
 from veles.accelerated_units import AcceleratedUnit, IOpenCLUnit, ICUDAUnit, \
     INumpyUnit
 from veles.normalization import NoneNormalizer
@@ -73,11 +74,16 @@ class EvaluatorsRegistry(UnitCommandLineArgumentsRegistry,
 class EvaluatorBase(AcceleratedUnit, TriviallyDistributable):
     hide_from_registry = True
     """Base class for evaluators.
+
+    Attributes:
+        merged_output_path: if set in testing mode, the merged output is
+            stored in this .npy file mapped into memory instead of RAM.
     """
     def __init__(self, workflow, **kwargs):
         kwargs["view_group"] = kwargs.get("view_group", "EVALUATOR")
         super(EvaluatorBase, self).__init__(workflow, **kwargs)
         self.mean = kwargs.get("mean", True)
+        self.merged_output_path = kwargs.get("merged_output_path")
         self.err_output = Array()
         self._merged_output = Array()
         self.krn_constants_i_ = None
@@ -108,8 +114,15 @@ class EvaluatorBase(AcceleratedUnit, TriviallyDistributable):
         super(EvaluatorBase, self).initialize(device, **kwargs)
         dtype = self.output.dtype
         if self.testing:
-            self._merged_output.reset(numpy.zeros(
-                (self.class_lengths[TEST],) + self.output.shape[1:], dtype))
+            shape = (self.class_lengths[TEST],) + self.output.shape[1:]
+            if self.merged_output_path is not None:
+                # The minibatches are written sequentially and the pages
+                # already written can be evicted by the OS
+                self._merged_output.reset(numpy.lib.format.open_memmap(
+                    self.merged_output_path, mode="w+", dtype=dtype,
+                    shape=shape))
+            else:
+                self._merged_output.reset(numpy.zeros(shape, dtype))
             return
 
         self.krn_constants_i_ = numpy.zeros(1, numpy.int32)
@@ -130,6 +143,11 @@ class EvaluatorBase(AcceleratedUnit, TriviallyDistributable):
         self.merged_output[self.offset - self.batch_size:self.offset] = \
             self.output[:self.batch_size]
 
+    def stop(self):
+        if self.testing and isinstance(self.merged_output, numpy.memmap):
+            self.merged_output.flush()
+        super(EvaluatorBase, self).stop()
+
     def get_metric_names(self):
         if self.testing:
             return {"Output"}
@@ -176,11 +194,15 @@ class EvaluatorSoftmax(EvaluatorBase):
         compute_confusion_matrix: compute confusion matrix or not.
         max_idx: indexes of element with maximum real value for each sample.
         max_err_output_sum: maximum of backpropagated error sum by sample.
+        output_labels_path: if set in testing mode, the recognized labels
+            are appended to this file as JSON lines after every minibatch
+            and get_metric_values() returns the path instead of the dict.
     """
     def __init__(self, workflow, **kwargs):
         super(EvaluatorSoftmax, self).__init__(workflow, **kwargs)
         self.compute_confusion_matrix = kwargs.get(
             "compute_confusion_matrix", True)
+        self.output_labels_path = kwargs.get("output_labels_path")
         self.confusion_matrix = Array()
         self.n_err = Array()
         self.max_err_output_sum = Array()
@@ -192,6 +214,8 @@ class EvaluatorSoftmax(EvaluatorBase):
     def initialize(self, device, **kwargs):
         super(EvaluatorSoftmax, self).initialize(device=device, **kwargs)
         if self.testing:
+            if self.output_labels_path is not None:
+                open(self.output_labels_path, "w").close()
             return
         self.sources_["evaluator"] = {}
 
@@ -276,57 +300,91 @@ class EvaluatorSoftmax(EvaluatorBase):
             vec.map_write()
 
         batch_size = self.batch_size
-        labels = self.labels.mem
-        confusion_matrix = self.confusion_matrix.mem
-
-        n_ok = 0
-        n_total = 0
+        labels = self.labels.mem[:batch_size]
+        max_idx = self.max_idx.mem[:batch_size]
+        # Samples with negative labels are skipped
+        skipped = labels < 0
+        samples = numpy.flatnonzero(~skipped)
+        labels = labels[samples]
+        max_idx = max_idx[samples]
+
+        if self.confusion_matrix:
+            confusion_matrix = self.confusion_matrix.mem
+            confusion_matrix += numpy.bincount(
+                max_idx * confusion_matrix.shape[1] + labels,
+                minlength=confusion_matrix.size).reshape(
+                confusion_matrix.shape).astype(confusion_matrix.dtype)
+        n_ok = numpy.count_nonzero(max_idx == labels)
+
+        # Compute softmax output error gradient
         multiplier = 1.0 / batch_size if self.mean else 1.0
-        for i in range(batch_size):  # loop by batch
-            if labels[i] < 0:
-                self.err_output.mem[i] = 0.0
-                continue
-            output = ravel(self.output[i])
-            err_output = ravel(self.err_output[i])
-
-            max_idx = self.max_idx[i]
-            confusion_matrix[max_idx, labels[i]] += 1
-            if max_idx == labels[i]:
-                n_ok += 1
-            n_total += 1
-
-            # Compute softmax output error gradient
-            err_output[:] = output[:]
-            err_output[labels[i]] -= 1.0
-            err_output *= multiplier
+        err_output = self.err_output.mem.reshape(
+            self.err_output.shape[0], -1)
+        output = self.output.mem.reshape(self.output.shape[0], -1)
+        err_output[:batch_size] = output[:batch_size]
+        err_output[samples, labels] -= 1.0
+        err_output[:batch_size] *= multiplier
+        err_output[:batch_size][skipped] = 0.0
+        # Set errors for excessive samples to zero
+        err_output[batch_size:] = 0.0
+
+        if samples.size > 0:
             if err_output.dtype in (numpy.complex64, numpy.complex128):
-                self.max_err_output_sum[0] = max(
-                    self.max_err_output_sum[0], numpy.linalg.norm(err_output))
+                err_sums = numpy.linalg.norm(err_output[samples], axis=1)
             else:
-                self.max_err_output_sum[0] = max(
-                    self.max_err_output_sum[0], (numpy.fabs(err_output)).sum())
-        # Set errors for excessive samples to zero
-        if batch_size < self.err_output.mem.shape[0]:
-            self.err_output.mem[batch_size:] = 0.0
+                err_sums = numpy.fabs(err_output[samples]).sum(axis=1)
+            self.max_err_output_sum[0] = max(
+                self.max_err_output_sum[0], err_sums.max())
         self.n_err[0] += batch_size - n_ok
-        self.n_err[1] += n_total
+        self.n_err[1] += samples.size
+
+    def merge_output(self):
+        super(EvaluatorSoftmax, self).merge_output()
+        if self.output_labels_path is None:
+            return
+        start = self.offset - self.batch_size
+        with open(self.output_labels_path, "a") as fout:
+            for key, label in zip(*self._output_labels(start, self.offset)):
+                fout.write(json.dumps({"key": self._to_json(key),
+                                       "label": self._to_json(label)}))
+                fout.write("\n")
+
+    @staticmethod
+    def _to_json(value):
+        """Converts the loader keys (e.g., LMDB (index, bytes) tuples) and
+        the labels (e.g., numpy integers) into JSON serializable values.
+        """
+        if isinstance(value, (tuple, list)):
+            return [EvaluatorSoftmax._to_json(v) for v in value]
+        if isinstance(value, bytes):
+            return value.decode("utf-8", "replace")
+        if isinstance(value, numpy.generic):
+            return value.item()
+        return value
+
+    def _output_labels(self, start, end):
+        """Returns the keys and the recognized labels of the merged output
+        samples in [start, end).
+        """
+        output = self.merged_output[start:end]
+        output = output.reshape(output.shape[0], -1)
+        # The last maximal value wins
+        max_indices = output.shape[1] - 1 - numpy.argmax(
+            output[:, ::-1], axis=1)
+        labels = [self.labels_mapping[i] for i in max_indices.tolist()]
+        class_keys = getattr(self, "class_keys", None)
+        if class_keys is not None:
+            keys = class_keys[TEST][start:end]
+        else:
+            keys = range(start, end)
+        return keys, labels
 
     def get_metric_values(self):
         if self.testing:
-            output_labels = {}
-            class_keys = getattr(self, "class_keys", None)
-            for index, labels in enumerate(self.merged_output[:]):
-                max_value = 0
-                for label_index, value in enumerate(labels):
-                    if value >= max_value:
-                        max_value = value
-                        max_index = label_index
-                if class_keys is not None:
-                    output_labels[self.class_keys[TEST][
-                        index]] = self.labels_mapping[max_index]
-                else:
-                    output_labels[index] = self.labels_mapping[max_index]
-            return {"Output": output_labels}
+            if self.output_labels_path is not None:
+                return {"Output": self.output_labels_path}
+            return {"Output": dict(zip(*self._output_labels(
+                0, len(self.merged_output))))}
         return {}
 
 
@@ -380,6 +438,12 @@ class EvaluatorMSE(EvaluatorBase):
         self.root = kwargs.get("root", True)
         self.demand("target", "normalizer")
 
+    def init_unpickled(self):
+        super(EvaluatorMSE, self).init_unpickled()
+        self._denormed_output_ = None
+        self._denormed_target_ = None
+        self._class_targets_norms_ = None
+
     @property
     def root(self):
         """
@@ -512,18 +576,27 @@ class EvaluatorMSE(EvaluatorBase):
         mse = self.mse.mem[:batch_size]
         assert_addr(mse, self.mse.mem)
 
-        err_output[:] = output - target
+        numpy.subtract(output, target, err_output)
         if not isinstance(self.normalizer, NoneNormalizer):
-            output_copy = output.copy()
-            target_copy = target.copy()
+            if self._denormed_output_ is None:
+                self._denormed_output_ = numpy.empty_like(
+                    self.err_output.matrix)
+                self._denormed_target_ = numpy.empty_like(
+                    self.err_output.matrix)
+            output_copy = self._denormed_output_[:batch_size]
+            target_copy = self._denormed_target_[:batch_size]
+            output_copy[:] = output
+            target_copy[:] = target
             self.normalizer.denormalize(output_copy)
             self.normalizer.denormalize(target_copy)
-            denormed_err_output = output_copy - target_copy
+            denormed_err_output = numpy.subtract(
+                output_copy, target_copy, output_copy)
         else:
             denormed_err_output = err_output
         self.err_output.mem[batch_size:] = 0
-        mse[:] = numpy.square(denormed_err_output).sum(axis=1) / \
-            denormed_err_output.shape[1]
+        numpy.einsum("ij,ij->i", denormed_err_output, denormed_err_output,
+                     out=mse)
+        mse /= denormed_err_output.shape[1]
         if self.mean:
             err_output /= batch_size
         if self.root:
@@ -539,18 +612,22 @@ class EvaluatorMSE(EvaluatorBase):
             self.labels.map_read()
             self.n_err.map_write()
             class_targets = self.class_targets.matrix
-            labels = self.labels.mem
-            for i, sample in enumerate(output):
-                lbl = numpy.linalg.norm(class_targets - sample,
-                                        axis=1).argmin()
-                if lbl != labels[i]:
-                    self.n_err.mem[0] += 1
-                self.n_err.mem[1] += 1
+            if self._class_targets_norms_ is None:
+                self._class_targets_norms_ = numpy.einsum(
+                    "ij,ij->i", class_targets, class_targets)
+            # ||t - o||^2 - ||o||^2 = ||t||^2 - 2 o.t has the same argmin
+            dists = numpy.dot(output, class_targets.transpose())
+            dists *= -2
+            dists += self._class_targets_norms_
+            closest = numpy.argmin(dists, axis=1)
+            self.n_err.mem[0] += numpy.count_nonzero(
+                closest != self.labels.mem[:batch_size])
+            self.n_err.mem[1] += batch_size
 
     def merge_output(self):
         if not isinstance(self.normalizer, NoneNormalizer):
             output = self.output[:self.batch_size].copy()
             self.normalizer.denormalize(output)
         else:
-            output = self.output.mem
+            output = self.output.mem[:self.batch_size]
         self.merged_output[self.offset - self.batch_size:self.offset] = output
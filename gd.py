@@ -67,6 +67,9 @@ AdaDeltaGDObjects = namedtuple("AdaDeltaGDObjects", ("momentum",
 AdaGradGDObjects = namedtuple("AdaGradGDObjects", ("epsilon",
                                                    "weights",
                                                    "bias"))
+AdamGDObjects = namedtuple("AdamGDObjects", ("beta1", "beta2", "epsilon",
+                                             "weights", "sweights",
+                                             "bias", "sbias"))
 
 
 @implementer(IOpenCLUnit, ICUDAUnit, INumpyUnit)
@@ -99,8 +102,7 @@ class GradientDescent(nn_units.GradientDescentBase):
         0- old (gradient ->l1l2->add moment->new moment->upd weights)
         1- new ( gradient-> new moment->l1l2->
             add( adadelta adagard,fast and t.d.)->upd weights)
-        2- TODO : NESTEROV
-        3- Sparsing (different ways)
+        2- Sparsing (different ways)
         self.variant_moment_gradient -
             variant of the method using a moment gradient
         gradient_weights_with_moment  -not the correct name
@@ -108,7 +110,7 @@ class GradientDescent(nn_units.GradientDescentBase):
         self.last_minibatch - need of loader
      """
     MAPPING = {"all2all"}
-    SOLVERS = ("momentum", "adagrad", "adadelta", "fast")
+    SOLVERS = ("momentum", "adagrad", "adadelta", "fast", "adam", "nesterov")
 
     @property
     def solvers(self):
@@ -118,6 +120,9 @@ class GradientDescent(nn_units.GradientDescentBase):
     def solvers(self, arr):
         if "adagrad" in arr and "adadelta" in arr:
             raise ValueError("This solver is not have adagrad and adadelta")
+        if "adam" in arr and ("adagrad" in arr or "adadelta" in arr):
+            raise ValueError("adam can not be combined with adagrad or "
+                             "adadelta")
         solvers = set()
         for value in arr:
             if value not in self.SOLVERS:
@@ -167,6 +172,16 @@ class GradientDescent(nn_units.GradientDescentBase):
                 kwargs.get("adagrad_epsilon", 1e-8),
                 Array(), Array())
 
+        if "adam" in self.solvers:
+            self.adam = AdamGDObjects(
+                kwargs.get("adam_beta1", 0.9),
+                kwargs.get("adam_beta2", 0.999),
+                kwargs.get("adam_epsilon", 1e-8),
+                Array(), Array(),
+                Array(), Array())
+            # The number of the applied steps for the bias correction
+            self.adam_steps = {"weights": 0, "bias": 0}
+
         self.last_minibatch = kwargs.get("last_minibatch", False)
 
     def initialize(self, device, **kwargs):
@@ -202,7 +217,19 @@ class GradientDescent(nn_units.GradientDescentBase):
         if "adagrad" in self.solvers:
             self.init_vectors(self.adagrad.weights, self.adagrad.bias)
 
-        if (any(s in self.solvers for s in ("fast", "adagrad", "adadelta")) and
+        if "adam" in self.solvers:
+            # The state is kept if it was restored from a snapshot
+            for vec, like in ((self.adam.weights, self.weights),
+                              (self.adam.sweights, self.weights),
+                              (self.adam.bias, self.bias),
+                              (self.adam.sbias, self.bias)):
+                if not vec or vec.shape != like.shape:
+                    vec.reset(numpy.zeros_like(like.mem))
+            self.init_vectors(self.adam.weights, self.adam.sweights,
+                              self.adam.bias, self.adam.sbias)
+
+        if (any(s in self.solvers for s in (
+                "fast", "adagrad", "adadelta", "nesterov")) and
                 not self.gradient_weights_with_moment):
             raise ValueError("Some of the solvers need moment vectors")
 
@@ -237,13 +264,18 @@ class GradientDescent(nn_units.GradientDescentBase):
 
         self.sources_["all2all/gradient_descent/weights_update"] = {
             "USE_ORTHO": int(bool(self.factor_ortho)),
-            "USE_MOMENT": int(bool(self.gradient_weights_with_moment))
+            "USE_MOMENT": int(bool(self.gradient_weights_with_moment)),
+            "USE_NESTEROV": int("nesterov" in self.solvers),
+            "USE_ADAM": int("adam" in self.solvers)
         }
 
         self.sources_["all2all/gradient_descent/bias_update"] = {
             "BIAS_SIZE": side,
             "OUTPUT_SIZE": batch,
-            "USE_MOMENT": int(bool(self.gradient_bias_with_moment))
+            "USE_MOMENT": int(bool(self.gradient_bias_with_moment)),
+            "USE_NESTEROV": int("nesterov" in self.solvers),
+            "USE_ADAM": int("adam" in self.solvers),
+            "PRECOMPUTED_GRADIENT": int(self.accumulate_steps > 1)
         }
 
         self.build_program(defines, "%s_%d_%d_%d" % (
@@ -271,6 +303,20 @@ class GradientDescent(nn_units.GradientDescentBase):
                                                 self.col_sums.devmem)
             self.krn_weights_.set_arg(13, self.col_sums.devmem)
 
+        if "adam" in self.solvers:
+            # Adam's arguments follow the ones of orthogonalization
+            self._adam_const = {"weights": numpy.zeros(4, dtype=dtype),
+                                "bias": numpy.zeros(4, dtype=dtype)}
+            self._adam_arg_index = {
+                "weights": (self.krn_weights_,
+                            14 if self.factor_ortho else 12),
+                "bias": (self.krn_bias_, 13)}
+            for s, (kernel, index) in self._adam_arg_index.items():
+                if kernel is not None:
+                    kernel.set_arg(index, getattr(self.adam, s).devmem)
+                    kernel.set_arg(index + 1,
+                                   getattr(self.adam, "s" + s).devmem)
+
     def ocl_init(self):
         ocl_blas.OCLBLAS.attach_to_device(self.device)
         self._gpu_init(ocl_blas.OCLBLAS)
@@ -312,25 +358,58 @@ class GradientDescent(nn_units.GradientDescentBase):
         self._global_size_ortho = (other, 1, 1)
         self._local_size_ortho = (self.reduce_size, 1, 1)
 
-    def moment_use(self, gradient_w_moment, grad):
-        if gradient_w_moment:
-            if self.variant_moment_gradient:
-                gradients = (grad +
-                             gradient_w_moment.mem * self.gradient_moment)
-            else:
-                gradients = (
-                    (1 - self.gradient_moment) * grad +
-                    gradient_w_moment.mem * self.gradient_moment)
-            gradient_w_moment.mem[:] = gradients[:]
+    def accumulate_gradient_inplace(self, accumulated_gradient, gradient,
+                                    scratch):
+        """The same as accumulate_gradient_f(), but updates gradient in place.
+        """
+        if not accumulated_gradient or not self.accumulate_gradient:
+            return
+        acc = accumulated_gradient.mem
+        if self.acc_beta:
+            numpy.multiply(gradient, self.acc_alpha, out=scratch)
+            acc *= self.acc_beta
+            acc += scratch
+        else:
+            numpy.multiply(gradient, self.acc_alpha, out=acc)
+        gradient *= self.gd_beta
+        numpy.multiply(acc, self.gd_alpha, out=scratch)
+        gradient += scratch
+
+    def moment_use(self, gradient_w_moment, grad, scratch,
+                   gradient_moment=None):
+        """Updates the moment with grad. gradient_moment defaults to
+        self.gradient_moment.
+
+        Returns:
+            The moment or grad if there is no moment. With Nesterov's
+            momentum, grad plus the moment multiplied by gradient_moment,
+            computed in place of grad.
+        """
+        if not gradient_w_moment:
+            return grad
+        if gradient_moment is None:
+            gradient_moment = self.gradient_moment
+        moment = gradient_w_moment.mem
+        moment *= gradient_moment
+        if self.variant_moment_gradient:
+            moment += grad
         else:
-            gradients = grad
-        return gradients
+            numpy.multiply(grad, 1 - gradient_moment, out=scratch)
+            moment += scratch
+        if "nesterov" in self.solvers:
+            numpy.multiply(moment, gradient_moment, out=scratch)
+            grad += scratch
+            return grad
+        return moment
 
     def apply_gradient_f(self, gradient, vec, transposed):
         if self.apply_gradient:
             vec.mem += gradient
 
     def numpy_update(self, s):
+        """Applies the gradient of s ("weights" or "bias"). All the stages
+        work in place on the buffers from numpy_scratch().
+        """
         f_ortho_use = False if s == 'bias' else self.factor_ortho
 
         if s == 'weights':
@@ -352,72 +431,152 @@ class GradientDescent(nn_units.GradientDescentBase):
         grad_vec = getattr(self, "gradient_" + s)
         acc_vec = getattr(self, "accumulated_gradient_" + s)
         vec_old = getattr(self, "gradient_%s_with_moment" % s)
-        if "fast" in self.solvers:
-            f_vec = getattr(self.fast, s)
-        if "adagrad" in self.solvers:
-            adagard_vec = getattr(self.adagrad, s)
-        if "adadelta" in self.solvers:
-            adadelta_vec = getattr(self.adadelta, s)
-            adadelta_gvec = getattr(self.adadelta, "g" + s)
 
-        lr = self.learning_rate
-        factor_l12 = self.weights_decay
-        l1_vs_l2 = self.l1_vs_l2
+        # The same hyperparameters as the kernels and the master use
+        if s == 'bias':
+            lr = self.learning_rate_bias
+            factor_l12 = self.weights_decay_bias
+            l1_vs_l2 = self.l1_vs_l2_bias
+            moment = self.gradient_moment_bias
+        else:
+            lr = self.learning_rate
+            factor_l12 = self.weights_decay
+            l1_vs_l2 = self.l1_vs_l2
+            moment = self.gradient_moment
 
+        buffer = self.numpy_scratch(s, "gradient", vec.mem)
+        scratch = self.numpy_scratch(s, "scratch", vec.mem)
         if self.variant_gradient:
-            gradient = -nn_units.GradientDescentBase.numpy_gradient_step(
+            gradient = nn_units.GradientDescentBase.numpy_gradient_step(
                 vec.mem, grad_vec.mem, lr, factor_l12, l1_vs_l2, f_ortho_use,
-                v_trans)
-            gradient = self.accumulate_gradient_f(acc_vec, gradient)
+                v_trans, out=buffer, scratch=scratch)
+            numpy.negative(gradient, out=gradient)
+            self.accumulate_gradient_inplace(acc_vec, gradient, scratch)
             # if "momentum" in self.solvers:
-            gradient = self.moment_use(vec_old, gradient)
+            gradient = self.moment_use(vec_old, gradient, scratch,
+                                       moment)
         else:
             # it is RNN
-            gradient = self.accumulate_gradient_f(acc_vec, grad_vec)
-
-            gradient = self.moment_use(vec_old, gradient)
-            gradient = -nn_units.GradientDescentBase.numpy_gradient_step(
+            gradient = grad_vec.mem
+            if ((acc_vec and self.accumulate_gradient) or
+                    "nesterov" in self.solvers):
+                buffer[:] = gradient
+                gradient = buffer
+                self.accumulate_gradient_inplace(acc_vec, gradient, scratch)
+            gradient = self.moment_use(vec_old, gradient, scratch,
+                                       moment)
+            gradient = nn_units.GradientDescentBase.numpy_gradient_step(
                 vec.mem, gradient, lr, factor_l12, l1_vs_l2, f_ortho_use,
-                v_trans)
+                v_trans, scratch=scratch, out=buffer
+                if gradient is not buffer else
+                self.numpy_scratch(s, "gradient_step", vec.mem))
+            numpy.negative(gradient, out=gradient)
+        # The adaptive solvers must not change the moment
+        out = buffer if gradient is not buffer and (
+            not vec_old or gradient is vec_old.mem) else gradient
         if "adagrad" in self.solvers:
-            gradient = self.apply_adagrad(adagard_vec, vec_old, gradient)
+            gradient = self.apply_adagrad(
+                getattr(self.adagrad, s), vec_old, gradient, out, scratch)
         if "adadelta" in self.solvers:
-            gradient = self.apply_adadelta(adadelta_vec, adadelta_gvec,
-                                           vec_old, gradient)
+            gradient = self.apply_adadelta(
+                s, getattr(self.adadelta, s), getattr(self.adadelta, "g" + s),
+                vec_old, gradient, out, scratch)
+        if "adam" in self.solvers and self.apply_gradient:
+            gradient = self.apply_adam(s, gradient, out, scratch, lr)
         if "fast" in self.solvers:
-            self.apply_fast(f_vec, vec_old)
+            f_vec = getattr(self.fast, s)
+            self.apply_fast(f_vec, vec_old, scratch)
 
         self.apply_gradient_f(gradient, vec, v_trans)
 
         if "fast" in self.solvers and self.apply_gradient and not v_trans:
             vec.mem -= f_vec.mem
 
-    def apply_fast(self, f_vec, vec_old):
+    def apply_fast(self, f_vec, vec_old, scratch):
         f_vec.mem *= 0.95
-        f_vec.mem[:] = f_vec + self.fast.learning_rate * vec_old.mem
+        numpy.multiply(vec_old.mem, self.fast.learning_rate, out=scratch)
+        f_vec.mem += scratch
 
-    def apply_adagrad(self, adagard_vec, vec_old, gradient):
+    def apply_adagrad(self, adagard_vec, vec_old, gradient, out, scratch):
         adagard_vec.map_write()
-        adagard_vec.mem += (vec_old.mem ** 2)
-        adagard_vec.map_read()
-        gradient *= numpy.sqrt(adagard_vec.mem + self.adagrad.epsilon)
-
-        return gradient
-
-    def apply_adadelta(self, adadelta_vec, adadelta_gvec, vec_old, gradient):
+        numpy.square(vec_old.mem, out=scratch)
+        adagard_vec.mem += scratch
+        numpy.add(adagard_vec.mem, self.adagrad.epsilon, out=scratch)
+        numpy.sqrt(scratch, out=scratch)
+        return numpy.multiply(gradient, scratch, out=out)
+
+    def apply_adadelta(self, s, adadelta_vec, adadelta_gvec, vec_old,
+                       gradient, out, scratch):
         adadelta_vec.map_write()
         adadelta_gvec.map_write()
-        adadelta_gvec.mem = (self.adadelta.adom * adadelta_gvec.mem +
-                             (1 - self.adadelta.adom) * vec_old.mem ** 2)
-        s1, s2 = (numpy.sqrt(m.mem + self.adadelta.epsilon)
-                  for m in (adadelta_vec, adadelta_gvec))
-        gradient *= s1 / s2
-        adadelta_vec.mem = (self.adadelta_adom * adadelta_vec.mem +
-                            (1 - self.adadelta_adom) * gradient ** 2)
+        numpy.square(vec_old.mem, out=scratch)
+        scratch *= 1 - self.adadelta.adom
+        adadelta_gvec.mem *= self.adadelta.adom
+        adadelta_gvec.mem += scratch
+        s2 = out if out is not gradient else self.numpy_scratch(
+            s, "adadelta", gradient)
+        for m, sqrt in ((adadelta_vec, scratch), (adadelta_gvec, s2)):
+            numpy.add(m.mem, self.adadelta.epsilon, out=sqrt)
+            numpy.sqrt(sqrt, out=sqrt)
+        scratch /= s2
+        gradient = numpy.multiply(gradient, scratch, out=out)
+        numpy.square(gradient, out=scratch)
+        scratch *= 1 - self.adadelta_adom
+        adadelta_vec.mem *= self.adadelta_adom
+        adadelta_vec.mem += scratch
         self.adadelta_adom = 0 if (
             self.last_minibatch) else self.adadelta.momentum
         return gradient
 
+    def adam_learning_rate(self, s, lr):
+        """Counts the next Adam's step of s.
+
+        Returns:
+            lr with the bias correction of the moments.
+        """
+        self.adam_steps[s] += 1
+        step = self.adam_steps[s]
+        return lr * numpy.sqrt(1 - self.adam.beta2 ** step) / (
+            1 - self.adam.beta1 ** step)
+
+    def apply_adam(self, s, gradient, out, scratch, lr):
+        """Updates Adam's moments of s with gradient (which is already
+        multiplied by -lr, hence epsilon is too) and computes the step in
+        out.
+        """
+        first, second = getattr(self.adam, s), getattr(self.adam, "s" + s)
+        first.map_write()
+        second.map_write()
+        adam_lr = self.adam_learning_rate(s, lr)
+        first.mem *= self.adam.beta1
+        numpy.multiply(gradient, 1 - self.adam.beta1, out=scratch)
+        first.mem += scratch
+        second.mem *= self.adam.beta2
+        numpy.square(gradient, out=scratch)
+        scratch *= 1 - self.adam.beta2
+        second.mem += scratch
+        numpy.sqrt(second.mem, out=scratch)
+        scratch += lr * self.adam.epsilon
+        numpy.divide(first.mem, scratch, out=out)
+        out *= adam_lr
+        return out
+
+    def gpu_adam_update(self, s, lr):
+        """Sets Adam's constants of the kernel which updates s.
+        """
+        if "adam" not in self.solvers:
+            return
+        self.unmap_vectors(getattr(self.adam, s),
+                           getattr(self.adam, "s" + s))
+        # The kernel ignores Adam if the gradient is not applied
+        const = self._adam_const[s]
+        const[:] = (self.adam.beta1, self.adam.beta2, self.adam.epsilon,
+                    self.adam_learning_rate(s, lr)
+                    if self.apply_gradient else 0)
+        kernel, index = self._adam_arg_index[s]
+        kernel.set_args(self.device.skip(index + 2), const[0:1], const[1:2],
+                        const[2:3], const[3:4])
+
     def numpy_weights_update(self):
         if not self.need_gradient_weights:
             return
@@ -433,12 +592,15 @@ class GradientDescent(nn_units.GradientDescentBase):
             self.input.mem, [self.input.shape[0], self.input.sample_size])
 
         self.gradient_weights.map_write()
+        gradient = self.minibatch_gradient("weights")
         if self.weights_transposed:
-            numpy.dot(inp.transpose(), err_output, self.gradient_weights.mem)
+            numpy.dot(inp.transpose(), err_output, gradient)
         else:
-            numpy.dot(err_output.transpose(), inp, self.gradient_weights.mem)
+            numpy.dot(err_output.transpose(), inp, gradient)
 
-        self.numpy_update('weights')
+        self.average_gradient("weights", gradient)
+        if self.accumulation_complete:
+            self.numpy_update('weights')
 
     def numpy_bias_update(self):
         if not self.need_gradient_weights or not self.include_bias:
@@ -446,9 +608,12 @@ class GradientDescent(nn_units.GradientDescentBase):
         self.err_output.map_read()
 
         self.gradient_bias.map_write()
-        self.gradient_bias.mem[:] = self.err_output.mem.sum(axis=0)
+        gradient = self.minibatch_gradient("bias")
+        gradient[:] = self.err_output.mem.sum(axis=0)
 
-        self.numpy_update('bias')
+        self.average_gradient("bias", gradient)
+        if self.accumulation_complete:
+            self.numpy_update('bias')
 
     def numpy_err_input_update(self):
         """Backpropagate error (will compute err_input).
@@ -527,8 +692,7 @@ class GradientDescent(nn_units.GradientDescentBase):
 
         self.unmap_vectors(self.err_output, self.gradient_weights, self.input)
 
-        self.np_alpha[0] = 1.0
-        self.np_beta[0] = 0.0
+        self.np_alpha[0], self.np_beta[0] = self.accumulation_factors
 
         if self.weights_transposed:
             self.gemm_(
@@ -545,9 +709,49 @@ class GradientDescent(nn_units.GradientDescentBase):
                 self.np_alpha, self.input.devmem, self.err_output.devmem,
                 self.np_beta, self.gradient_weights.devmem)
 
+        if not self.accumulation_complete:
+            return
+
         # Accumulate/apply gradient
+        self.gpu_adam_update("weights", self.learning_rate)
         super(GradientDescent, self).gpu_weights_update()
 
+    def gpu_bias_update(self):
+        if (self.need_gradient_weights and self.include_bias and
+                self.accumulation_complete):
+            self.gpu_adam_update("bias", self.learning_rate_bias)
+        super(GradientDescent, self).gpu_bias_update()
+
+    def apply_data_from_slave(self, data, slave):
+        if "adam" not in self.solvers and "nesterov" not in self.solvers:
+            super(GradientDescent, self).apply_data_from_slave(data, slave)
+            return
+        # The master applies the momentum and the solvers to the gradients
+        # from the slaves, so the state of the solvers is kept here
+        for s, gradient, moment, lr in (
+                ("weights", data[0], self.gradient_moment,
+                 self.learning_rate),
+                ("bias", data[1], self.gradient_moment_bias,
+                 self.learning_rate_bias)):
+            vec = getattr(self, s)
+            if not vec:
+                continue
+            vec.map_write()
+            vec_old = getattr(self, "gradient_%s_with_moment" % s)
+            vec_old.map_write()
+            vec_old.mem *= moment
+            vec_old.mem += gradient
+            step = vec_old.mem
+            buffer = self.numpy_scratch(s, "gradient", vec.mem)
+            scratch = self.numpy_scratch(s, "scratch", vec.mem)
+            if "nesterov" in self.solvers:
+                numpy.multiply(step, moment, out=buffer)
+                buffer += gradient
+                step = buffer
+            if "adam" in self.solvers:
+                step = self.apply_adam(s, step, buffer, scratch, lr)
+            vec.mem += step
+
 
 class GDSoftmax(GradientDescent):
     """Gradient Descent for :class:`veles.znicz.all2all.All2AllSoftmax`.
@@ -44,12 +44,10 @@ under the License.
 from __future__ import division
 
 import cuda4py.blas as cublas
-from itertools import product
 import numpy
 from zope.interface import implementer
 
 import veles.error as error
-from veles.memory import reshape_transposed
 from veles.accelerated_units import IOpenCLUnit, ICUDAUnit, INumpyUnit
 import veles.ocl_blas as ocl_blas
 from veles.znicz.conv import ConvolutionalBase
@@ -86,9 +84,13 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
         n_kernels: number of convolutional kernels.
         kx: kernel width.
         ky: kernel height.
+        err_input_engine: CPU algorithm of err_input computation: "gemm"
+            (unpacked GEMM followed by col2im) or "fft" (convolution in
+            the frequency domain, pays off for large kernels).
     """
 
     MAPPING = {"conv"}
+    ERR_INPUT_ENGINES = ("gemm", "fft")
 
     def __init__(self, workflow, **kwargs):
         super(GradientDescentConv, self).__init__(workflow, **kwargs)
@@ -104,6 +106,13 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
         if self.include_bias:
             self.demand("bias")
 
+        # CPU err_input algorithm: "gemm" (col2im) or "fft"
+        self.err_input_engine = kwargs.get("err_input_engine", "gemm")
+        if self.err_input_engine not in self.ERR_INPUT_ENGINES:
+            raise ValueError(
+                "Unsupported err_input_engine: %s. Select one of %s." %
+                (self.err_input_engine, ", ".join(self.ERR_INPUT_ENGINES)))
+
     def initialize(self, device, **kwargs):
         super(GradientDescentConv, self).initialize(device=device, **kwargs)
 
@@ -157,7 +166,8 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
         self.sources_["all2all/gradient_descent/bias_update"] = {
             "BIAS_SIZE": self.n_kernels,
             "OUTPUT_SIZE": self._kernel_app_total,
-            "USE_MOMENT": int(bool(self.gradient_moment_bias))
+            "USE_MOMENT": int(bool(self.gradient_moment_bias)),
+            "PRECOMPUTED_GRADIENT": int(self.accumulate_steps > 1)
         }
 
         defines = {
@@ -225,6 +235,9 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
         self.gemm_ = blas_class.gemm(self._dtype)
         self.np_one = numpy.ones(1, dtype=self._dtype)
         self.np_zero = numpy.zeros(1, dtype=self._dtype)
+        # The factors of the gradient averaging (accumulation_factors)
+        self.np_alpha = numpy.ones(1, dtype=self._dtype)
+        self.np_beta = numpy.zeros(1, dtype=self._dtype)
         self._const_i = numpy.zeros(2, dtype=numpy.int64)
 
     def ocl_init(self):
@@ -381,6 +394,7 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
             return
         self.unmap_vectors(self.err_output, self.input, self.gradient_weights)
         unpack_data = self.device.get_temp_buffer()
+        self.np_alpha[0], self.np_beta[0] = self.accumulation_factors
 
         # Calculate weights gradient: err_output * input
         for i in range(0, self._batch_size, self.unpack_size):
@@ -411,15 +425,15 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
                 self.n_kernels, self._kernel_size, unpack_side,
-                self.np_one, int(self.err_output.devmem) + output_offs,
-                unpack_data, self.np_one if start_image else self.np_zero,
+                self.np_alpha, int(self.err_output.devmem) + output_offs,
+                unpack_data, self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem)
         else:
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
-                self._kernel_size, self.n_kernels, unpack_side, self.np_one,
+                self._kernel_size, self.n_kernels, unpack_side, self.np_alpha,
                 unpack_data, int(self.err_output.devmem) + output_offs,
-                self.np_one if start_image else self.np_zero,
+                self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem)
 
     def _ocl_process_weights_subblock(self, start_image, image_count,
@@ -439,15 +453,15 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
                 self.n_kernels, self._kernel_size, unpack_side,
-                self.np_one, self.err_output.devmem,
-                unpack_data, self.np_one if start_image else self.np_zero,
+                self.np_alpha, self.err_output.devmem,
+                unpack_data, self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem, offsetA=output_offs)
         else:
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
-                self._kernel_size, self.n_kernels, unpack_side, self.np_one,
+                self._kernel_size, self.n_kernels, unpack_side, self.np_alpha,
                 unpack_data, self.err_output.devmem,
-                self.np_one if start_image else self.np_zero,
+                self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem, offsetB=output_offs)
 
     def numpy_weights_update(self):
@@ -459,60 +473,33 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
         self.gradient_weights.map_write()
         self.accumulated_gradient_weights.map_write()
 
-        dtype = self.weights.dtype
-        sy = self.input.shape[1]
-        sx = self.input.shape[2]
-        n_channels = self.input.size // (self.input.shape[0] * sx * sy)
-
-        sx_full = self.padding[0] + sx + self.padding[2]
-        sy_full = self.padding[1] + sy + self.padding[3]
-        nx = (sx_full - self.kx) // self.sliding[0] + 1
-        ny = (sy_full - self.ky) // self.sliding[1] + 1
-        sample_shape = (nx * ny, self.kx * self.ky * n_channels)
-
-        sh = self.err_output.shape
-        if len(sh) == 3:
-            sh[1] *= sh[2]
-            sh[2] = 1
-
-        # calculate gradient for weights
-        gd_weights = (reshape_transposed(self.gradient_weights.mem)
-                      if self.weights_transposed
-                      else self.gradient_weights.mem)
-        gd_weights[:] = 0
-        cut = numpy.empty((self.ky, self.kx, n_channels), dtype=dtype)
-        sample = numpy.empty(sample_shape, dtype=dtype)
-        for batch in range(self.current_batch_size):
-            # input data unrolling
-            sample = numpy.empty(sample_shape)
-            for by, bx in ((by, bx) for by in range(ny) for bx in range(nx)):
-                y1, y2 = (by * self.sliding[1],
-                          by * self.sliding[1] + self.ky)
-                x1, x2 = (bx * self.sliding[0],
-                          bx * self.sliding[0] + self.kx)
-                i1, i2 = (min(max(y1 - self.padding[1], 0), sy),
-                          min(max(y2 - self.padding[1], 0), sy))
-                j1, j2 = (min(max(x1 - self.padding[0], 0), sx),
-                          min(max(x2 - self.padding[0], 0), sx))
-                cut_i1, cut_i2 = (i1 - y1 + self.padding[1],
-                                  i2 - y1 + self.padding[1])
-                cut_j1, cut_j2 = (j1 - x1 + self.padding[0],
-                                  j2 - x1 + self.padding[0])
-                cut = numpy.zeros((self.ky, self.kx, n_channels),
-                                  dtype=self.input.mem.dtype)
-                cut[cut_i1:cut_i2, cut_j1:cut_j2, :] = \
-                    self.input.mem[batch, i1:i2, j1:j2, :].reshape(i2 - i1,
-                                                                   j2 - j1,
-                                                                   n_channels)
-                sample[by * nx + bx] = cut.ravel()
-            err_out_shape = self.err_output.mem.shape
-            out = self.err_output.mem[batch].reshape(err_out_shape[1] *
-                                                     err_out_shape[2],
-                                                     self.n_kernels)
-            gd_weights += numpy.dot(out.transpose(),
-                                    sample)
-        if self.weights_transposed:
-            gd_weights = reshape_transposed(gd_weights)
+        # calculate gradient for weights: err_output * unpacked input
+        gd_weights = self.minibatch_gradient("weights")
+        err_output = self.err_output.mem.reshape(
+            self._batch_size * self._kernel_app_per_image, self.n_kernels)
+        batch_size = self.current_batch_size
+        for i in range(0, batch_size, self.unpack_size):
+            count = min(batch_size - i, self.unpack_size)
+            unpack_side = count * self._kernel_app_per_image
+            unpack_data = self.numpy_buffer(
+                "unpack_data", (unpack_side, self._kernel_size), self._dtype)
+            self.numpy_unpack(self.input.mem[i:i + count], unpack_data)
+            out = err_output[i * self._kernel_app_per_image:
+                             i * self._kernel_app_per_image + unpack_side]
+            a, b = ((unpack_data.transpose(), out) if self.weights_transposed
+                    else (out.transpose(), unpack_data))
+            if not i:
+                numpy.dot(a, b, gd_weights)
+                continue
+            block = self.numpy_buffer(
+                "gradient_weights_block", gd_weights.shape, self._dtype)
+            numpy.dot(a, b, block)
+            gd_weights += block
+
+        self.average_gradient("weights", gd_weights)
+        if not self.accumulation_complete:
+            return
+        gd_weights = self.gradient_weights.mem
 
         # update weights
         lr = self.learning_rate
@@ -545,13 +532,17 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
         err_out_shape = self.err_output.mem.shape
 
         # calculate gradient for bias
-        gd_bias = self.gradient_bias.mem
+        gd_bias = self.minibatch_gradient("bias")
         gd_bias[:] = 0
         for batch in range(self.current_batch_size):
             out = self.err_output.mem[batch].reshape(err_out_shape[1] *
                                                      err_out_shape[2],
                                                      self.n_kernels)
             gd_bias += numpy.add.reduce(out)
+        self.average_gradient("bias", gd_bias)
+        if not self.accumulation_complete:
+            return
+        gd_bias = self.gradient_bias.mem
         # update bias
         lr = self.learning_rate_bias
         factor_l12 = self.weights_decay_bias
@@ -577,47 +568,74 @@ class GradientDescentConv(ConvolutionalBase, nn_units.GradientDescentBase):
         if not self.need_err_input:
             return
 
-        from scipy.signal import convolve2d
-
-        self.err_input.map_invalidate()
+        self.err_input.map_write()
         self.err_output.map_read()
         self.weights.map_read()
 
-        batch_size = self.input.mem.shape[0]
-        sy = self.input.mem.shape[1]
-        sx = self.input.mem.shape[2]
-        n_channels = self.input.mem.size // (batch_size * sx * sy)
-        sx_full = self.padding[0] + sx + self.padding[2]
-        sy_full = self.padding[1] + sy + self.padding[3]
-
-        weights = (reshape_transposed(self.weights.mem)
-                   if self.weights_transposed else self.weights.mem)
-
         if not self.err_input_beta:
             self.err_input.mem[:] = 0
         else:
             self.err_input.mem *= self.err_input_beta
-        err_input = numpy.zeros_like(self.err_input.mem)
-        # initialize sparse output error
-        sparse_err_output = numpy.zeros((
-            batch_size, sy_full - self.ky + 1, sx_full - self.kx + 1,
-            self.n_kernels), dtype=self.err_output.dtype)
-        for (batch, i, j, k), err in numpy.ndenumerate(self.err_output.mem):
-            sparse_err_output[batch, i * self.sliding[1],
-                              j * self.sliding[0], k] = err
-        err_sample = numpy.zeros(
-            (sy_full - self.ky + 1, sx_full - self.kx + 1),
-            dtype=err_input.dtype)
-        for batch, k in product(range(batch_size), range(self.n_kernels)):
-            err_sample[:] = sparse_err_output[batch, :, :, k]
-            cur_kernel = weights[k].reshape(self.ky, self.kx, n_channels)
-            for ch in range(n_channels):
-                err_input_full = convolve2d(err_sample, cur_kernel[:, :, ch],
-                                            mode='full')
-                err_input[batch, :, :, ch] += \
-                    err_input_full[self.padding[1]:(sy_full - self.padding[3]),
-                                   self.padding[0]:(sx_full - self.padding[2])]
-        self.err_input.mem += err_input * self.err_input_alpha
+
+        weights = (self.weights.mem.transpose() if self.weights_transposed
+                   else self.weights.mem)
+        err_output = self.err_output.mem.reshape(
+            self._batch_size * self._kernel_app_per_image, self.n_kernels)
+        if self.err_input_engine == "fft":
+            kernels_fft = numpy.fft.rfft2(
+                weights.reshape(self.n_kernels, self.ky, self.kx,
+                                self._n_channels),
+                s=self._full_image_shape, axes=(1, 2))
+            # (sy_full, sx_full // 2 + 1, n_kernels, n_channels)
+            kernels_fft = kernels_fft.transpose(1, 2, 0, 3)
+        for i in range(0, self._batch_size, self.unpack_size):
+            count = min(self._batch_size - i, self.unpack_size)
+            unpack_side = count * self._kernel_app_per_image
+            out = err_output[i * self._kernel_app_per_image:
+                             i * self._kernel_app_per_image + unpack_side]
+            err_input = self.err_input.mem[i:i + count]
+            if self.err_input_engine == "fft":
+                self._numpy_err_input_fft(out, kernels_fft, err_input)
+                continue
+            unpack_data = self.numpy_buffer(
+                "unpack_data", (unpack_side, self._kernel_size), self._dtype)
+            numpy.dot(out, weights, unpack_data)
+            if self.err_input_alpha != 1:
+                unpack_data *= self.err_input_alpha
+            self.numpy_pack(unpack_data, err_input)
+
+    @property
+    def _full_image_shape(self):
+        return (self.padding[1] + self._sy + self.padding[3],
+                self.padding[0] + self._sx + self.padding[2])
+
+    def _numpy_err_input_fft(self, err_output, kernels_fft, err_input):
+        """Computes err_input as the full convolution of the dilated
+        err_output with the kernels in the frequency domain.
+        """
+        count = err_input.shape[0]
+        sy_full, sx_full = self._full_image_shape
+        ky_app, kx_app = self.numpy_kernel_app
+        sparse_err_output = self.numpy_buffer(
+            "sparse_err_output", (count, sy_full - self.ky + 1,
+                                  sx_full - self.kx + 1, self.n_kernels),
+            self._dtype)
+        sparse_err_output[:, ::self.sliding[1], ::self.sliding[0]] = \
+            err_output.reshape(count, ky_app, kx_app, self.n_kernels)
+        err_output_fft = numpy.fft.rfft2(
+            sparse_err_output, s=self._full_image_shape, axes=(1, 2))
+        # sum over kernels for every frequency at once
+        err_input_fft = numpy.matmul(
+            err_output_fft[:, :, :, numpy.newaxis, :], kernels_fft)[
+            :, :, :, 0, :]
+        err_input_full = numpy.fft.irfft2(
+            err_input_fft, s=self._full_image_shape, axes=(1, 2))
+        err_input_full *= self.err_input_alpha
+        err_input = err_input.reshape(
+            count, self._sy, self._sx, self._n_channels)
+        err_input += err_input_full[
+            :, self.padding[1]:self.padding[1] + self._sy,
+            self.padding[0]:self.padding[0] + self._sx]
 
     def gpu_run(self):
         """Do gradient descent for OpenCL and CUDA.
@@ -156,6 +156,9 @@ class GDDeconv(ConvolutionalBase, nn_units.GradientDescentBase):
             self.hits.initialize(self.device)
 
         self._batch_size = self.err_output.shape[0]
+        self._sy, self._sx = sy, sx
+        self._n_channels = self.channels_number
+        self._dtype = self.err_output.dtype
         self._kernel_app_per_image = self.input.sample_size // self.n_kernels
         self._kernel_app_total = (self._kernel_app_per_image *
                                   self.input.shape[0])
@@ -234,7 +237,9 @@ class GDDeconv(ConvolutionalBase, nn_units.GradientDescentBase):
 
         self.gemm_ = blas_class.gemm(dtype)
         self.np_one = numpy.ones(1, dtype=dtype)
-        self.np_zero = numpy.zeros(1, dtype=dtype)
+        # The factors of the gradient averaging (accumulation_factors)
+        self.np_alpha = numpy.ones(1, dtype=dtype)
+        self.np_beta = numpy.zeros(1, dtype=dtype)
         self._const_i = numpy.zeros(1, dtype=numpy.int64)
         self.np_err_input_alpha = numpy.ones(1, dtype=dtype)
         self.np_err_input_beta = numpy.zeros(1, dtype=dtype)
@@ -311,6 +316,7 @@ class GDDeconv(ConvolutionalBase, nn_units.GradientDescentBase):
         self.unmap_vectors(self.err_input, self.weights, self.err_output,
                            self.gradient_weights)
         unpack_data = self.device.get_temp_buffer()
+        self.np_alpha[0], self.np_beta[0] = self.accumulation_factors
         for i in range(0, self._batch_size, self.unpack_size):
             self._process_subblock(
                 i, min(self._batch_size - i, self.unpack_size), unpack_data)
@@ -353,15 +359,15 @@ class GDDeconv(ConvolutionalBase, nn_units.GradientDescentBase):
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
                 self.n_kernels, self._kernel_size, unpack_side,
-                self.np_one, int(self.input.devmem) + output_offs,
-                unpack_data, self.np_one if start_image else self.np_zero,
+                self.np_alpha, int(self.input.devmem) + output_offs,
+                unpack_data, self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem)
         else:
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
-                self._kernel_size, self.n_kernels, unpack_side, self.np_one,
+                self._kernel_size, self.n_kernels, unpack_side, self.np_alpha,
                 unpack_data, int(self.input.devmem) + output_offs,
-                self.np_one if start_image else self.np_zero,
+                self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem)
 
     def _ocl_process_subblock(self, start_image, image_count, unpack_data):
@@ -394,16 +400,114 @@ class GDDeconv(ConvolutionalBase, nn_units.GradientDescentBase):
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
                 self.n_kernels, self._kernel_size, unpack_side,
-                self.np_one, self.input.devmem,
-                unpack_data, self.np_one if start_image else self.np_zero,
+                self.np_alpha, self.input.devmem,
+                unpack_data, self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem, offsetA=output_offs)
         else:
             self.gemm_(
                 self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_T,
                 self._kernel_size, self.n_kernels, unpack_side,
-                self.np_one, unpack_data, self.input.devmem,
-                self.np_one if start_image else self.np_zero,
+                self.np_alpha, unpack_data, self.input.devmem,
+                self.np_one if start_image else self.np_beta,
                 self.gradient_weights.devmem, offsetB=output_offs)
 
+    def numpy_err_output_update(self):
+        """Divides err_output by the hits count.
+        """
+        self.err_output.map_write()
+        if self.hits:
+            self.hits.map_read()
+            self.err_output.mem /= numpy.maximum(self.hits.mem, 1)
+        else:
+            self.err_output.mem /= ((self.kx // self.sliding[0]) *
+                                    (self.ky // self.sliding[1]))
+
     def numpy_run(self):
-        raise NotImplementedError()
+        # Divide err_output by hits count
+        self.numpy_err_output_update()
+
+        # Update err_input and simultaneousely accumulate gradient
+        self.input.map_read()
+        self.weights.map_read()
+        if self.need_err_input:
+            self.err_input.map_write()
+        gradient = None
+        if self.need_gradient_weights:
+            if self.accumulated_steps > 1:
+                # average_gradient() includes the minibatch into the mean
+                self.gradient_weights.map_write()
+            else:
+                self.gradient_weights.map_invalidate()
+            gradient = self.minibatch_gradient("weights")
+        for i in range(0, self._batch_size, self.unpack_size):
+            self._numpy_process_subblock(
+                i, min(self._batch_size - i, self.unpack_size), gradient)
+        if self.need_gradient_weights:
+            self.average_gradient("weights", gradient)
+
+        # Update weights
+        self.numpy_weights_update()
+
+    def _numpy_process_subblock(self, start_image, image_count, gradient):
+        unpack_side = self._kernel_app_per_image * image_count
+        unpack_data = self.numpy_buffer(
+            "unpack_data", (unpack_side, self._kernel_size), self._dtype)
+        self.numpy_unpack(
+            self.err_output.mem[start_image:start_image + image_count],
+            unpack_data)
+        rows = slice(start_image * self._kernel_app_per_image,
+                     start_image * self._kernel_app_per_image + unpack_side)
+
+        # Update err_input
+        if self.need_err_input:
+            weights = (self.weights.mem if self.weights_transposed
+                       else self.weights.mem.transpose())
+            err_input = self.err_input.mem.reshape(
+                self._kernel_app_total, self.n_kernels)[rows]
+            if self.err_input_beta:
+                block = self.numpy_buffer(
+                    "err_input_block", err_input.shape, self._dtype)
+                numpy.dot(unpack_data, weights, block)
+                block *= self.err_input_alpha
+                err_input *= self.err_input_beta
+                err_input += block
+            else:
+                numpy.dot(unpack_data, weights, err_input)
+                if self.err_input_alpha != 1:
+                    err_input *= self.err_input_alpha
+
+        if not self.need_gradient_weights:
+            return
+
+        # Accumulate gradient
+        inp = self.input.mem.reshape(
+            self._kernel_app_total, self.n_kernels)[rows]
+        a, b = ((unpack_data.transpose(), inp) if self.weights_transposed
+                else (inp.transpose(), unpack_data))
+        if not start_image:
+            numpy.dot(a, b, gradient)
+            return
+        block = self.numpy_buffer(
+            "gradient_weights_block", gradient.shape, self._dtype)
+        numpy.dot(a, b, block)
+        gradient += block
+
+    def numpy_weights_update(self):
+        if not self.need_gradient_weights or not self.accumulation_complete:
+            return
+        self.weights.map_write()
+        self.accumulated_gradient_weights.map_write()
+        self.gradient_weights_with_moment.map_write()
+
+        gradient = -nn_units.GradientDescentBase.numpy_gradient_step(
+            self.weights.mem, self.gradient_weights.mem, self.learning_rate,
+            self.weights_decay, self.l1_vs_l2, self.factor_ortho,
+            self.weights_transposed)
+        gradient = self.accumulate_gradient_f(
+            self.accumulated_gradient_weights, gradient)
+        if self.gradient_weights_with_moment:
+            gradient += (self.gradient_weights_with_moment.mem *
+                         self.gradient_moment)
+            self.gradient_weights_with_moment.mem[:] = gradient
+        if self.apply_gradient:
+            self.weights.mem += gradient
@@ -239,11 +239,9 @@ class GDMaxPooling(GDPooling):
         self.err_input.mem[:] = 0
 
         # self.input_offset can contain equal values
-        for err, offset in numpy.nditer([self.err_output.mem,
-                                         self.input_offset.mem]):
-            batch, y, x, ch = numpy.unravel_index(offset,
-                                                  self.err_input.shape)
-            self.err_input.mem[batch, y, x, ch] += err
+        numpy.add.at(self.err_input.mem.reshape(-1),
+                     self.input_offset.mem.reshape(-1),
+                     self.err_output.mem.reshape(-1))
 
 
 class GDMaxAbsPooling(GDMaxPooling):
@@ -272,16 +270,15 @@ class GDAvgPooling(GDPooling):
     def numpy_run(self):
         self.err_output.map_read()
         self.err_input.map_invalidate()
-        self.err_input.mem[:] = 0
-
-        for (batch, y, x, ch), err in numpy.ndenumerate(self.err_output.mem):
-            hx1 = x * self.sliding[0]
-            hx2 = hx1 + self.kx
-            hx2 = hx2 if hx2 < self.sx else self.sx
-            hy1 = y * self.sliding[1]
-            hy2 = hy1 + self.ky
-            hy2 = hy2 if hy2 < self.sy else self.sy
-            delta = err / ((hx2 - hx1) * (hy2 - hy1))
-            for i, j in ((ii, jj) for ii in range(hy1, hy2)
-                         for jj in range(hx1, hx2)):
-                self.err_input.mem[batch, i, j, ch] += delta
+        err_input = self.err_input.mem
+        err_input[:] = 0
+
+        ny, nx = self.numpy_window_shapes()
+        delta = self.err_output.mem.reshape(self.output_shape) / (ny * nx)
+        # Every window view touches distinct elements, so += is safe
+        padded = self.numpy_padded(err_input, 0)
+        for _, _, view in self.numpy_windows(padded):
+            view += delta
+        if not numpy.shares_memory(padded, err_input):
+            err_input.reshape(padded.shape[0], self.sy, self.sx, -1)[:] = \
+                padded[:, :self.sy, :self.sx]
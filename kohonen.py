@@ -38,6 +38,10 @@ under the License.
 from __future__ import division
 import numpy
 import opencl4py as cl
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
 import threading
 from zope.interface import implementer
 
@@ -53,19 +57,19 @@ class KohonenBase(object):
     """Common base of Kohonen units.
     """
 
-    def init_unpickled(self):
-        super(KohonenBase, self).init_unpickled()
-        numpy_version = [int(mem) for mem in numpy.__version__.split('.')]
-        if numpy_version[0] == 1 and numpy_version[1] < 8:
-            self.numpy_linalg_norm = self._numpy_legacy_linalg_norm
-        else:
-            self.numpy_linalg_norm = self._numpy_1_8_linalg_norm
+    def numpy_winners(self, inputs, weights, weights_transposed=False):
+        """Finds the winning neuron of every sample in the batch at once.
 
-    def _numpy_1_8_linalg_norm(self, dist):
-        return numpy.linalg.norm(dist, axis=1)
-
-    def _numpy_legacy_linalg_norm(self, dist):
-        return [numpy.linalg.norm(dist[i]) for i in range(dist.shape[0])]
+        ||x - w||^2 = ||x||^2 - 2 x.w + ||w||^2, and ||x||^2 does not
+        depend on the neuron, so the argmin of ||w||^2 - 2 x.w is taken.
+        """
+        inputs = inputs.reshape(inputs.shape[0], -1)
+        if weights_transposed:
+            weights = weights.transpose()
+        dists = numpy.dot(inputs, weights.transpose())
+        dists *= -2
+        dists += numpy.einsum("ij,ij->i", weights, weights)
+        return numpy.argmin(dists, axis=1)
 
 
 @implementer(IOpenCLUnit, INumpyUnit)
@@ -243,16 +247,13 @@ class KohonenForward(KohonenBase, AcceleratedUnit):
 
         length = self.minibatch_size if self.total is not None \
             else self.input.mem.shape[0]
-        for sindex in range(length):
-            if self.argmins is None:
-                dist = self.weights.mem - self.input[sindex]
-                winner = numpy.argmin(self.numpy_linalg_norm(dist))
-                self.output[sindex] = winner
-            else:
-                winner = self.argmins[sindex]
-            if self.total is not None:
-                index = sindex + self.minibatch_offset - self.minibatch_size
-                self.total[index] = winner
+        if self.argmins is None:
+            self.output.mem[:length] = self.numpy_winners(
+                self.input.mem[:length], self.weights.mem,
+                self.weights_transposed)
+        if self.total is not None:
+            offset = self.minibatch_offset - self.minibatch_size
+            self.total.mem[offset:offset + length] = self.output.mem[:length]
 
 
 @implementer(IOpenCLUnit, INumpyUnit)
@@ -280,6 +281,7 @@ class KohonenTrainer(KohonenBase, AcceleratedUnit):
         _krn_argmin_: finds indexes of minimal computed distances.
         krn_gravity_: computes gravity to the winner neuron.
         krn_apply_gradients_: applies gradient to weights.
+        _grid_distances_: squared distances between the neurons on the grid.
     """
     def __init__(self, workflow, **kwargs):
         super(KohonenTrainer, self).__init__(workflow, **kwargs)
@@ -308,6 +310,7 @@ class KohonenTrainer(KohonenBase, AcceleratedUnit):
         self._krn_gravity_ = None
         self._krn_compute_gradients_ = None
         self._krn_apply_gradients_ = None
+        self._grid_distances_ = None
 
     @property
     def gravity_radius(self):
@@ -469,30 +472,43 @@ class KohonenTrainer(KohonenBase, AcceleratedUnit):
         wrapped.__name__ = name + '_iteration'
         return wrapped
 
+    @property
+    def grid_distances(self):
+        if self._grid_distances_ is None:
+            self._coords.map_read()
+            coords = self._coords.mem
+            diff = coords[:, numpy.newaxis] - coords[numpy.newaxis]
+            self._grid_distances_ = numpy.einsum("ijk,ijk->ij", diff, diff)
+        return self._grid_distances_
+
     @iteration
     def numpy_run(self):
-        batch_size = self.input.mem.shape[0]
-        neurons_number = self._neurons_number
-        dists = numpy.empty(neurons_number)
-        gradients = numpy.zeros(self.weights.mem.shape)
         sigma = self.gravity_radius
         gmult = self.gradient_multiplier
         self.input.map_read()
-        self.weights.map_invalidate()
-        self.winners.map_invalidate()
-
-        for sindex in range(batch_size):
-            dist = self.weights.mem - self.input[sindex]
-            winner = numpy.argmin(self.numpy_linalg_norm(dist))
-            self.winners[winner] += 1
-            winner_coords = self._coords.mem[winner]
-            for nindex in range(neurons_number):
-                dist = self._coords.mem[nindex] - winner_coords
-                dists[nindex] = numpy.sum(dist * dist)
-            gravity = numpy.exp(dists / (-2 * sigma * sigma))
-            gradients += gravity.reshape((1, neurons_number)).transpose() * \
-                (self.input[sindex] - self.weights.mem) * gmult
-        self.weights.mem += gradients
+        self.weights.map_write()
+        self.winners.map_write()
+        self.argmins.map_invalidate()
+
+        inputs = self.input.mem.reshape(self.input.mem.shape[0], -1)
+        weights = self.weights.mem
+        argmins = self.numpy_winners(inputs, weights, self.weights_transposed)
+        self.argmins.mem[:] = argmins
+        self.winners.mem += numpy.bincount(
+            argmins, minlength=self._neurons_number).astype(numpy.int32)
+
+        # gravity[sample, neuron] pulls every neuron to the sample
+        gravity = self.grid_distances[argmins]
+        gravity *= -0.5 / (sigma * sigma)
+        numpy.exp(gravity, gravity)
+        gravity *= gmult
+        # sum_s gravity[s, n] * (x_s - w_n) for all the neurons at once
+        if self.weights_transposed:
+            weights *= 1 - gravity.sum(axis=0)
+            weights += numpy.dot(inputs.transpose(), gravity)
+        else:
+            weights *= (1 - gravity.sum(axis=0))[:, numpy.newaxis]
+            weights += numpy.dot(gravity.transpose(), inputs)
 
     @iteration
     def ocl_run(self):
@@ -594,13 +610,24 @@ class KohonenValidator(Unit):
         result: the resulting mapping between Kohonen neurons and real
                 categories.
         fitness: the ratio of samples classified right to the overall number.
+        hits: the matrix of the numbers of samples won by each neuron (rows)
+              per label (columns); the last column counts unlabeled samples.
+        exact_assignment: map each label to the single neuron which gives
+                          the maximal overall fitness instead of mapping
+                          every neuron to its most frequent label.
     """
     def __init__(self, workflow, **kwargs):
         super(KohonenValidator, self).__init__(workflow, **kwargs)
         self.demand("input", "minibatch_indices", "minibatch_size",
                     "samples_by_label", "labels_mapping",
                     "reversed_labels_mapping", "shape")
-        self.accumulated_input = []
+        self.exact_assignment = kwargs.get("exact_assignment", False)
+        if self.exact_assignment and linear_sum_assignment is None:
+            raise ImportError("exact_assignment requires scipy "
+                              "(scipy.optimize.linear_sum_assignment)")
+        self.hits = None
+        self._labels = []
+        self._sample_labels = None
         self._fitness = 0
         self._fitness_by_label = {}
         self._fitness_by_neuron = []
@@ -612,14 +639,22 @@ class KohonenValidator(Unit):
         self._lock_ = threading.Lock()
 
     def initialize(self, **kwargs):
-        del self.accumulated_input[:]
-        self.accumulated_input.extend([
-            set() for _ in range(self.neurons_count)])
+        # Columns follow labels_mapping order for the stable tie breaking
+        self._labels = sorted(self.samples_by_label,
+                              key=lambda label: self.labels_mapping[label])
+        self._sample_labels = numpy.full(
+            max(max(m) for m in self.samples_by_label.values() if len(m)) + 1,
+            len(self._labels), dtype=numpy.int32)
+        for column, label in enumerate(self._labels):
+            self._sample_labels[list(self.samples_by_label[label])] = column
+        self.hits = numpy.zeros((self.neurons_count, len(self._labels) + 1),
+                                dtype=numpy.int64)
         self._fitness = 0
         self._reset_result()
         self._fitness_by_label.clear()
         self._fitness_by_label.update(
             {label: 0 for label in self.samples_by_label})
+        del self._fitness_by_neuron[:]
         self._fitness_by_neuron.extend((0,) * self.neurons_count)
         self._overall = sum(len(m) for m in self.samples_by_label.values())
         assert self._overall > 0
@@ -627,8 +662,7 @@ class KohonenValidator(Unit):
         self._need_validate = True
 
     def reset(self):
-        for acc in self.accumulated_input:
-            acc.clear()
+        self.hits[:] = 0
         self._need_validate = True
 
     def run(self):
@@ -636,9 +670,13 @@ class KohonenValidator(Unit):
         self.minibatch_indices.map_read()
 
         self.reset()
-        for i in range(self.minibatch_size):
-            self.accumulated_input[self.input[i]].add(
-                self.minibatch_indices[i])
+        winners = self.input.mem[:self.minibatch_size]
+        indices = self.minibatch_indices.mem[:self.minibatch_size]
+        columns = numpy.full(len(indices), len(self._labels),
+                             dtype=numpy.int32)
+        known = indices < len(self._sample_labels)
+        columns[known] = self._sample_labels[indices[known]]
+        numpy.add.at(self.hits, (winners, columns), 1)
 
     @property
     def neurons_count(self):
@@ -678,45 +716,38 @@ class KohonenValidator(Unit):
         columns represent labels. The problem is to take the numbers from our
         matrix so that the sum is maximal and there are no numbers on the same
         row.
-        The algorithm is to first take the maximal number from matrix, then
-        the most significant one which stands on a different row, and repeat
-        the previous step until the work is done.
-        The difficulty is N*L log(N*L).
+        Each row is independent, so every neuron takes its maximal number
+        (the latest label in labels_mapping order on ties). If
+        exact_assignment is set, every label is additionally restricted to
+        a single neuron and the optimal assignment is solved.
+        The difficulty is N*L.
         """
         if not self._need_validate:
             return
-        intersections = []
-        for neuron in range(self.neurons_count):
-            for label, members in self.samples_by_label.items():
-                intersections.append((
-                    len(self.accumulated_input[neuron].intersection(members)),
-                    neuron, self.labels_mapping[label]))
-        intersections.sort(reverse=True)
+        hits = self.hits[:, :-1]
+        if self.exact_assignment:
+            neurons, columns = linear_sum_assignment(-hits)
+        else:
+            columns = hits.shape[1] - 1 - numpy.argmax(hits[:, ::-1], axis=1)
+            neurons = numpy.arange(hits.shape[0])
+        fits = hits[neurons, columns]
+        neurons, columns, fits = (
+            v[fits > 0] for v in (neurons, columns, fits))
         self._reset_result()
-        fitted = 0
-        fitted_by_label = {label: 0 for label in self.samples_by_label}
-        fitted_by_neuron = [0] * self.neurons_count
-        pos = 0
-        banned_neurons = set()
-        while (intersections[pos][0] > 0 and
-               len(banned_neurons) < self.neurons_count):
-            while intersections[pos][1] in banned_neurons:
-                pos += 1
-            fit, neuron, label = intersections[pos]
-            label = self.reversed_labels_mapping[label]
-            fitted += fit
-            fitted_by_label[label] += fit
-            fitted_by_neuron[neuron] = fit
-            self._result[label].add(neuron)
-            banned_neurons.add(neuron)
-        self._fitness = fitted / self._overall
+        for neuron, column in zip(neurons, columns):
+            self._result[self._labels[column]].add(int(neuron))
+        self._fitness = float(fits.sum()) / self._overall
         assert self._fitness <= 1
-        for label, members in self.samples_by_label.items():
-            self._fitness_by_label[label] = \
-                fitted_by_label[label] / len(members)
-        for neuron, wins in enumerate(self.accumulated_input):
-            self._fitness_by_neuron[neuron] = \
-                fitted_by_neuron[neuron] / len(wins) if len(wins) > 0 else 0
+        fitted_by_label = numpy.bincount(columns, weights=fits,
+                                         minlength=len(self._labels))
+        for column, label in enumerate(self._labels):
+            self._fitness_by_label[label] = float(
+                fitted_by_label[column]) / len(self.samples_by_label[label])
+        fitted_by_neuron = numpy.zeros(self.neurons_count)
+        fitted_by_neuron[neurons] = fits
+        wins = self.hits.sum(axis=1)
+        self._fitness_by_neuron[:] = (
+            fitted_by_neuron / numpy.maximum(wins, 1)).tolist()
         self.reset()
         self._need_validate = False
         self.info("Fitness: %.2f", self._fitness)
@@ -0,0 +1,138 @@
+# -*-coding: utf-8 -*-
+"""
+.. invisible:
+     _   _ _____ _     _____ _____
+    | | | |  ___| |   |  ___/  ___|
+    | | | | |__ | |   | |__ \ `--.
+    | | | |  __|| |   |  __| `--. \
+    \ \_/ / |___| |___| |___/\__/ /
+     \___/\____/\_____|____/\____/
+
+Created on Oct 17, 2026
+
+Decoding of the serialized caffe.Datum without protobuf.
+
+███████████████████████████████████████████████████████████████████████████████
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+███████████████████████████████████████████████████████████████████████████████
+"""
+
+
+import numpy
+
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+# Datum field number -> attribute name of the scalar (varint) fields
+DATUM_VARINT_FIELDS = {1: "channels", 2: "height", 3: "width", 5: "label",
+                       7: "encoded"}
+DATUM_DATA_FIELD = 4
+DATUM_FLOAT_DATA_FIELD = 6
+
+
+class DatumView(object):
+    """caffe.Datum decoded from the wire format without copying: data and
+    float_data are numpy arrays over the original buffer, so it must stay
+    alive and unchanged while they are used.
+    """
+    __slots__ = ("channels", "height", "width", "label", "encoded", "data",
+                 "float_data")
+
+    def __init__(self, buffer):
+        self.channels = self.height = self.width = self.label = 0
+        self.encoded = False
+        self.data = numpy.empty(0, numpy.uint8)
+        self.float_data = numpy.empty(0, numpy.float32)
+        self.ParseFromString(buffer)
+
+    def ParseFromString(self, buffer):
+        """Decodes the serialized Datum. The interface is the same as the
+        protobuf one, except that unset fields are not reset.
+        """
+        view = memoryview(buffer)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast("B")
+        size = len(view)
+        float_data = []
+        pos = 0
+        while pos < size:
+            tag, pos = read_varint(view, pos)
+            field, wire_type = tag >> 3, tag & 7
+            if wire_type == WIRE_VARINT:
+                value, pos = read_varint(view, pos)
+                name = DATUM_VARINT_FIELDS.get(field)
+                if name == "encoded":
+                    self.encoded = bool(value)
+                elif name is not None:
+                    # int32 fields are sign-extended to 64 bits
+                    setattr(self, name,
+                            value - (1 << 64) if value >> 63 else value)
+            elif wire_type == WIRE_LENGTH_DELIMITED:
+                length, pos = read_varint(view, pos)
+                end = pos + length
+                if end > size:
+                    raise ValueError("Truncated Datum")
+                if field == DATUM_DATA_FIELD:
+                    self.data = numpy.frombuffer(view[pos:end], numpy.uint8)
+                elif field == DATUM_FLOAT_DATA_FIELD:
+                    float_data.append(
+                        numpy.frombuffer(view[pos:end], "<f4"))
+                pos = end
+            elif wire_type == WIRE_FIXED32:
+                if field == DATUM_FLOAT_DATA_FIELD:
+                    float_data.append(
+                        numpy.frombuffer(view[pos:pos + 4], "<f4"))
+                pos += 4
+            elif wire_type == WIRE_FIXED64:
+                pos += 8
+            else:
+                raise ValueError(
+                    "Unsupported wire type %d of field %d in Datum" %
+                    (wire_type, field))
+        if pos > size:
+            raise ValueError("Truncated Datum")
+        if len(float_data) == 1:
+            self.float_data = float_data[0]
+        elif float_data:
+            self.float_data = numpy.concatenate(float_data)
+
+
+def read_varint(view, pos):
+    """Decodes the base 128 varint from the buffer at the specified position.
+
+    Returns:
+        tuple (value, position after the varint).
+    """
+    result = 0
+    shift = 0
+    try:
+        while True:
+            byte = view[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result, pos
+            shift += 7
+    except IndexError:
+        raise ValueError("Truncated varint in Datum")
@@ -38,6 +38,7 @@ under the License.
 from collections import defaultdict
 
 import json
+import mmap
 import pickle
 import os
 
@@ -49,17 +50,35 @@ import veles.error as error
 from veles.memory import Array
 import veles.opencl_types as opencl_types
 import veles.loader as loader
+from veles.znicz.loader.prefetch import MinibatchPrefetcher
+from veles.znicz.loader.sharded import ShardedDataset
 
 
 @implementer(loader.ILoader)
 class ImagenetLoaderBase(loader.Loader):
     MAPPING = "imagenet_loader_base"
-    """loads imagenet from samples.dat, labels.pickle"""
+    """loads imagenet from samples.dat, labels.pickle
+
+    If use_mmap is True, samples.dat is mapped into memory and every
+    minibatch is gathered at once in the file order; mmap_advise
+    additionally asks the OS to prefetch the samples of the next
+    minibatch. If prefetch_depth is positive, the samples of that many
+    next minibatches are read in a background thread.
+
+    If sharded_path is set, the samples, labels, class lengths and
+    matrixes are read from the sharded dataset in that directory (see
+    sharded.py) instead of the files above, by sharded_workers threads.
+    """
     def __init__(self, workflow, **kwargs):
         super(ImagenetLoaderBase, self).__init__(workflow, **kwargs)
         self.mean = Array()
         self.rdisp = Array()
         self._file_samples_ = ""
+        self.use_mmap = kwargs.get("use_mmap", False)
+        self.mmap_advise = kwargs.get("mmap_advise", False)
+        self.prefetch_depth = kwargs.get("prefetch_depth", 0)
+        self.sharded_path = kwargs.get("sharded_path")
+        self.sharded_workers = kwargs.get("sharded_workers", 1)
         self.sx = kwargs.get("sx", 256)
         self.sy = kwargs.get("sy", 256)
         self.channels = kwargs.get("channels", 3)
@@ -85,8 +104,26 @@ class ImagenetLoaderBase(loader.Loader):
         self._unique_labels_count = len(self._train_different_labels_)
         self.minibatch_labels.reset(numpy.zeros(
             self.max_minibatch_size, dtype=numpy.int32))
+        self._samples_ = numpy.zeros(
+            (self.max_minibatch_size, self.sy, self.sx, self.channels),
+            dtype=numpy.uint8)
+        self.stop_prefetching()
+        if self.prefetch_depth > 0 and not self.is_master:
+            # The background thread must not move the shared file position
+            if self._mmap_samples_ is None and self._sharded_ is None:
+                self._prefetch_file_ = open(self.samples_filename, "rb")
+            self._prefetcher_ = MinibatchPrefetcher(
+                lambda indices, samples: self.read_samples(
+                    indices, samples, self._prefetch_file_),
+                self._samples_.shape, self._samples_.dtype,
+                self.prefetch_depth)
 
     def load_data(self):
+        self._mmap_samples_ = None
+        self._sharded_ = None
+        if self.sharded_path is not None:
+            self.load_sharded()
+            return
         if (self.original_labels_filename is None or
                 not os.path.exists(self.original_labels_filename)):
             raise OSError(
@@ -141,9 +178,44 @@ class ImagenetLoaderBase(loader.Loader):
                 "Wrong data file size: %s (original data) != %s (original "
                 "labels)" % (number_of_samples, len(self._original_labels_)))
 
+        if self.use_mmap:
+            self._mmap_ = mmap.mmap(self._file_samples_.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+            self._mmap_samples_ = numpy.frombuffer(
+                self._mmap_, dtype=numpy.uint8).reshape(
+                number_of_samples, self.sy, self.sx, self.channels)
+
+    def load_sharded(self):
+        self._sharded_ = ShardedDataset(
+            self.sharded_path, self.sharded_workers)
+        if self._sharded_.shape != (self.sy, self.sx, self.channels) or \
+                self._sharded_.dtype != numpy.uint8:
+            raise error.BadFormatError(
+                "The samples in %s are %s %s instead of uint8 %s" % (
+                    self.sharded_path, self._sharded_.dtype,
+                    self._sharded_.shape, (self.sy, self.sx, self.channels)))
+        for index, value in enumerate(self._sharded_.class_lengths):
+            self.class_lengths[index] = value
+        self.info("Class Lengths: %s", str(self.class_lengths))
+        names = self._sharded_.label_names
+        for name, value in zip(names, self._sharded_.label_values):
+            self.labels_mapping[name] = value
+        labels = self._sharded_.labels
+        self._original_labels_ = [names[index] for index in labels.tolist()]
+        self.reversed_labels_mapping[:] = [None] * len(labels)
+        for key, val in self.labels_mapping.items():
+            self.reversed_labels_mapping[val] = key
+        for index in labels[self.class_lengths[0] +
+                            self.class_lengths[1]:].tolist():
+            self._train_different_labels_[names[index]] += 1
+
     def load_mean(self):
-        with open(self.matrixes_filename, "rb") as fin:
-            matrixes = pickle.load(fin)
+        matrixes = None
+        if self._sharded_ is not None:
+            matrixes = self._sharded_.load_matrixes()
+        if matrixes is None:
+            with open(self.matrixes_filename, "rb") as fin:
+                matrixes = pickle.load(fin)
         self.mean.mem = matrixes[0]
         self.rdisp.mem = matrixes[1].astype(
             opencl_types.dtypes[root.common.engine.precision_type])
@@ -164,11 +236,43 @@ class ImagenetLoaderBase(loader.Loader):
         dtype = opencl_types.dtypes[root.common.engine.precision_type]
         self.minibatch_data.mem = numpy.zeros(sh, dtype=dtype)
 
-    def fill_data(self, index, index_sample, sample):
-        self._file_samples_.readinto(self.minibatch_data.mem[index])
+    def fill_sample(self, index, index_sample, sample):
+        """Puts the sample read from samples.dat into the minibatch.
+        """
+        self.minibatch_data.mem[index] = sample
         self.minibatch_labels.mem[index] = self.labels_mapping[
             self._original_labels_[int(index_sample)]]
 
+    def read_samples(self, indices, samples, fin=None):
+        """Reads the samples with the specified indices from samples.dat or
+        the sharded dataset. The memory mapped file is read in the ascending
+        order of the sample offsets.
+        """
+        if self._sharded_ is not None:
+            self._sharded_.read(indices, samples)
+            return
+        if self._mmap_samples_ is not None:
+            order = numpy.argsort(indices)
+            samples[order] = self._mmap_samples_[indices[order]]
+            return
+        if fin is None:
+            fin = self._file_samples_
+        for sample, index_sample in zip(samples, indices):
+            fin.seek(int(index_sample) * sample.nbytes)
+            fin.readinto(sample)
+
+    def advise_samples(self, indices):
+        """Asks the OS to read ahead the samples with the specified indices.
+        """
+        if not hasattr(mmap, "MADV_WILLNEED"):
+            return
+        sample_bytes = self._mmap_samples_[0].nbytes
+        for index_sample in numpy.sort(indices):
+            offset = int(index_sample) * sample_bytes
+            start = offset - offset % mmap.PAGESIZE
+            self._mmap_.madvise(mmap.MADV_WILLNEED, start,
+                                offset + sample_bytes - start)
+
     def fill_indices(self, start_offset, count):
         if self.minibatch_class == 0 and not self.testing:
             return True
@@ -184,13 +288,25 @@ class ImagenetLoaderBase(loader.Loader):
         self.minibatch_data.map_invalidate()
         self.minibatch_labels.map_invalidate()
 
-        sample = numpy.zeros(
-            [self.sy, self.sx, self.channels], dtype=numpy.uint8)
-        sample_bytes = sample.nbytes
-
-        for index, index_sample in enumerate(idxs[:count]):
-            self._file_samples_.seek(int(index_sample) * sample_bytes)
-            self.fill_data(index, index_sample, sample)
+        indices = idxs[:count]
+        samples = self._samples_[:count]
+        if (self._prefetcher_ is None or
+                not self._prefetcher_.get(indices, samples)):
+            self.read_samples(indices, samples)
+        for index, index_sample in enumerate(indices):
+            self.fill_sample(index, index_sample, samples[index])
+
+        # Assume that the next minibatches follow in shuffled_indices
+        end = start_offset + count
+        if self._prefetcher_ is not None:
+            for offset in range(end, end + count * self.prefetch_depth,
+                                count):
+                upcoming = self.shuffled_indices[offset:offset + count]
+                if len(upcoming) == 0:
+                    break
+                self._prefetcher_.request(upcoming)
+        if self._mmap_samples_ is not None and self.mmap_advise:
+            self.advise_samples(self.shuffled_indices[end:end + count])
 
         if count < len(idxs):
             idxs[count:] = self.class_lengths[1]  # no data sample is there
@@ -204,3 +320,24 @@ class ImagenetLoaderBase(loader.Loader):
     def fill_minibatch(self):
         # minibatch was filled in fill_indices, so fill_minibatch not need
         raise error.Bug("Control should not go here")
+
+    def stop_prefetching(self):
+        """Stops the prefetcher's thread and closes its file.
+        """
+        prefetcher = getattr(self, "_prefetcher_", None)
+        if prefetcher is not None:
+            prefetcher.stop()
+            self._prefetcher_ = None
+            self.info("Prefetched minibatches hits/misses: %d/%d, stalled "
+                      "for %.2f sec", prefetcher.hits, prefetcher.misses,
+                      prefetcher.stall_time)
+        fin = getattr(self, "_prefetch_file_", None)
+        if fin is not None:
+            fin.close()
+        self._prefetch_file_ = None
+
+    def stop(self):
+        self.stop_prefetching()
+        if getattr(self, "_sharded_", None) is not None:
+            self._sharded_.close()
+        super(ImagenetLoaderBase, self).stop()
@@ -7,17 +7,41 @@ A loader for LMDB base (CAFFE intermediate format).
 Copyright (c) 2014, Samsung Electronics, Co., Ltd.
 """
 
+from collections import OrderedDict
+import hashlib
+import os
+import time
+
 import numpy
 from zope.interface import implementer
 
 import lmdb
+from veles.config import root
 from veles.loader import IImageLoader, ImageLoader, CLASS_NAME
-from veles.znicz.loader.caffe import Datum
+from veles.znicz.loader.caffe.datum import DatumView
+from veles.znicz.loader.prefetch import MinibatchPrefetcher
 
 
 @implementer(IImageLoader)
 class LMDBLoader(ImageLoader):
+    """Loads the images from LMDB databases of Caffe Datum-s.
+
+    The parsed Datum-s are kept in the LRU cache of at most cache_size
+    bytes of the raw values, which is filled for each minibatch at once
+    with sorted keys. The keys of each database are stored in cache_dir as
+    .npy files of fixed width byte strings so that they are not read from
+    the whole database on every start.
+
+    The Datum-s are decoded by DatumView right over the memory mapped
+    databases (the transactions are opened with buffers=True), so the image
+    data is never copied until it is put into the minibatch.
+
+    If prefetch_depth is positive, the image data of that many next
+    minibatches in shuffled_indices is read in a background thread with its
+    own transactions, so that the disk reads overlap with the computation.
+    """
     MAPPING = "lmdb"
+    KEYS_INDEX_VERSION = 1
 
     def __init__(self, workflow, **kwargs):
         super(LMDBLoader, self).__init__(workflow, **kwargs)
@@ -30,14 +54,28 @@ class LMDBLoader(ImageLoader):
         self.db_color_space = kwargs.get("db_colorspace", "RGB")
         self.db_splitted_channels = kwargs.get("db_splitted_channels", True)
         self.use_cache = kwargs.get("use_cache", True)
+        self.cache_size = kwargs.get("cache_size", 256 << 20)
+        self.cache_dir = kwargs.get("cache_dir", root.common.dirs.cache)
+        self.prefetch_depth = kwargs.get("prefetch_depth", 0)
         self._cache_hits = 0
         self._cache_misses = 0
+        self._bytes_read = 0
+        self._read_time = 0
 
     def init_unpickled(self):
         super(LMDBLoader, self).init_unpickled()
         # LMDB base cursors, used as KV-iterators
         self._cursors_ = [None] * 3
-        self._cache_ = None, None
+        self._envs_ = [None] * 3
+        self._entries_ = [0] * 3
+        self._prefetcher_ = None
+        # key -> prefetched image data
+        self._prefetched_ = {}
+        # class index -> transaction of the prefetcher's thread
+        self._prefetch_txns_ = {}
+        # key -> (DatumView, size of the raw value)
+        self._cache_ = OrderedDict()
+        self._cache_bytes_ = 0
 
     @property
     def cache_hits(self):
@@ -47,6 +85,18 @@ class LMDBLoader(ImageLoader):
     def cache_misses(self):
         return self._cache_misses
 
+    @property
+    def bytes_read(self):
+        """The overall size of the values read from the databases.
+        """
+        return self._bytes_read
+
+    @property
+    def read_time(self):
+        """The overall time spent reading the databases, in seconds.
+        """
+        return self._read_time
+
     @property
     def files(self):
         return self._files
@@ -89,8 +139,9 @@ class LMDBLoader(ImageLoader):
     def get_image_data(self, key):
         """Return the image data associated with the specified key.
         """
-        datum = self.get_cached_data(key)
-        img = numpy.fromstring(datum.data, dtype=numpy.uint8)
+        img = self._prefetched_.get(key)
+        if img is None:
+            img = self.get_cached_data(key).data
         osh = self.original_shape
         if not self.db_splitted_channels:
             img = img.reshape(osh)
@@ -100,24 +151,139 @@ class LMDBLoader(ImageLoader):
         return img
 
     def get_cached_data(self, key):
-        if self.use_cache:
-            if key != self._cache_[0]:
-                datum = self.get_datum(key)
-                self._cache_misses += 1
-            else:
-                datum = self._cache_[1]
-                self._cache_hits += 1
-        else:
-            datum = self.get_datum(key)
-        return datum
+        if not self.use_cache:
+            return self.get_datum(key)
+        entry = self._cache_.pop(key, None)
+        if entry is None:
+            self._cache_misses += 1
+            return self.get_datum(key)
+        self._cache_hits += 1
+        self._cache_[key] = entry
+        return entry[0]
 
     def get_datum(self, key):
         index, dkey = key
-        datum = Datum()
-        datum.ParseFromString(self._cursors_[index].get(dkey))
-        self._cache_ = key, datum
+        start = time.time()
+        value = self._cursors_[index].get(dkey)
+        self._read_time += time.time() - start
+        return self._add_datum(key, value)
+
+    def cache_data(self, keys):
+        """Reads the Datum-s of the specified keys which are not in the cache
+        yet in the ascending order of the keys, in one batch per database.
+        """
+        missing = [[], [], []]
+        for key in keys:
+            if key not in self._cache_:
+                missing[key[0]].append(key[1])
+        for index, dkeys in enumerate(missing):
+            if not dkeys:
+                continue
+            dkeys = sorted(set(dkeys))
+            self._cache_misses += len(dkeys)
+            cursor = self._cursors_[index]
+            start = time.time()
+            if hasattr(cursor, "getmulti"):
+                items = cursor.getmulti(dkeys)
+            else:
+                items = [(dkey, cursor.get(dkey)) for dkey in dkeys]
+            self._read_time += time.time() - start
+            for dkey, value in items:
+                # The keys are memoryview-s of the transaction like values
+                self._add_datum((index, bytes(dkey)), value)
+
+    def _add_datum(self, key, value):
+        datum = DatumView(value)
+        size = len(value)
+        self._bytes_read += size
+        if self.use_cache:
+            self._cache_[key] = datum, size
+            self._cache_bytes_ += size
+            while self._cache_bytes_ > self.cache_size and \
+                    len(self._cache_) > 1:
+                self._cache_bytes_ -= self._cache_.popitem(last=False)[1][1]
         return datum
 
+    def initialize(self, **kwargs):
+        super(LMDBLoader, self).initialize(**kwargs)
+        self.stop_prefetching()
+        if self.prefetch_depth > 0 and not self.is_master:
+            # The prefetched rows are used until the next fill_indices()
+            self._samples_ = numpy.empty(
+                (self.max_minibatch_size,
+                 int(numpy.prod(self.original_shape))), numpy.uint8)
+            self._prefetcher_ = MinibatchPrefetcher(
+                self.read_image_data, self._samples_.shape,
+                self._samples_.dtype, self.prefetch_depth)
+
+    def stop_prefetching(self):
+        """Stops the prefetcher's thread and closes its transactions.
+        """
+        prefetcher = self._prefetcher_
+        if prefetcher is None:
+            return
+        prefetcher.stop()
+        self._prefetcher_ = None
+        for txn in self._prefetch_txns_.values():
+            txn.abort()
+        self._prefetch_txns_.clear()
+        self._prefetched_.clear()
+        self.info("Prefetched minibatches hits/misses: %d/%d, stalled "
+                  "for %.2f sec", prefetcher.hits, prefetcher.misses,
+                  prefetcher.stall_time)
+
+    def get_sample_keys(self, indices):
+        """Returns the list of keys of the samples with the specified
+        indices.
+        """
+        classes = numpy.searchsorted(
+            self.class_end_offsets, indices, side="right")
+        return [self.class_keys[class_index][
+            index - self.class_end_offsets[class_index] +
+            self.class_lengths[class_index]]
+            for class_index, index in zip(classes, indices)]
+
+    def read_image_data(self, indices, samples):
+        """Copies the image data of the samples with the specified indices
+        into the rows of samples. Is called from the prefetcher's thread,
+        which uses its own transactions.
+        """
+        for row, (index, dkey) in zip(samples,
+                                      self.get_sample_keys(indices)):
+            txn = self._prefetch_txns_.get(index)
+            if txn is None:
+                txn = self._prefetch_txns_[index] = self._envs_[index].begin(
+                    buffers=True)
+            row[:] = DatumView(txn.get(dkey)).data
+
+    def fill_indices(self, start_offset, count):
+        result = super(LMDBLoader, self).fill_indices(start_offset, count)
+        if self.is_master:
+            return result
+        self.minibatch_indices.map_read()
+        indices = self.minibatch_indices.mem[:count]
+        keys = None
+        if self.use_cache:
+            keys = self.get_sample_keys(indices)
+            self.cache_data(keys)
+        self._prefetched_.clear()
+        if self._prefetcher_ is None:
+            return result
+        samples = self._samples_[:count]
+        if self._prefetcher_.get(indices, samples):
+            if keys is None:
+                keys = self.get_sample_keys(indices)
+            self._prefetched_.update(zip(keys, samples))
+        # Assume that the next minibatches follow in shuffled_indices
+        self.shuffled_indices.map_read()
+        end = start_offset + count
+        for offset in range(end, end + count * self.prefetch_depth, count):
+            upcoming = self.shuffled_indices[offset:offset + count]
+            if len(upcoming) == 0:
+                break
+            self._prefetcher_.request(upcoming)
+        return result
+
     def get_keys(self, index):
         """
         Return a list of image keys for the specified class index.
@@ -126,12 +292,58 @@ class LMDBLoader(ImageLoader):
         cursor = self._cursors_[index]
         if cursor is None:
             return []
-        keys = [(index, cursor.key())]
-        while cursor.next():
-            keys.append((index, cursor.key()))
-        cursor.first()
+        dkeys = self._load_keys_index(index)
+        if dkeys is None:
+            # The transaction is opened with buffers=True for the zero copy
+            # values, the keys must outlive it and be sortable and picklable
+            dkeys = [bytes(dkey) for dkey in
+                     cursor.iternext(keys=True, values=False)]
+            cursor.first()
+            self._save_keys_index(index, dkeys)
+
+        return [(index, dkey) for dkey in dkeys]
+
+    def keys_index_path(self, index):
+        """Path to the keys index of the specified class index in cache_dir,
+        keyed by the database path, its number of entries and the
+        modification time of its data.mdb.
+        """
+        db_path = os.path.abspath(self._files[index])
+        digest = hashlib.sha1(("%d %s %d %d" % (
+            self.KEYS_INDEX_VERSION, db_path, self._entries_[index],
+            os.path.getmtime(os.path.join(db_path, "data.mdb")))).encode())
+        return os.path.join(
+            self.cache_dir, "lmdb_keys_%s.npy" % digest.hexdigest())
+
+    def _load_keys_index(self, index):
+        path = self.keys_index_path(index)
+        if not os.access(path, os.R_OK):
+            return None
+        try:
+            dkeys = numpy.load(path, allow_pickle=False)
+        except (IOError, OSError, ValueError) as e:
+            self.warning("Failed to load the keys index %s: %s", path, e)
+            return None
+        if dkeys.dtype.kind != "S" or dkeys.shape != (
+                self._entries_[index],):
+            self.warning("The keys index %s is corrupted", path)
+            return None
+        return dkeys.tolist()
 
-        return keys
+    def _save_keys_index(self, index, dkeys):
+        path = self.keys_index_path(index)
+        # Fixed width byte strings drop the trailing zeros
+        if any(dkey.endswith(b"\0") for dkey in dkeys):
+            self.warning("Some keys end with zero bytes, the keys index is "
+                         "not saved")
+            return
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as fout:
+                numpy.save(fout, numpy.array(dkeys, dtype=bytes))
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            self.warning("Failed to save the keys index %s: %s", path, e)
 
     def load_data(self):
         for index, _ in enumerate(CLASS_NAME):
@@ -139,10 +351,13 @@ class LMDBLoader(ImageLoader):
         super(LMDBLoader, self).load_data()
 
     def stop(self):
+        self.stop_prefetching()
         super(LMDBLoader, self).stop()
         self.info("Cache hits/misses: %d/%d (%d%%)", self.cache_hits,
-                  self.cache_misses, self.cache_hits * 100 // (
-                      self.cache_hits + self.cache_misses))
+                  self.cache_misses, self.cache_hits * 100 // max(
+                      self.cache_hits + self.cache_misses, 1))
+        self.info("Read %d bytes in %.2f sec, %d bytes are cached",
+                  self.bytes_read, self.read_time, self._cache_bytes_)
 
     def _initialize_cursor(self, index):
         if self._files == (None, None, None):
@@ -153,17 +368,22 @@ class LMDBLoader(ImageLoader):
         db_path = self._files[index]
         if not db_path:
             return tuple()
-        _, cursor = self._open_db(db_path)
+        self._entries_[index], cursor, self._envs_[index] = \
+            self._open_db(db_path)
         self._cursors_[index] = cursor
+        # The cached Datum-s refer to the buffers of the old transaction
+        for key in [key for key in self._cache_ if key[0] == index]:
+            self._cache_bytes_ -= self._cache_.pop(key)[1]
 
     def _open_db(self, base_path):
         """
         Returns:
             int: number of pics in the database
             :class:`lmdb.Cursor`: base cursor
+            :class:`lmdb.Environment`: the database
         """
         db = lmdb.open(base_path)
-        transaction = db.begin()
+        transaction = db.begin(buffers=True)
         cursor = transaction.cursor()
         cursor.first()
-        return db.stat()["entries"], cursor
+        return db.stat()["entries"], cursor, db
@@ -36,6 +36,7 @@ under the License.
 
 
 import gzip
+import hashlib
 import numpy
 import os
 import struct
@@ -49,8 +50,16 @@ from veles.loader import FullBatchLoader, IFullBatchLoader, TEST, VALID, TRAIN
 @implementer(IFullBatchLoader)
 class MnistLoader(FullBatchLoader):
     """Loads MNIST dataset.
+
+    The parsed dataset is cached in cache_dir as .npy files in the dtype of
+    original_data, keyed by the hash of the headers, sizes and modification
+    times of the original files, and is memory mapped on the subsequent
+    runs. The normalization is
+    applied by FullBatchLoader after load_data(), so the cached values are
+    the raw ones.
     """
     MAPPING = "mnist_loader"
+    CACHE_VERSION = 1
 
     TRAIN_IMAGES = "train-images.idx3-ubyte"
     TRAIN_LABELS = "train-labels.idx1-ubyte"
@@ -73,6 +82,8 @@ class MnistLoader(FullBatchLoader):
             self.data_path, self.TRAIN_LABELS)
         self.train_data_path = os.path.join(
             self.data_path, self.TRAIN_IMAGES)
+        self.use_cache = kwargs.get("use_cache", True)
+        self.cache_dir = kwargs.get("cache_dir", self.data_path)
 
     def load_dataset(self):
         """
@@ -120,7 +131,7 @@ class MnistLoader(FullBatchLoader):
                 raise error.BadFormatError("Wrong number of labels in "
                                            "train-labels")
 
-            arr = numpy.zeros(n_labels, dtype=numpy.byte)
+            arr = numpy.empty(n_labels, dtype=numpy.byte)
             n = fin.readinto(arr)
             if n != n_labels:
                 raise error.BadFormatError("EOF reached while reading labels "
@@ -148,15 +159,16 @@ class MnistLoader(FullBatchLoader):
                                            " should be 28*28")
 
             # 0 - white, 255 - black
-            pixels = numpy.zeros(n_images * n_rows * n_cols, dtype=numpy.ubyte)
+            pixels = numpy.empty(n_images * n_rows * n_cols, dtype=numpy.ubyte)
             n = fin.readinto(pixels)
             if n != n_images * n_rows * n_cols:
                 raise error.BadFormatError("EOF reached while reading images "
                                            "from train-images")
 
-        # Transforming images into float arrays and normalizing to [-1, 1]:
-        images = pixels.astype(numpy.float32).reshape(n_images, n_rows, n_cols)
-        self.original_data.mem[offs:offs + n_images] = images[:]
+        # Transforming images into float arrays (without the intermediate
+        # copy); the normalization is applied later by FullBatchLoader
+        self.original_data.mem[offs:offs + n_images] = pixels.reshape(
+            n_images, n_rows, n_cols)
 
     def load_data(self):
         """Here we will load MNIST data.
@@ -170,7 +182,6 @@ class MnistLoader(FullBatchLoader):
             self.class_lengths[VALID] = self.class_lengths[TRAIN] = 0
         self.create_originals((28, 28))
         self.original_labels[:] = (0 for _ in range(len(self.original_labels)))
-        self.info("Loading from original MNIST files...")
         self.load_dataset()
         for path in (
                 self.test_data_path, self.test_labels_path,
@@ -180,7 +191,70 @@ class MnistLoader(FullBatchLoader):
                     "There is no data in %s. Failed to load data from url: %s."
                     " Please download MNIST dataset manualy in folder %s" %
                     (self.data_path, self.URL, self.data_path))
+        if self.use_cache and self.load_cache():
+            return
+        self.info("Loading from original MNIST files...")
         self.load_original(
             0, 10000, self.test_labels_path, self.test_data_path)
         self.load_original(
             10000, 60000, self.train_labels_path, self.train_data_path)
+        if self.use_cache:
+            self.save_cache()
+
+    @property
+    def cache_paths(self):
+        """Paths to the cached images and labels.
+        """
+        digest = hashlib.sha1(("%d %s" % (
+            self.CACHE_VERSION, self.original_data.dtype.str)).encode())
+        for path in (self.test_labels_path, self.test_data_path,
+                     self.train_labels_path, self.train_data_path):
+            stat = os.stat(path)
+            digest.update(("%d %d" % (stat.st_size, stat.st_mtime)).encode())
+            with open(path, "rb") as fin:
+                digest.update(fin.read(16))
+        prefix = os.path.join(self.cache_dir, "mnist_" + digest.hexdigest())
+        return prefix + "_images.npy", prefix + "_labels.npy"
+
+    def load_cache(self):
+        """Fills the originals from the cache.
+
+        Returns:
+            True if succeeded, otherwise, False.
+        """
+        images_path, labels_path = self.cache_paths
+        if not os.access(images_path, os.R_OK) or \
+                not os.access(labels_path, os.R_OK):
+            return False
+        try:
+            images = numpy.load(images_path, mmap_mode="c")
+            labels = numpy.load(labels_path)
+        except (IOError, OSError, ValueError) as e:
+            self.warning("Failed to load the cached MNIST from %s: %s",
+                         images_path, e)
+            return False
+        if images.shape != self.original_data.shape or \
+                images.dtype != self.original_data.dtype or \
+                labels.shape != (len(self.original_labels),):
+            self.warning("The cached MNIST in %s is corrupted", images_path)
+            return False
+        self.info("Loading MNIST from %s...", images_path)
+        # Copy-on-write mapping, the pages are read on demand
+        self.original_data.mem = images.view(numpy.ndarray)
+        self.original_labels[:] = labels
+        return True
+
+    def save_cache(self):
+        """Saves the originals to the cache so that load_cache() can use it.
+        """
+        for path, arr in zip(self.cache_paths, (
+                self.original_data.mem,
+                numpy.array(self.original_labels, dtype=numpy.byte))):
+            tmp_path = path + ".tmp"
+            try:
+                with open(tmp_path, "wb") as fout:
+                    numpy.save(fout, arr)
+                os.rename(tmp_path, path)
+            except (IOError, OSError) as e:
+                self.warning("Failed to cache MNIST to %s: %s", path, e)
+                return
@@ -0,0 +1,185 @@
+# -*-coding: utf-8 -*-
+"""
+.. invisible:
+     _   _ _____ _     _____ _____
+    | | | |  ___| |   |  ___/  ___|
+    | | | | |__ | |   | |__ \ `--.
+    | | | |  __|| |   |  __| `--. \
+    \ \_/ / |___| |___| |___/\__/ /
+     \___/\____/\_____|____/\____/
+
+Created on Oct 17, 2026
+
+Background reading of the upcoming minibatches for the loaders.
+
+███████████████████████████████████████████████████████████████████████████████
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+███████████████████████████████████████████████████████████████████████████████
+"""
+
+
+from collections import deque
+import threading
+import time
+
+import numpy
+from six.moves import queue
+
+from veles.logger import Logger
+
+
+class MinibatchPrefetcher(Logger):
+    """Reads the samples of the upcoming minibatches in a background thread
+    into a ring of preallocated buffers while the current one is processed.
+
+    The requests are served in the order they were made, and a prefetched
+    minibatch is used only if its sample indices are exactly the requested
+    ones, so the result does not depend on the timing: it is always the
+    same as reading synchronously. The stale requests are discarded without
+    waiting for them: the background thread skips them or returns their
+    buffers to the ring when it is done.
+
+    Attributes:
+        read: function (indices, samples) which reads the samples with the
+              specified indices into samples; it is called from the
+              background thread and must not touch the loader's state.
+        depth: the maximal number of minibatches read in advance.
+        hits: the number of minibatches taken from the prefetched ones.
+        misses: the number of minibatches which were not prefetched.
+        stall_time: the overall time spent waiting for the background
+                    thread, in seconds.
+    """
+    # The fields of the pending entries
+    INDICES, BUFFER, DONE, ERROR, DISCARDED = range(5)
+
+    def __init__(self, read, shape, dtype, depth=2):
+        super(MinibatchPrefetcher, self).__init__()
+        if depth < 1:
+            raise ValueError("depth must be positive (got %s)" % depth)
+        self.read = read
+        self.depth = depth
+        self.hits = 0
+        self.misses = 0
+        self.stall_time = 0.0
+        self._buffers = [numpy.empty(shape, dtype) for _ in range(depth)]
+        # Guards _free and the DONE and DISCARDED fields of the entries
+        self._lock = threading.Lock()
+        self._free = list(range(depth))
+        self._pending = deque()
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._work, name="MinibatchPrefetcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        """The number of minibatches currently requested in advance.
+        """
+        return len(self._pending)
+
+    def request(self, indices):
+        """Schedules reading of the samples with the specified indices.
+        Does nothing if the ring is full or they are already scheduled.
+        """
+        indices = numpy.array(indices)
+        if any(numpy.array_equal(indices, entry[self.INDICES])
+               for entry in self._pending):
+            return
+        with self._lock:
+            if not self._free:
+                return
+            index = self._free.pop()
+        entry = [indices, index, threading.Event(), None, False]
+        self._pending.append(entry)
+        self._requests.put(entry)
+
+    def get(self, indices, samples):
+        """Copies the prefetched samples with the specified indices into
+        samples.
+
+        Returns:
+            True if the samples were prefetched, otherwise, False and the
+            caller must read them itself.
+        """
+        found = any(numpy.array_equal(entry[self.INDICES], indices)
+                    for entry in self._pending)
+        # The entries requested before are stale; if the indices were not
+        # requested at all, the order changed and every entry is stale
+        while self._pending:
+            entry = self._pending.popleft()
+            if not found or not numpy.array_equal(
+                    entry[self.INDICES], indices):
+                self._discard(entry)
+                continue
+            done = entry[self.DONE]
+            if not done.is_set():
+                start = time.time()
+                done.wait()
+                self.stall_time += time.time() - start
+            found = entry[self.ERROR] is None
+            if found:
+                samples[:] = self._buffers[entry[self.BUFFER]][:len(indices)]
+            with self._lock:
+                self._free.append(entry[self.BUFFER])
+            break
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def stop(self):
+        """Discards the pending requests and stops the background thread.
+        """
+        while self._pending:
+            self._discard(self._pending.popleft())
+        self._requests.put(None)
+        self._thread.join()
+
+    def _discard(self, entry):
+        """Returns the buffer of the entry to the ring, or lets the
+        background thread do it if the entry is not read yet.
+        """
+        with self._lock:
+            if entry[self.DONE].is_set():
+                self._free.append(entry[self.BUFFER])
+            else:
+                entry[self.DISCARDED] = True
+
+    def _work(self):
+        while True:
+            entry = self._requests.get()
+            if entry is None:
+                return
+            indices, index = entry[self.INDICES], entry[self.BUFFER]
+            with self._lock:
+                discarded = entry[self.DISCARDED]
+            if not discarded:
+                try:
+                    self.read(indices, self._buffers[index][:len(indices)])
+                except Exception as e:
+                    entry[self.ERROR] = e
+                    self.warning("Failed to prefetch %d samples: %s: %s",
+                                 len(indices), type(e).__name__, e)
+            with self._lock:
+                entry[self.DONE].set()
+                if entry[self.DISCARDED]:
+                    self._free.append(index)
@@ -0,0 +1,287 @@
+# -*-coding: utf-8 -*-
+"""
+.. invisible:
+     _   _ _____ _     _____ _____
+    | | | |  ___| |   |  ___/  ___|
+    | | | | |__ | |   | |__ \ `--.
+    | | | |  __|| |   |  __| `--. \
+    \ \_/ / |___| |___| |___/\__/ /
+     \___/\____/\_____|____/\____/
+
+Created on Oct 17, 2026
+
+Sharded indexed container of fixed shape samples and the converter to it
+from the monolithic samples.dat produced by preparation_imagenet.py.
+
+The dataset is a directory with:
+
+    header.json - format version, sample shape and dtype, class lengths,
+                  compression, label names and values, the list of shards;
+    labels.npy - index of the label name of each sample;
+    mean.npy, rdisp.npy - optional mean and reciprocal dispersion matrices;
+    shard_NNNNN.bin - samples, either raw or compressed one by one;
+    shard_NNNNN.offsets.npy - offsets of the samples in the shard, plus
+                              the shard size at the end.
+
+header.json is written the last, so an incomplete dataset is not opened.
+
+███████████████████████████████████████████████████████████████████████████████
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+███████████████████████████████████████████████████████████████████████████████
+"""
+
+
+import json
+import mmap
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import zlib
+
+import numpy
+
+
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+LABELS_FILE = "labels.npy"
+MEAN_FILE = "mean.npy"
+RDISP_FILE = "rdisp.npy"
+SHARD_FILE = "shard_%05d.bin"
+OFFSETS_FILE = "shard_%05d.offsets.npy"
+COMPRESSIONS = (None, "zlib")
+
+
+class ShardedDataset(object):
+    """Reads the samples from the sharded dataset directory.
+
+    Only the header and the labels are read on open; the shards are
+    memory mapped and their offset tables are loaded on the first access.
+    Reading is thread safe, and any number of processes may open the same
+    dataset.
+
+    Attributes:
+        path: the dataset directory.
+        shape: the shape of a sample.
+        dtype: the dtype of a sample.
+        class_lengths: the number of test, validation and train samples.
+        compression: None or the name of the per sample compression.
+        label_names: the names of the labels.
+        label_values: the integer values of the labels.
+        labels: the index in label_names of each sample's label.
+        workers: the number of threads which read different shards.
+    """
+    def __init__(self, path, workers=1):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE), "r") as fin:
+            header = json.load(fin)
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError("Unsupported version %s of the dataset %s" %
+                             (header["version"], path))
+        self.shape = tuple(header["shape"])
+        self.dtype = numpy.dtype(header["dtype"])
+        self.class_lengths = header["class_lengths"]
+        self.compression = header["compression"]
+        if self.compression not in COMPRESSIONS:
+            raise ValueError("Unsupported compression %s of the dataset %s" %
+                             (self.compression, path))
+        self.label_names = header["label_names"]
+        self.label_values = header["label_values"]
+        self.labels = numpy.load(os.path.join(path, LABELS_FILE),
+                                 mmap_mode="r")
+        self._shard_ends = numpy.cumsum(header["shards"])
+        if self._shard_ends[-1] != sum(self.class_lengths) or \
+                len(self.labels) != sum(self.class_lengths):
+            raise ValueError("The dataset %s is inconsistent" % path)
+        self._shards = [None] * len(header["shards"])
+        self._lock = threading.Lock()
+        self.workers = workers
+        self._pool = ThreadPool(workers) if workers > 1 else None
+
+    def __len__(self):
+        return int(self._shard_ends[-1])
+
+    @property
+    def sample_nbytes(self):
+        return int(numpy.prod(self.shape)) * self.dtype.itemsize
+
+    def load_matrixes(self):
+        """Returns:
+            tuple (mean, rdisp) or None if they were not saved.
+        """
+        mean_path = os.path.join(self.path, MEAN_FILE)
+        if not os.path.exists(mean_path):
+            return None
+        return (numpy.load(mean_path),
+                numpy.load(os.path.join(self.path, RDISP_FILE)))
+
+    def read(self, indices, samples):
+        """Reads the samples with the specified indices into samples, shard
+        by shard in the ascending order of the offsets.
+        """
+        indices = numpy.asarray(indices)
+        order = numpy.argsort(indices, kind="mergesort")
+        shard_indices = numpy.searchsorted(
+            self._shard_ends, indices[order], side="right")
+        bounds = numpy.flatnonzero(numpy.diff(shard_indices)) + 1
+        jobs = [(shard_indices[start], order[start:end])
+                for start, end in zip(
+                    numpy.concatenate(([0], bounds)),
+                    numpy.concatenate((bounds, [len(order)])))
+                if start < end]
+        if self._pool is None or len(jobs) < 2:
+            for job in jobs:
+                self._read_shard(indices, samples, *job)
+        else:
+            self._pool.map(
+                lambda job: self._read_shard(indices, samples, *job), jobs)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        # The mappings are closed when the views of them are released
+        self._shards = [None] * len(self._shards)
+
+    def _read_shard(self, indices, samples, shard_index, positions):
+        data, offsets = self._open_shard(shard_index)
+        first = self._shard_ends[shard_index - 1] if shard_index > 0 else 0
+        for position in positions:
+            index = indices[position] - first
+            chunk = data[offsets[index]:offsets[index + 1]]
+            if self.compression == "zlib":
+                chunk = numpy.frombuffer(zlib.decompress(chunk), numpy.uint8)
+            samples[position] = chunk.view(self.dtype).reshape(self.shape)
+
+    def _open_shard(self, shard_index):
+        shard = self._shards[shard_index]
+        if shard is not None:
+            return shard
+        with self._lock:
+            shard = self._shards[shard_index]
+            if shard is None:
+                offsets = numpy.load(os.path.join(
+                    self.path, OFFSETS_FILE % shard_index))
+                with open(os.path.join(
+                        self.path, SHARD_FILE % shard_index), "rb") as fin:
+                    data = numpy.frombuffer(mmap.mmap(
+                        fin.fileno(), 0, access=mmap.ACCESS_READ),
+                        numpy.uint8)
+                shard = self._shards[shard_index] = data, offsets
+        return shard
+
+
+def write_shard(args):
+    """Writes the samples [start, start + count) of samples.dat to the
+    shard with the specified index. Is run in the converter's processes.
+
+    Returns:
+        The shard size in bytes.
+    """
+    (samples_filename, path, shard_index, start, count, sample_nbytes,
+     compression, level) = args
+    offsets = numpy.zeros(count + 1, dtype=numpy.int64)
+    with open(samples_filename, "rb") as fin, open(os.path.join(
+            path, SHARD_FILE % shard_index), "wb") as fout:
+        fin.seek(start * sample_nbytes)
+        for index in range(count):
+            chunk = fin.read(sample_nbytes)
+            if len(chunk) != sample_nbytes:
+                raise ValueError("%s is truncated" % samples_filename)
+            if compression == "zlib":
+                chunk = zlib.compress(chunk, level)
+            fout.write(chunk)
+            offsets[index + 1] = offsets[index] + len(chunk)
+    numpy.save(os.path.join(path, OFFSETS_FILE % shard_index), offsets)
+    return int(offsets[-1])
+
+
+def convert_to_sharded(path, samples_filename, shape, dtype, class_lengths,
+                       original_labels, matrixes=None, samples_per_shard=4096,
+                       compression=None, level=6, processes=None):
+    """Converts samples.dat with the specified labels into the sharded
+    dataset, writing the shards in parallel.
+
+    Arguments:
+        path: the dataset directory, it is created if it does not exist.
+        samples_filename: the file with the concatenated samples.
+        shape: the shape of a sample.
+        dtype: the dtype of a sample.
+        class_lengths: the number of test, validation and train samples.
+        original_labels: (name, value) label of each sample.
+        matrixes: None or (mean, rdisp).
+        samples_per_shard: the maximal number of samples in a shard.
+        compression: None or "zlib".
+        level: the compression level.
+        processes: the number of processes, defaults to the number of CPUs.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unsupported compression %s" % compression)
+    dtype = numpy.dtype(dtype)
+    total = sum(class_lengths)
+    if len(original_labels) != total:
+        raise ValueError("Number of labels missmatches sum of class lengths")
+    sample_nbytes = int(numpy.prod(shape)) * dtype.itemsize
+    if os.path.getsize(samples_filename) != total * sample_nbytes:
+        raise ValueError("Wrong data file size of %s" % samples_filename)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    header_path = os.path.join(path, HEADER_FILE)
+    if os.path.exists(header_path):
+        os.remove(header_path)
+
+    names_indices = {}
+    label_values = []
+    labels = numpy.empty(total, dtype=numpy.int32)
+    for index, (name, value) in enumerate(original_labels):
+        name_index = names_indices.get(name)
+        if name_index is None:
+            name_index = names_indices[name] = len(label_values)
+            label_values.append(int(value))
+        labels[index] = name_index
+    numpy.save(os.path.join(path, LABELS_FILE), labels)
+    if matrixes is not None:
+        numpy.save(os.path.join(path, MEAN_FILE), matrixes[0])
+        numpy.save(os.path.join(path, RDISP_FILE), matrixes[1])
+
+    starts = list(range(0, total, samples_per_shard))
+    shards = [min(samples_per_shard, total - start) for start in starts]
+    jobs = [(samples_filename, path, shard_index, start, count,
+             sample_nbytes, compression, level)
+            for shard_index, (start, count) in enumerate(zip(starts, shards))]
+    pool = Pool(processes)
+    try:
+        sizes = pool.map(write_shard, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    label_names = [None] * len(label_values)
+    for name, name_index in names_indices.items():
+        label_names[name_index] = name
+    header = {"version": FORMAT_VERSION, "shape": list(shape),
+              "dtype": dtype.str, "class_lengths": list(class_lengths),
+              "compression": compression, "label_names": label_names,
+              "label_values": label_values, "shards": shards}
+    with open(header_path + ".tmp", "w") as fout:
+        json.dump(header, fout)
+    os.rename(header_path + ".tmp", header_path)
+    return sum(sizes)
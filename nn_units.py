@@ -37,6 +37,7 @@ under the License.
 
 from __future__ import division
 from collections import defaultdict
+import cuda4py.blas as cublas
 import gc
 import numpy
 import logging
@@ -48,7 +49,7 @@ from veles.avatar import Avatar
 from veles.external.prettytable import PrettyTable
 from veles.distributable import IDistributable
 from veles.loader import Loader
-from veles.memory import reshape_transposed, roundup, Array
+from veles.memory import roundup, Array
 from veles.mutable import Bool
 from veles.accelerated_units import AcceleratedUnit, AcceleratedWorkflow
 import veles.prng as prng
@@ -361,6 +362,12 @@ class GradientDescentBase(AcceleratedUnit):
         gradient_changed: when True, slave will send gradients to master
             (assigned to True just before the run call, so it can be set to
             False inside ocl_run, numpy_run if necessary).
+        accumulate_steps: the number of minibatches the gradient is averaged
+            over before it is applied.
+        accumulated_steps: the number of the current minibatch in the
+            accumulation window (starting from 1).
+        accumulation_complete: the gradient is applied after the current
+            minibatch.
         ocl_set_const_args: True when constant arguments for the kernel
                             had been changed and need to be set again.
     """
@@ -437,10 +444,43 @@ class GradientDescentBase(AcceleratedUnit):
         # Sets to True when gradient changes
         self.gradient_changed = False
 
+        # Large batch mode: gradient_weights and gradient_bias are the mean
+        # of accumulate_steps minibatches, which is applied at once.
+        # accumulated_steps and accumulation_complete are linked from
+        # DecisionGD by StandardWorkflow.link_gds().
+        self.accumulate_steps = kwargs.get("accumulate_steps", 1)
+        self.accumulated_steps = 1
+        self.accumulation_complete = True
+        # Ones to sum err_output with gemm if accumulate_steps > 1
+        self.minibatch_ones = Array()
+
         # Gradient will be applied to weights immediately just after computing
         self.apply_gradient = kwargs.get("apply_gradient",
                                          not workflow.is_slave)
 
+    def init_unpickled(self):
+        super(GradientDescentBase, self).init_unpickled()
+        # (s, name) -> buffer of the numpy updates
+        self._numpy_scratch_ = {}
+        # Snapshots taken before the gradient accumulation was added
+        if not hasattr(self, "accumulate_steps"):
+            self.accumulate_steps = 1
+        if not hasattr(self, "accumulated_steps"):
+            self.accumulated_steps = 1
+        if not hasattr(self, "accumulation_complete"):
+            self.accumulation_complete = True
+        if not hasattr(self, "minibatch_ones"):
+            self.minibatch_ones = Array()
+
+    @property
+    def accumulation_factors(self):
+        """Returns:
+            tuple (alpha, beta) such that alpha * minibatch gradient +
+            beta * gradient is the mean over the current accumulation window.
+        """
+        steps = self.accumulated_steps
+        return 1.0 / steps, (steps - 1.0) / steps
+
     @property
     def current_batch_size(self):
         batch_size = getattr(self, "batch_size", None)
@@ -514,6 +554,16 @@ class GradientDescentBase(AcceleratedUnit):
             else:
                 assert self.gradient_bias_with_moment.size == self.bias.size
 
+        if (self.accumulate_steps > 1 and self.include_bias and self.bias and
+                self.need_gradient_weights):
+            # gpu_bias_update() sums err_output with gemm, the rows of
+            # err_output are the bias-sized vectors
+            rows = self.err_output.size // self.bias.size
+            if not self.minibatch_ones or self.minibatch_ones.size != rows:
+                self.minibatch_ones.reset(numpy.ones(
+                    rows, dtype=self.err_output.dtype))
+            self.init_vectors(self.minibatch_ones)
+
         dtype = self.err_output.dtype
         if self.need_err_input:
             if self.err_input:
@@ -540,8 +590,44 @@ class GradientDescentBase(AcceleratedUnit):
             self.accumulated_gradient_weights, self.accumulated_gradient_bias,
             self.gradient_weights_with_moment, self.gradient_bias_with_moment)
 
+    def numpy_scratch(self, s, name, like, dtype=None):
+        """Returns the cached buffer of the same shape as like and
+        the same dtype (unless specified) for the update of s ("weights" or
+        "bias").
+        """
+        key = s, name
+        dtype = like.dtype if dtype is None else numpy.dtype(dtype)
+        buffer = self._numpy_scratch_.get(key)
+        if (buffer is None or buffer.shape != like.shape or
+                buffer.dtype != dtype):
+            buffer = self._numpy_scratch_[key] = numpy.empty_like(
+                like, dtype=dtype)
+        return buffer
+
+    def minibatch_gradient(self, s):
+        """Returns the array for the gradient of s over the current
+        minibatch: gradient_weights or gradient_bias itself unless the
+        gradient is being accumulated.
+        """
+        vec = getattr(self, "gradient_" + s)
+        if self.accumulated_steps > 1:
+            return self.numpy_scratch(s, "minibatch", vec.mem)
+        return vec.mem
+
+    def average_gradient(self, s, gradient):
+        """Includes the gradient returned by minibatch_gradient() into the
+        mean over the accumulation window.
+        """
+        vec = getattr(self, "gradient_" + s)
+        if gradient is vec.mem:
+            return
+        alpha, beta = self.accumulation_factors
+        vec.mem *= beta
+        gradient *= alpha
+        vec.mem += gradient
+
     def gpu_weights_update(self):
-        if not self.need_gradient_weights:
+        if not self.need_gradient_weights or not self.accumulation_complete:
             return
 
         self.unmap_vectors(
@@ -576,6 +662,20 @@ class GradientDescentBase(AcceleratedUnit):
     def gpu_bias_update(self):
         if not self.need_gradient_weights or not self.include_bias:
             return
+        if self.accumulate_steps > 1:
+            # The kernel takes the mean gradient instead of reducing
+            # err_output (PRECOMPUTED_GRADIENT)
+            self.unmap_vectors(self.err_output, self.gradient_bias,
+                               self.minibatch_ones)
+            self.np_alpha[0], self.np_beta[0] = self.accumulation_factors
+            self.gemm_(
+                self.device.blas, cublas.CUBLAS_OP_N, cublas.CUBLAS_OP_N,
+                self.bias.size, 1, self.minibatch_ones.size,
+                self.np_alpha, self.err_output.devmem,
+                self.minibatch_ones.devmem,
+                self.np_beta, self.gradient_bias.devmem)
+            if not self.accumulation_complete:
+                return
 
         self.unmap_vectors(
             self.err_output, self.bias, self.gradient_bias,
@@ -662,8 +762,10 @@ class GradientDescentBase(AcceleratedUnit):
         self.gradient_moment_bias = data[5]
         self.fill_zeros(self.gradient_weights_with_moment)
         self.fill_zeros(self.gradient_bias_with_moment)
-        self.fill_zeros(self.gradient_weights)
-        self.fill_zeros(self.gradient_bias)
+        if self.accumulation_complete:
+            # Otherwise, the gradient is being accumulated
+            self.fill_zeros(self.gradient_weights)
+            self.fill_zeros(self.gradient_bias)
         self.fill_zeros(self.accumulated_gradient_weights)
         self.fill_zeros(self.accumulated_gradient_bias)
 
@@ -706,20 +808,45 @@ class GradientDescentBase(AcceleratedUnit):
 
     @staticmethod
     def numpy_gradient_step(weight, gradient, lr, factor_l12, l1_vs_l2,
-                            factor_ortho=0, weights_transposed=False):
-        gradient = gradient.copy()
-        gradient += factor_l12 * ((1.0 - l1_vs_l2) * weight +
-                                  0.5 * l1_vs_l2 * numpy.sign(weight))
+                            factor_ortho=0, weights_transposed=False,
+                            out=None, scratch=None):
+        """Returns lr * (gradient + regularization). If out and scratch
+        (both of the shape of weight and distinct from gradient) are
+        specified, it is computed in out without temporary arrays.
+        """
+        if out is None:
+            out = numpy.empty_like(gradient)
+        if scratch is None:
+            scratch = numpy.empty_like(weight)
+        if factor_l12:
+            numpy.multiply(weight, 1.0 - l1_vs_l2, out=out)
+            numpy.sign(weight, out=scratch)
+            scratch *= 0.5 * l1_vs_l2
+            out += scratch
+            out *= factor_l12
+            out += gradient
+        else:
+            out[:] = gradient
         if factor_ortho:
-            col_sums = (reshape_transposed(weight).sum(axis=1)
-                        if weights_transposed else weight.sum(axis=0))
-            for i, row in enumerate(gradient):
-                row += (col_sums - weight[i]) * factor_ortho / weight.shape[0]
-        gradient *= lr
-        return gradient
+            # Each weight is pulled towards the sum of the weights of the
+            # same input over all the neurons (rows, or columns if
+            # transposed), like compute_col_sums and gradient_step_ortho do
+            if weights_transposed:
+                numpy.subtract(weight.sum(axis=1)[:, numpy.newaxis], weight,
+                               out=scratch)
+                n_neurons = weight.shape[1]
+            else:
+                numpy.subtract(weight.sum(axis=0), weight, out=scratch)
+                n_neurons = weight.shape[0]
+            scratch *= factor_ortho
+            scratch /= n_neurons
+            out += scratch
+        out *= lr
+        return out
 
     def run(self):
-        self.gradient_changed = True
+        # Slaves send the gradient once per accumulation window
+        self.gradient_changed = bool(self.accumulation_complete)
         super(GradientDescentBase, self).run()
         self.ocl_set_const_args = False
 
@@ -67,13 +67,17 @@ class LocalResponseNormalizer(AcceleratedUnit):
         source_array must be a 4-dimensional array (channel dim is the last).
         """
         assert len(source_array.shape) == 4
-        subsums = numpy.empty_like(source_array)
         num_of_chans = source_array.shape[3]
-        for i in range(num_of_chans):
-            min_index = max(0, i - int(window_size / 2))
-            max_index = min(i + int(window_size / 2), num_of_chans - 1)
-            array_slice = source_array[:, :, :, min_index: max_index + 1]
-            subsums[:, :, :, i] = numpy.sum(array_slice, axis=3)
+        half = int(window_size / 2)
+        # Window sums are differences of the channel prefix sums
+        prefix_sums = numpy.zeros(
+            source_array.shape[:3] + (num_of_chans + 1,),
+            dtype=source_array.dtype)
+        numpy.cumsum(source_array, axis=3, out=prefix_sums[:, :, :, 1:])
+        chans = numpy.arange(num_of_chans)
+        subsums = prefix_sums.take(
+            numpy.minimum(chans + half, num_of_chans - 1) + 1, axis=3)
+        subsums -= prefix_sums.take(numpy.maximum(chans - half, 0), axis=3)
         return subsums
 
     # IDistributable implementation
@@ -152,7 +156,7 @@ class LRNormalizerForward(LocalResponseNormalizer, Forward):
         subsums += self.k
         subsums **= self.beta
 
-        numpy.copyto(self.output.mem, self.input.mem / subsums)
+        numpy.divide(self.input.mem, subsums, out=self.output.mem)
 
     def _gpu_run(self):
         self.unmap_vectors(self.input, self.output)
@@ -229,36 +233,26 @@ class LRNormalizerBackward(LocalResponseNormalizer, GradientDescentBase):
         assert len(self.input.shape) == 4
         assert self.input.shape == self.err_output.shape
 
-        num_of_chans = self.input.shape[3]
-
-        input_squared = numpy.square(self.input.mem)
-        input_subsums = self._subsums(input_squared, self.n)
-
-        input_subsums *= self.alpha
-        input_subsums += self.k
-
-        input_subsums_powered = numpy.power(input_subsums, (self.beta + 1))
-
+        inp = self.input.mem
         err_h = self.err_input.mem
         err_y = self.err_output.mem
 
-        for i in range(num_of_chans):
-            min_index = max(0, i - int(self.n / 2))
-            max_index = min(i + int(self.n / 2), num_of_chans - 1)
-
-            delta_h = numpy.zeros(dtype=numpy.float64,
-                                  shape=err_h[:, :, :, i].shape)
-            for j in range(min_index, max_index + 1):
-                dh = numpy.zeros(shape=delta_h.shape, dtype=numpy.float64)
-                if i == j:
-                    dh += input_subsums[:, :, :, j]
-                dh -= (2 * self.beta * self.alpha *
-                       self.input.mem[:, :, :, i] *
-                       self.input.mem[:, :, :, j])
-                dh *= (err_y[:, :, :, j] /
-                       input_subsums_powered[:, :, :, j])
-                delta_h += dh
-            numpy.copyto(err_h[:, :, :, i], delta_h)
+        input_subsums = self._subsums(numpy.square(inp), self.n)
+        input_subsums *= self.alpha
+        input_subsums += self.k
+        input_subsums_powered = numpy.power(input_subsums, self.beta)
+
+        # The windows are symmetric, so the cross-channel term of channel i
+        # is the window sum of x_j * err_y_j / s_j^(beta + 1)
+        cross = numpy.multiply(inp, err_y)
+        cross /= input_subsums_powered
+        cross /= input_subsums
+        cross = self._subsums(cross, self.n)
+        cross *= -2 * self.beta * self.alpha
+        cross *= inp
+
+        numpy.divide(err_y, input_subsums_powered, out=err_h)
+        err_h += cross
 
     def _gpu_run(self):
         self.unmap_vectors(self.err_output, self.input, self.err_input)
@@ -27,8 +27,22 @@ void bias_update(__global const dtype    *err_output,
 				 const dtype             acc_alpha,
 				 const dtype             acc_beta,
 				 const dtype             gd_alpha,
-				 const dtype             gd_beta) {
+				 const dtype             gd_beta
+#if USE_ADAM > 0
+                 , __global dtype        *adam_first,
+                 __global dtype          *adam_second,
+                 const dtype             adam_beta1,
+                 const dtype             adam_beta2,
+                 const dtype             adam_epsilon,
+                 const dtype             adam_lr
+#endif
+                 ) {
 
+#if PRECOMPUTED_GRADIENT > 0
+  // The mean gradient over several minibatches is already in gradient
+  int bx = get_group_id(0);
+  int tx = get_local_id(0);
+#else
   #define A err_output
   #define A_WIDTH BIAS_SIZE
   #define A_HEIGHT OUTPUT_SIZE
@@ -40,6 +54,7 @@ void bias_update(__global const dtype    *err_output,
   #undef A_HEIGHT
   #undef A_WIDTH
   #undef A
+#endif
 
   #include "bias_update.store_output.cl"
 }
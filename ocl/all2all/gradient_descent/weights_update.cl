@@ -21,6 +21,14 @@ __kernel void weights_update(__global dtype          *weights,
 #if USE_ORTHO > 0
                              , const dtype           factor_ortho,
                              __global const dtype    *col_sums
+#endif
+#if USE_ADAM > 0
+                             , __global dtype        *adam_first,
+                             __global dtype          *adam_second,
+                             const dtype             adam_beta1,
+                             const dtype             adam_beta2,
+                             const dtype             adam_epsilon,
+                             const dtype             adam_lr
 #endif
                     ) {
   size_t idx = get_global_id(0);
@@ -8,8 +8,22 @@ gd += gd_alpha * acc;
 #endif
 
 #if USE_MOMENT > 0
+#if USE_NESTEROV > 0
+dtype gd_raw = gd;
+#endif
 gd += gradient_with_moment[idx] * moment;
 gradient_with_moment[idx] = gd;
+#if USE_NESTEROV > 0
+gd = gd * moment + gd_raw;
+#endif
+#endif
+
+#if USE_ADAM > 0 && APPLY_GRADIENT > 0
+dtype adam_m = adam_beta1 * adam_first[idx] + (1 - adam_beta1) * gd;
+dtype adam_v = adam_beta2 * adam_second[idx] + (1 - adam_beta2) * gd * gd;
+adam_first[idx] = adam_m;
+adam_second[idx] = adam_v;
+gd = adam_lr * adam_m / (sqrt(adam_v) + lr * adam_epsilon);
 #endif
 
 #if APPLY_GRADIENT > 0
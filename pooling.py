@@ -50,7 +50,6 @@ under the License.
 
 
 from __future__ import division
-from itertools import product
 import logging
 import numpy
 import time
@@ -117,6 +116,61 @@ class PoolingBase(Unit):
     def n_channels(self):
         return self.input.size // (self.input_batch_size * self.sx * self.sy)
 
+    def init_unpickled(self):
+        super(PoolingBase, self).init_unpickled()
+        self._numpy_padded_ = None
+
+    def numpy_padded(self, data, fill):
+        """Returns the images extended to the right and to the bottom with
+        `fill` so that partial windows become complete.
+        """
+        sy = (self.out_sy - 1) * self.sliding[1] + self.ky
+        sx = (self.out_sx - 1) * self.sliding[0] + self.kx
+        data = data.reshape(data.shape[0], self.sy, self.sx, self.n_channels)
+        if (sy, sx) == (self.sy, self.sx):
+            return data
+        shape = (data.shape[0], sy, sx, self.n_channels)
+        padded = self._numpy_padded_
+        if (padded is None or padded.shape != shape or
+                padded.dtype != data.dtype):
+            padded = self._numpy_padded_ = numpy.empty(shape, data.dtype)
+        padded[:, self.sy:] = fill
+        padded[:, :, self.sx:] = fill
+        padded[:, :self.sy, :self.sx] = data
+        return padded
+
+    def numpy_windows(self, padded):
+        """Yields (i, j, view) for every position (i, j) inside the pooling
+        window, where view is the output shaped strided view of the padded
+        images at that position in every window.
+        """
+        sly, slx = self.sliding[1], self.sliding[0]
+        out_sy, out_sx = self.out_sy, self.out_sx
+        for i in range(self.ky):
+            for j in range(self.kx):
+                yield i, j, padded[:, i:i + sly * out_sy:sly,
+                                   j:j + slx * out_sx:slx]
+
+    def numpy_window_offsets(self, batch_size):
+        """Returns the flat input offsets of the top left window corners.
+        """
+        shape = (batch_size, self.out_sy, self.out_sx, self.n_channels)
+        batch, y, x, ch = (
+            numpy.arange(n).reshape([-1 if i == d else 1 for d in range(4)])
+            for i, n in enumerate(shape))
+        return (((batch * self.sy + y * self.sliding[1]) * self.sx +
+                 x * self.sliding[0]) * self.n_channels + ch)
+
+    def numpy_window_shapes(self):
+        """Returns the real heights and widths of the windows, partial
+        windows included, as arrays broadcastable to the output shape.
+        """
+        ny = numpy.minimum(
+            self.ky, self.sy - numpy.arange(self.out_sy) * self.sliding[1])
+        nx = numpy.minimum(
+            self.kx, self.sx - numpy.arange(self.out_sx) * self.sliding[0])
+        return ny.reshape(1, -1, 1, 1), nx.reshape(1, 1, -1, 1)
+
 
 @implementer(IOpenCLUnit, ICUDAUnit, INumpyUnit, IDistributable)
 class Pooling(PoolingBase, nn_units.Forward, TriviallyDistributable):
@@ -224,19 +278,7 @@ class Pooling(PoolingBase, nn_units.Forward, TriviallyDistributable):
         self._gpu_run()
 
     def numpy_run(self):
-        self.input.map_read()
-        self.output.map_invalidate()
-        for batch, ch, out_x, out_y in product(*map(range, (
-                self.input_batch_size, self.n_channels) + self.out_sxy)):
-            x1 = out_x * self.sliding[0]
-            y1 = out_y * self.sliding[1]
-            test_idx = x1 + self.kx
-            x2 = test_idx if test_idx <= self.sx else self.sx
-            test_idx = y1 + self.ky
-            y2 = test_idx if test_idx <= self.sy else self.sy
-            cut = self.input.mem[batch, y1:y2, x1:x2, ch]
-            val = self.numpy_run_cut(cut, (batch, y1, x1, ch, out_y, out_x))
-            self.output.mem[batch, out_y, out_x, ch] = val
+        raise NotImplementedError()
 
     def run(self):
         t1 = time.time()
@@ -294,22 +336,6 @@ class OffsetPooling(Pooling):
         self.input_offset.unmap()
         super(OffsetPooling, self).cuda_run()
 
-    def numpy_run(self):
-        self.input_offset.map_invalidate()
-        super(OffsetPooling, self).numpy_run()
-
-    def numpy_run_cut(self, cut, coords):
-        batch, y1, x1, ch, out_y, out_x = coords
-        cut_index = self.numpy_run_cut_offset(
-            cut, numpy.ravel_multi_index((batch, out_y, out_x, ch),
-                                         self.output.shape))
-        i, j = numpy.unravel_index(cut_index, cut.shape)
-        idx = numpy.ravel_multi_index((batch, y1 + i, x1 + j, ch),
-                                      self.input.shape)
-        val = numpy.ravel(self.input.mem)[idx]
-        self.input_offset.mem[batch, out_y, out_x, ch] = idx
-        return val
-
 
 class MaxPoolingBase(OffsetPooling):
     """MaxPooling forward propagation base class.
@@ -321,6 +347,32 @@ class MaxPoolingBase(OffsetPooling):
         super(MaxPoolingBase, self).init_unpickled()
         self._kernel_name = "max_pooling"
 
+    def numpy_run(self):
+        self.input.map_read()
+        self.output.map_invalidate()
+        self.input_offset.map_invalidate()
+
+        # The first element of every window is always inside the image
+        windows = self.numpy_windows(self.numpy_padded(
+            self.input.mem, self.NUMPY_PADDING_VALUE))
+        _, _, view = next(windows)
+        output = self.output.mem
+        output[:] = view
+        best = self.numpy_compared_values(output)
+        if best is output:
+            best = output.copy()
+        lucky = numpy.zeros(output.shape, dtype=numpy.int32)
+        for i, j, view in windows:
+            values = self.numpy_compared_values(view)
+            hit = numpy.greater(values, best)
+            numpy.copyto(best, values, where=hit)
+            numpy.copyto(output, view, where=hit)
+            numpy.copyto(lucky, i * self.kx + j, where=hit)
+        row, col = numpy.divmod(lucky, self.kx)
+        self.input_offset.mem[:] = (
+            self.numpy_window_offsets(output.shape[0]) +
+            (row * self.sx + col) * self.n_channels)
+
     def ocl_init(self):
         super(MaxPoolingBase, self).ocl_init()
         self.set_args()
@@ -335,9 +387,10 @@ class MaxPooling(MaxPoolingBase):
     """
 
     MAPPING = {"max_pooling"}
+    NUMPY_PADDING_VALUE = -numpy.inf
 
-    def numpy_run_cut_offset(self, cut, index):
-        return cut.argmax()
+    def numpy_compared_values(self, values):
+        return values
 
 
 class MaxAbsPooling(MaxPoolingBase):
@@ -356,13 +409,14 @@ class MaxAbsPooling(MaxPoolingBase):
     """
 
     MAPPING = {"maxabs_pooling"}
+    NUMPY_PADDING_VALUE = 0
 
     def __init__(self, workflow, **kwargs):
         super(MaxAbsPooling, self).__init__(workflow, **kwargs)
         self.sources_["pooling"] = {"ABS_VALUES": 1}
 
-    def numpy_run_cut_offset(self, cut, index):
-        return numpy.abs(cut).argmax()
+    def numpy_compared_values(self, values):
+        return numpy.abs(values)
 
 
 class StochasticPoolingBase(OffsetPooling):
@@ -414,7 +468,12 @@ class StochasticPoolingBase(OffsetPooling):
 
     def numpy_run(self):
         self.uniform.numpy_fill(self.output_size << 1)
-        super(StochasticPoolingBase, self).numpy_run()
+        self.input.map_read()
+        self.output.map_invalidate()
+        self.input_offset.map_invalidate()
+        offsets = self.numpy_stochastic_offsets()
+        self.input_offset.mem[:] = offsets
+        self.output.mem[:] = numpy.take(self.input.mem, offsets)
 
     def ocl_run(self):
         if not self._rand_set:
@@ -434,9 +493,39 @@ class StochasticPoolingBase(OffsetPooling):
         rnd = self.uniform.output.mem.view(dtype=numpy.uint16)[index]
         return rnd * vsum / 65536
 
-    def calculate_random_index_cpu(self, cut, index):
+    def calculate_random_index_cpu(self, size, index):
         rnd = self.uniform.output.mem.view(dtype=numpy.uint16)[index]
-        return int(rnd * cut.size >> 16)
+        return rnd.astype(numpy.int64) * size >> 16
+
+    def numpy_stochastic_offsets(self):
+        """Chooses the element of each window with the probability
+        proportional to its weight by searching the random position in the
+        cumulative sums of the window weights.
+
+        Returns:
+            The flat input offsets of the chosen elements.
+        """
+        # Padded elements have zero weight and are never chosen
+        weights = numpy.array([
+            self.numpy_weights(view) for _, _, view in
+            self.numpy_windows(self.numpy_padded(self.input.mem, 0))])
+        cumsum = numpy.cumsum(weights, axis=0, out=weights)
+        vsum = cumsum[-1]
+        index = numpy.s_[:self.output_size]
+        position = self.calculate_position_cpu(index, vsum.ravel()).reshape(
+            vsum.shape)
+        lucky = numpy.sum(cumsum < position, axis=0)
+        row, col = numpy.divmod(lucky, self.kx)
+
+        # Windows without positive weights choose uniformly
+        ny, nx = self.numpy_window_shapes()
+        ny, nx = numpy.broadcast_arrays(ny, nx, vsum)[:2]
+        zero = vsum == 0
+        random = self.calculate_random_index_cpu(
+            ny[zero] * nx[zero], numpy.flatnonzero(zero))
+        row[zero], col[zero] = numpy.divmod(random, nx[zero])
+        return (self.numpy_window_offsets(vsum.shape[0]) +
+                (row * self.sx + col) * self.n_channels)
 
 
 class StochasticPooling(StochasticPoolingBase):
@@ -445,18 +534,8 @@ class StochasticPooling(StochasticPoolingBase):
 
     MAPPING = {"stochastic_pooling"}
 
-    def numpy_run_cut_offset(self, cut, index):
-        vsum = numpy.sum(cut[cut > 0])
-        if vsum == 0:
-            return self.calculate_random_index_cpu(cut, index)
-        position = self.calculate_position_cpu(index, vsum)
-        vsum = 0
-        for i in range(cut.size):
-            val = cut.ravel()[i]
-            if val > 0:
-                vsum += val
-            if position <= vsum:
-                return i
+    def numpy_weights(self, values):
+        return numpy.maximum(values, 0)
 
 
 class StochasticAbsPooling(StochasticPoolingBase):
@@ -469,17 +548,8 @@ class StochasticAbsPooling(StochasticPoolingBase):
         super(StochasticAbsPooling, self).__init__(workflow, **kwargs)
         self.sources_["pooling"] = {"ABS_VALUES": 1}
 
-    def numpy_run_cut_offset(self, cut, index):
-        vsum = numpy.sum(numpy.abs(cut))
-        if vsum == 0:
-            return self.calculate_random_index_cpu(cut, index)
-        position = self.calculate_position_cpu(index, vsum)
-        vsum = 0
-        for i in range(cut.size):
-            val = cut.ravel()[i]
-            vsum += abs(val)
-            if position <= vsum:
-                return i
+    def numpy_weights(self, values):
+        return numpy.abs(values)
 
 
 class StochasticPoolingDepooling(StochasticPooling):
@@ -502,7 +572,13 @@ class StochasticPoolingDepooling(StochasticPooling):
         self.set_arg(0, self.input)
 
     def numpy_run(self):
-        raise NotImplementedError()
+        self.uniform.numpy_fill(self.output_size << 1)
+        self.input.map_write()
+        offsets = self.numpy_stochastic_offsets()
+        # The windows tile the whole input, so only the chosen values survive
+        values = numpy.take(self.input.mem, offsets)
+        self.input.mem.fill(0)
+        numpy.put(self.input.mem, offsets, values)
 
 
 class StochasticAbsPoolingDepooling(StochasticPoolingDepooling):
@@ -518,6 +594,9 @@ class StochasticAbsPoolingDepooling(StochasticPoolingDepooling):
         super(StochasticAbsPoolingDepooling, self).init_unpickled()
         self.sources_["pooling"]["ABS_VALUES"] = 1
 
+    def numpy_weights(self, values):
+        return numpy.abs(values)
+
 
 class AvgPooling(Pooling):
     """AvgPooling forward propagation.
@@ -544,5 +623,13 @@ class AvgPooling(Pooling):
         super(AvgPooling, self).cuda_init()
         self.set_args(self.input, self.output)
 
-    def numpy_run_cut(self, cut, coords):
-        return numpy.sum(cut) / cut.size
+    def numpy_run(self):
+        self.input.map_read()
+        self.output.map_invalidate()
+        output = self.output.mem
+        output[:] = 0
+        for _, _, view in self.numpy_windows(
+                self.numpy_padded(self.input.mem, 0)):
+            output += view
+        ny, nx = self.numpy_window_shapes()
+        output /= ny * nx
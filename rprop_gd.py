@@ -42,88 +42,113 @@ from veles.znicz.gd import GradientDescent
 
 
 class GDRProp(GradientDescent):
-    MAPPING = {"rprop_gd"}
-    """
-    Only CPU version is implemented
+    """RProp- and iRProp- (Igel, Husken, 2000) for
+    :class:`veles.znicz.all2all.All2All`.
+
+    The gradient is computed by :class:`veles.znicz.gd.GradientDescent`
+    (so it can be accumulated over the whole train set with
+    DecisionGD.accumulate_steps), only its sign is used. Each weight has its
+    own learning rate which is multiplied by increase if the sign of the
+    gradient did not change since the previous step and by decrease if it
+    did. iRProp- also skips the step of the weight when the sign changes.
+    Only CPU version is implemented.
+
+    Attributes:
+        variant: "rprop-" or "irprop-".
+        weight_lrs: the learning rates of the weights.
+        bias_lrs: the learning rates of the bias.
+        prev_gradient_weights: the gradient of the previous step.
+        prev_gradient_bias
     """
+    MAPPING = {"rprop_gd"}
+    VARIANTS = ("rprop-", "irprop-")
+
     def __init__(self, workflow, **kwargs):
         super(GDRProp, self).__init__(workflow, **kwargs)
-        self.initial_learning_rate = 0.01
-        self.min_learning_rate = 10 ** -6
-        self.max_learning_rate = 1
-        self.increase = 1.05
-        self.decrease = 0.80
+        self.initial_learning_rate = kwargs.get("initial_learning_rate", 0.01)
+        self.min_learning_rate = kwargs.get("min_learning_rate", 10 ** -6)
+        self.max_learning_rate = kwargs.get("max_learning_rate", 1)
+        self.increase = kwargs.get("increase", 1.05)
+        self.decrease = kwargs.get("decrease", 0.80)
+        self.variant = kwargs.get("variant", "rprop-")
+        if self.variant not in self.VARIANTS:
+            raise ValueError("variant must be one of %s (got %s)" %
+                             (self.VARIANTS, self.variant))
 
         self.weight_lrs = memory.Array()
         self.bias_lrs = memory.Array()
+        self.prev_gradient_weights = memory.Array()
+        self.prev_gradient_bias = memory.Array()
+
+    def init_unpickled(self):
+        super(GDRProp, self).init_unpickled()
+        # Snapshots taken before iRProp- was added
+        if not hasattr(self, "variant"):
+            self.variant = "rprop-"
+        if not hasattr(self, "prev_gradient_weights"):
+            self.prev_gradient_weights = memory.Array()
+        if not hasattr(self, "prev_gradient_bias"):
+            self.prev_gradient_bias = memory.Array()
 
     def initialize(self, device, **kwargs):
         super(GDRProp, self).initialize(device=device, **kwargs)
-        self.weight_lrs.mem = numpy.zeros(
-            shape=self.weights.mem.shape, dtype=self.weights.mem.dtype)
-        self.bias_lrs.mem = numpy.zeros(
-            shape=self.bias.mem.shape, dtype=self.bias.mem.dtype)
-
-        self.weight_lrs.initialize(self.device)
-        self.bias_lrs.initialize(self.device)
-
-    def numpy_weights_update(self):
-        self.input.map_read()
-        self.err_output.map_read()
-        self.weights.map_write()
-        self.gradient_weights.map_write()
-        gradient = numpy.dot(
-            self.err_output.mem.swapaxes(0, 1),
-            self.input.mem.reshape((self.input.mem.shape[0],
-                                    numpy.prod(self.input.mem.shape[1:]))))
-
-        grad_sign = numpy.sign(gradient)
-        grad_delta_sign = numpy.sign(self.gradient_weights.mem * gradient)
-
-        increase_ratios = numpy.where(grad_delta_sign > 0, self.increase, 1)
-        decrease_ratios = numpy.where(grad_delta_sign < 0, self.decrease, 1)
-
-        self.weight_lrs.mem *= increase_ratios
-        self.weight_lrs.mem * decrease_ratios
-
-        self.weight_lrs.mem[:] = self.weight_lrs.mem.clip(
-            self.min_learning_rate, self.max_learning_rate)[:]
-
-        if self.weights_transposed:
-            self.weights.mem -= (grad_sign * self.weight_lrs.mem).transpose()
-        else:
-            self.weights.mem -= grad_sign * self.weight_lrs.mem
-
-        self.gradient_weights.mem[:] = gradient[:]
-
-    def numpy_bias_update(self):
-        if not self.include_bias:
-            return
-
-        self.err_output.map_read()
-        self.bias.map_write()
-        self.gradient_bias.map_write()
-
-        gradient = numpy.sum(self.err_output.mem, axis=0)
-        grad_sign = numpy.sign(gradient)
-        grad_delta_sign = numpy.sign(self.gradient_bias.mem * gradient)
-        increase_ratios = numpy.where(grad_delta_sign > 0, self.increase, 1)
-        decrease_ratios = numpy.where(grad_delta_sign < 0, self.decrease, 1)
-        self.bias_lrs.mem *= increase_ratios
-        self.bias_lrs.mem * decrease_ratios
-
-        self.bias_lrs.mem[:] = self.bias_lrs.mem.clip(
-            self.min_learning_rate, self.max_learning_rate)[:]
-
-        self.bias.mem -= grad_sign * self.bias_lrs.mem
-        self.gradient_bias.mem[:] = gradient[:]
-
-    def ocl_weights_update(self):
-        pass
-
-    def ocl_bias_update(self):
-        pass
+        # The state is kept if it was restored from a snapshot
+        for s, like in (("weights", self.weights), ("bias", self.bias)):
+            if not like:
+                continue
+            lrs, prev = self.rprop_vectors(s)
+            if not lrs or lrs.shape != like.shape:
+                lrs.reset(numpy.full_like(like.mem,
+                                          self.initial_learning_rate))
+                prev.reset(numpy.zeros_like(like.mem))
+            elif not prev or prev.shape != like.shape:
+                prev.reset(numpy.zeros_like(like.mem))
+            self.init_vectors(lrs, prev)
+
+    def rprop_vectors(self, s):
+        """Returns:
+            tuple (learning rates, previous gradient) of s ("weights" or
+            "bias").
+        """
+        if s == "weights":
+            return self.weight_lrs, self.prev_gradient_weights
+        return self.bias_lrs, self.prev_gradient_bias
+
+    def numpy_update(self, s):
+        """Applies the RProp step to s using gradient_weights or
+        gradient_bias. Works in place, without allocations.
+        """
+        vec = getattr(self, s)
+        grad_vec = getattr(self, "gradient_" + s)
+        lrs, prev = self.rprop_vectors(s)
+        grad_vec.map_read()
+        for v in (vec, lrs, prev):
+            v.map_write()
+        gradient = grad_vec.mem
+        scratch = self.numpy_scratch(s, "scratch", vec.mem)
+        mask = self.numpy_scratch(s, "mask", vec.mem, numpy.bool_)
+
+        # Sign agreement with the previous step
+        numpy.multiply(gradient, prev.mem, out=scratch)
+        numpy.greater(scratch, 0, out=mask)
+        numpy.multiply(lrs.mem, self.increase, out=lrs.mem, where=mask)
+        numpy.less(scratch, 0, out=mask)
+        numpy.multiply(lrs.mem, self.decrease, out=lrs.mem, where=mask)
+        numpy.clip(lrs.mem, self.min_learning_rate, self.max_learning_rate,
+                   out=lrs.mem)
+
+        numpy.copyto(prev.mem, gradient)
+        if self.variant == "irprop-":
+            # No step and no adaptation on the next step after the change
+            numpy.copyto(prev.mem, 0, where=mask)
+        numpy.sign(prev.mem, out=scratch)
+        scratch *= lrs.mem
+        if self.apply_gradient:
+            vec.mem -= scratch
 
     def ocl_run(self):
         # TODO(a.golovizin): implement OCL version
         self.numpy_run()
+
+    def cuda_run(self):
+        self.numpy_run()
@@ -58,6 +58,7 @@ from veles.znicz.evaluator import EvaluatorsRegistry
 # Important: do not remove unused imports! It will prevent MatchingObject
 # metaclass from adding the mapping in the corresponding modules
 from veles.znicz import gd, gd_conv, gd_pooling  # pylint: disable=W0611
+from veles.znicz.gd_deconv import GDDeconv
 from veles.znicz.gd_pooling import GDPooling
 from veles.znicz.nn_rollback import NNRollback
 from veles.znicz.standard_workflow_base import BaseWorkflowConfig, \
@@ -305,6 +306,9 @@ class StandardWorkflow(StandardWorkflowBase):
         :class:`veles.znicz.nn_units.GradientDescentBase` descendant,
         :class:`veles.znicz.decision.DecisionBase` descendant and
         corresponded :class:`veles.znicz.nn_units.ForwardBase` descendant unit.
+        If the decision has accumulate_steps > 1, the gradient descent units
+        average the gradient over that many train minibatches before applying
+        it (see :class:`veles.znicz.decision.DecisionGD`).
         Returns the first :class:`veles.znicz.nn_units.GradientDescentBase`
         which correspond to the first :class:`veles.znicz.nn_units.ForwardBase`
         descendant (but the first
@@ -364,6 +368,20 @@ class StandardWorkflow(StandardWorkflowBase):
 
             unit.gate_skip = self.decision.gd_skip
 
+            accumulate_steps = getattr(self.decision, "accumulate_steps", 1)
+            if accumulate_steps > 1:
+                if (not isinstance(unit, (gd.GradientDescent,
+                                          gd_conv.GradientDescentConv,
+                                          GDDeconv)) and
+                        hasattr(self.forwards[i], "weights")):
+                    raise error.BadFormatError(
+                        "%s does not support accumulate_steps" % unit)
+                unit.accumulate_steps = accumulate_steps
+                unit.link_attrs(
+                    self.decision,
+                    ("accumulated_steps", "gd_accumulated_steps"),
+                    ("accumulation_complete", "gd_apply"))
+
         # Remove None elements
         for i in units_to_delete:
             del self.gds[i]
@@ -106,8 +106,7 @@ class ImagenetLoader(ImagenetLoaderBase):
             w_off:w_off + self.crop_size_sx, :self.channels]
         return sample
 
-    def fill_data(self, index, index_sample, sample):
-        self._file_samples_.readinto(sample)
+    def fill_sample(self, index, index_sample, sample):
         rand = prng.get()
         if self.minibatch_class == 2:
             self.do_mirror = self.mirror and bool(rand.randint((2)))
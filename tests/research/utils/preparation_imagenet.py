@@ -65,6 +65,7 @@ from veles.config import root
 import veles.opencl_types as opencl_types
 import veles.prng as rnd
 from veles.znicz.external import xmltodict
+from veles.znicz.loader.sharded import convert_to_sharded
 from veles.znicz.tests.research.ImagenetAE.processor import Processor
 
 
@@ -112,6 +113,13 @@ root.prep_imagenet.update({
         root.prep_imagenet.root_path,
         "count_samples_%s_%s.json"
         % (root.prep_imagenet.root_name, root.prep_imagenet.series)),
+    "sharded_path":
+    os.path.join(
+        root.prep_imagenet.root_path,
+        "sharded_%s_%s" % (root.prep_imagenet.root_name,
+                           root.prep_imagenet.series)),
+    "samples_per_shard": 4096,
+    "sharded_compression": None,  # None "zlib"
     "rect": (256, 256),
     "channels": 3,
     "get_label": "all_ways",
@@ -119,7 +127,7 @@ root.prep_imagenet.update({
     "get_label_from_txt_label": True,
     "command_to_run": "save_dataset_to_file"
     # "save_dataset_to_file" "init_dataset" "test_load_data"
-    # "save_validation_to_forward"
+    # "save_validation_to_forward" "convert_to_sharded"
 })
 
 root.prep_imagenet.classes_count = (
@@ -829,6 +837,30 @@ training Neural Network. And use it in ImagenetForward workflow, for example.
             pickle.dump(self.original_labels, fout)
         self.file_samples.close()
 
+    def convert_to_sharded(self):
+        """Converts the files saved by save_dataset_to_file() into the
+        sharded dataset for ImagenetLoaderBase's sharded_path.
+        """
+        with open(root.prep_imagenet.file_original_labels, "rb") as fin:
+            original_labels = pickle.load(fin)
+        with open(root.prep_imagenet.file_count_samples, "r") as fin:
+            count_samples = json.load(fin)
+        with open(root.prep_imagenet.file_matrix, "rb") as fin:
+            matrixes = pickle.load(fin)
+        # The samples are of the same shape as the mean image
+        shape = matrixes[0].shape
+        path = root.prep_imagenet.sharded_path
+        self.info("Converting %s to %s...",
+                  root.prep_imagenet.file_original_data, path)
+        size = convert_to_sharded(
+            path, root.prep_imagenet.file_original_data,
+            shape, numpy.uint8,
+            [count_samples[key] for key in (TEST, VALIDATION, TRAIN)],
+            original_labels, matrixes[:2],
+            root.prep_imagenet.samples_per_shard,
+            root.prep_imagenet.sharded_compression)
+        self.info("Saved %d bytes of samples to %s", size, path)
+
     def init_dataset(self):
         if self.series == "DET":
             self.init_files_det()
@@ -185,6 +185,57 @@ class TestDeconv(AcceleratedTest, GDNumDiff):
                               mean=False,
                               threshold=self.precision_threshold)
 
+    def test_gd_deconv_gpu_vs_cpu(self):
+        for weights_transposed in (False, True):
+            self.info("GDDeconv GPU vs CPU test (weights_transposed = %s)...",
+                      weights_transposed)
+            _, first, forward = self._test_deconv(self.device, None,
+                                                  weights_transposed)
+            first.input.map_read()
+            forward.output.map_read()
+            err_output = forward.output.mem - first.input.mem
+            gpu_err_input, gpu_weights = self._test_gd_deconv(
+                self.device, first, forward, err_output, weights_transposed)
+            cpu_err_input, cpu_weights = self._test_gd_deconv(
+                NumpyDevice(), first, forward, err_output, weights_transposed)
+            max_diff = numpy.fabs(gpu_err_input - cpu_err_input).max()
+            self.assertLess(max_diff, self.precision_threshold,
+                            "err_input differs by %.2e" % max_diff)
+            max_diff = numpy.fabs(gpu_weights - cpu_weights).max()
+            self.assertLess(max_diff, self.precision_threshold,
+                            "Weights differ by %.2e" % max_diff)
+
+    def _test_gd_deconv(self, device, first, forward, err_output,
+                        weights_transposed):
+        first.weights.map_read()
+        forward.input.map_read()
+        gd = GDDeconv(first.workflow, learning_rate=-1.0, weights_decay=0.0,
+                      gradient_moment=0.9,
+                      weights_transposed=weights_transposed)
+        gd.link_conv_attrs(first)
+        gd.weights = memory.Array(first.weights.mem.copy())
+        gd.input = memory.Array(forward.input.mem.copy())
+        gd.err_output = memory.Array(err_output.copy())
+        gd.initialize(device)
+        gd.run()
+        gd.err_input.map_read()
+        gd.weights.map_read()
+        nz = numpy.count_nonzero(numpy.isnan(gd.err_input.mem))
+        self.assertEqual(nz, 0, "NaNs encountered in err_input")
+        return gd.err_input.mem.copy(), gd.weights.mem.copy()
+
+    def test_deconv_gpu_vs_cpu(self):
+        for weights_transposed in (False, True):
+            self.info("Deconv GPU vs CPU test (weights_transposed = %s)...",
+                      weights_transposed)
+            gpu_output, forward, _ = self._test_deconv(
+                self.device, None, weights_transposed)
+            cpu_output, _, _ = self._test_deconv(
+                NumpyDevice(), forward, weights_transposed)
+            max_diff = numpy.fabs(gpu_output - cpu_output).max()
+            self.assertLess(max_diff, self.precision_threshold,
+                            "Result differs by %.2e" % max_diff)
+
     def _test_deconv(self, device, forward, weights_transposed):
         rnd.get().seed("%s/seed" % self.this_dir,
                        dtype=numpy.int32, count=1024)
@@ -33,7 +33,11 @@ under the License.
 ███████████████████████████████████████████████████████████████████████████████
 """
 
+import json
 import numpy
+import os
+import shutil
+import tempfile
 
 from veles.config import root
 from veles.memory import Array
@@ -44,6 +48,10 @@ from veles.tests import AcceleratedTest, assign_backend
 import veles.znicz.evaluator as evaluator
 
 
+class TestingEvaluatorSoftmax(evaluator.EvaluatorSoftmax):
+    testing = True
+
+
 class TestEvaluator(AcceleratedTest):
     ABSTRACT = True
 
@@ -123,6 +131,40 @@ class TestEvaluator(AcceleratedTest):
         self.info("Difference is %.12f", max_diff)
         self.assertLess(max_diff, 1.0e-4)
 
+    def test_softmax_output_labels(self):
+        n_classes = 4
+        labels = numpy.array([2, 0, 3, 3, 1])
+        keys = [(2, ("key%d" % i).encode()) for i in range(len(labels))]
+        dtype = opencl_types.dtypes[root.common.engine.precision_type]
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        path = os.path.join(path, "labels.json")
+
+        ev = TestingEvaluatorSoftmax(self.parent, output_labels_path=path)
+        ev.output = Array(numpy.zeros([3, n_classes], dtype=dtype))
+        ev.labels = Array()
+        ev.max_idx = Array()
+        ev.class_lengths = [len(labels), 0, 0]
+        ev.class_keys = [keys, [], []]
+        ev.labels_mapping = [numpy.int64(i * 10) for i in range(n_classes)]
+        ev.batch_size = 3
+        ev.offset = 0
+        ev.initialize(device=self.device)
+        for start in range(0, len(labels), 3):
+            batch = labels[start:start + 3]
+            ev.output.map_invalidate()
+            ev.output.mem[:] = 0
+            ev.output.mem[numpy.arange(len(batch)), batch] = 1
+            ev.batch_size = len(batch)
+            ev.offset = start + len(batch)
+            ev.run()
+
+        with open(path) as fin:
+            lines = [json.loads(line) for line in fin]
+        self.assertEqual(lines, [
+            {"key": [2, "key%d" % i], "label": int(label) * 10}
+            for i, label in enumerate(labels)])
+
 
 @assign_backend("ocl")
 class OpenCLTestEvaluator(TestEvaluator):
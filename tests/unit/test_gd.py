@@ -38,12 +38,15 @@ import numpy
 from veles.backends import NumpyDevice
 
 from veles.config import root
+from veles.loader import TRAIN
 from veles.memory import Array
 import veles.opencl_types as opencl_types
+from veles.pickle2 import pickle, best_protocol
 import veles.prng as prng
 from veles.znicz.gd import (GradientDescent, GDRELU, GDSoftmax, GDTanh,
                             GDSigmoid)
 import veles.znicz.all2all as all2all
+from veles.znicz.decision import DecisionGD
 from veles.znicz.nn_units import GradientDescentBase
 from veles.znicz.tests.unit.gd_numdiff import GDNumDiff
 from veles.tests import timeout, AcceleratedTest, assign_backend
@@ -200,6 +203,239 @@ class TestGD(AcceleratedTest, GDNumDiff):
         self._do_test_gpu_cpu(all2all.All2AllSigmoid, PatchedGDSigmoid)
 
 
+class TestGDSolvers(AcceleratedTest):
+    ABSTRACT = True
+
+    def setUp(self):
+        super(TestGDSolvers, self).setUp()
+        prng.get().seed(123)
+        self.dtype = opencl_types.dtypes[root.common.engine.precision_type]
+        self.batch_size = 3
+        self.input_size = 11
+        self.n_neurons = 5
+        self.weights = self._random(self.n_neurons, self.input_size)
+        self.bias = self._random(self.n_neurons)
+
+    def _random(self, *shape):
+        arr = numpy.zeros(shape, dtype=self.dtype)
+        prng.get().fill(arr)
+        return arr
+
+    def _minibatches(self, count, batch_size=None):
+        """Returns the list of (input, err_output) pairs.
+        """
+        batch_size = batch_size or self.batch_size
+        return [(self._random(batch_size, self.input_size),
+                 self._random(batch_size, self.n_neurons))
+                for _ in range(count)]
+
+    def _create(self, device, minibatches, weights_transposed=False,
+                **kwargs):
+        inp, err_output = minibatches[0]
+        gd = GradientDescent(
+            self.parent, need_err_input=False, weights_decay=0,
+            weights_transposed=weights_transposed, **kwargs)
+        gd.input = Array(inp.copy())
+        gd.err_output = Array(err_output.copy())
+        gd.output = Array(numpy.zeros_like(err_output))
+        gd.weights = Array(self.weights.transpose().copy()
+                           if weights_transposed else self.weights.copy())
+        gd.bias = Array(self.bias.copy())
+        gd.initialize(device=device)
+        return gd
+
+    def _step(self, gd, inp, err_output):
+        gd.input.map_invalidate()
+        gd.input.mem[:] = inp
+        gd.err_output.map_invalidate()
+        gd.err_output.mem[:] = err_output
+        gd.run()
+
+    def _run(self, device, minibatches, **kwargs):
+        """Runs GradientDescent on the minibatches.
+
+        Returns:
+            weights, bias
+        """
+        gd = self._create(device, minibatches, **kwargs)
+        for inp, err_output in minibatches:
+            self._step(gd, inp, err_output)
+        gd.weights.map_read()
+        gd.bias.map_read()
+        weights = gd.weights.mem.copy()
+        if kwargs.get("weights_transposed"):
+            weights = weights.transpose()
+        return weights, gd.bias.mem.copy()
+
+    def _assert_close(self, expected, actual, what, limit=0.0001):
+        max_diff = numpy.fabs(expected.ravel() - actual.ravel()).max()
+        self.info("%s difference is %.12f", what, max_diff)
+        self.assertLess(max_diff, limit,
+                        "%s differs by %.6f" % (what, max_diff))
+
+    def _compare(self, first, second, what):
+        self._assert_close(first[0], second[0], what + " weights")
+        self._assert_close(first[1], second[1], what + " bias")
+
+    @timeout()
+    def test_adam_nesterov_reference(self):
+        self.info("Will test Adam and Nesterov against the formulas")
+        lr, lr_bias, mu = 0.01, 0.05, 0.9
+        b1, b2, eps = 0.9, 0.999, 1e-8
+        minibatches = self._minibatches(5)
+        weights, bias = self.weights.astype(numpy.float64), \
+            self.bias.astype(numpy.float64)
+        adam = [[weights.copy(), numpy.zeros_like(weights),
+                 numpy.zeros_like(weights)],
+                [bias.copy(), numpy.zeros_like(bias),
+                 numpy.zeros_like(bias)]]
+        nesterov = [[weights.copy(), numpy.zeros_like(weights)],
+                    [bias.copy(), numpy.zeros_like(bias)]]
+        for t, (inp, err_output) in enumerate(minibatches, 1):
+            for gradient, (w, m, v), (nw, moment), rate in zip(
+                    (numpy.dot(err_output.transpose(), inp),
+                     err_output.sum(axis=0)), adam, nesterov, (lr, lr_bias)):
+                m *= b1
+                m += (1 - b1) * gradient
+                v *= b2
+                v += (1 - b2) * gradient ** 2
+                w -= rate * numpy.sqrt(1 - b2 ** t) / (1 - b1 ** t) * m / (
+                    numpy.sqrt(v) + eps)
+                moment *= mu
+                moment -= rate * gradient
+                nw += mu * moment - rate * gradient
+        self._compare(
+            (adam[0][0], adam[1][0]),
+            self._run(NumpyDevice(), minibatches, solvers={"adam"},
+                      learning_rate=lr, learning_rate_bias=lr_bias), "Adam")
+        self._compare(
+            (nesterov[0][0], nesterov[1][0]),
+            self._run(NumpyDevice(), minibatches, solvers={"nesterov"},
+                      learning_rate=lr, learning_rate_bias=lr_bias,
+                      gradient_moment=mu, gradient_moment_bias=mu),
+            "Nesterov")
+
+    def _do_test_gpu_cpu_solvers(self, **kwargs):
+        minibatches = self._minibatches(4)
+        self._compare(self._run(self.device, minibatches, **kwargs),
+                      self._run(NumpyDevice(), minibatches, **kwargs),
+                      "GPU-CPU")
+
+    @timeout()
+    def test_gpu_cpu_adam(self):
+        self.info("Will test Adam for gpu/cpu correctness")
+        for factor_ortho in (0, 0.01):
+            self._do_test_gpu_cpu_solvers(
+                solvers={"adam"}, learning_rate=0.01,
+                learning_rate_bias=0.01, factor_ortho=factor_ortho)
+        self._do_test_gpu_cpu_solvers(
+            solvers={"adam"}, learning_rate=0.01, learning_rate_bias=0.01,
+            gradient_moment=0.9, weights_transposed=True)
+        # The bias has its own hyperparameters
+        self._do_test_gpu_cpu_solvers(
+            solvers={"adam"}, learning_rate=0.01, learning_rate_bias=0.05,
+            weights_decay_bias=0.001, gradient_moment=0.9,
+            gradient_moment_bias=0.5)
+
+    @timeout()
+    def test_gpu_cpu_nesterov(self):
+        self.info("Will test Nesterov for gpu/cpu correctness")
+        for factor_ortho in (0, 0.01):
+            self._do_test_gpu_cpu_solvers(
+                solvers={"nesterov"}, learning_rate=0.01,
+                learning_rate_bias=0.01, gradient_moment=0.9,
+                factor_ortho=factor_ortho)
+
+    @timeout()
+    def test_adam_snapshot(self):
+        self.info("Will test the snapshot of Adam's state")
+        minibatches = self._minibatches(3)
+        gd = self._create(NumpyDevice(), minibatches, solvers={"adam"})
+        for inp, err_output in minibatches[:2]:
+            self._step(gd, inp, err_output)
+        restored = pickle.loads(pickle.dumps(gd, best_protocol))
+        self.assertEqual(restored.adam_steps, gd.adam_steps)
+        for name in ("weights", "sweights", "bias", "sbias"):
+            numpy.testing.assert_array_equal(
+                getattr(restored.adam, name).mem,
+                getattr(gd.adam, name).mem)
+        # initialize() must keep the restored state
+        restored.initialize(device=NumpyDevice())
+        for unit in (gd, restored):
+            self._step(unit, *minibatches[2])
+        self.assertEqual(restored.adam_steps, {"weights": 3, "bias": 3})
+        numpy.testing.assert_array_equal(restored.weights.mem,
+                                         gd.weights.mem)
+        numpy.testing.assert_array_equal(restored.bias.mem, gd.bias.mem)
+
+    def _run_accumulated(self, device, minibatches, steps, **kwargs):
+        """Runs GradientDescent on the minibatches of the train set, the
+        gradient is averaged by DecisionGD's windows of the specified size.
+
+        Returns:
+            weights, bias, the list of gd_apply values
+        """
+        decision = DecisionGD(self.parent, accumulate_steps=steps)
+        gd = self._create(device, minibatches, accumulate_steps=steps,
+                          **kwargs)
+        gd.link_attrs(decision,
+                      ("accumulated_steps", "gd_accumulated_steps"),
+                      ("accumulation_complete", "gd_apply"))
+        applied = []
+        for index, (inp, err_output) in enumerate(minibatches):
+            decision.minibatch_class = TRAIN
+            decision.last_minibatch = index == len(minibatches) - 1
+            decision.on_run()
+            applied.append(bool(decision.gd_apply))
+            self._step(gd, inp, err_output)
+        gd.weights.map_read()
+        gd.bias.map_read()
+        return gd.weights.mem.copy(), gd.bias.mem.copy(), applied
+
+    @staticmethod
+    def _windows(minibatches, steps):
+        """Joins the minibatches of each window into one minibatch of steps
+        times the size, err_output is averaged over the window.
+        """
+        windows = []
+        for start in range(0, len(minibatches), steps):
+            window = minibatches[start:start + steps]
+            inp = numpy.zeros((steps * len(window[0][0]),) +
+                              window[0][0].shape[1:], window[0][0].dtype)
+            err_output = numpy.zeros((len(inp),) + window[0][1].shape[1:],
+                                     window[0][1].dtype)
+            for index, (i, e) in enumerate(window):
+                size = len(i)
+                inp[index * size:(index + 1) * size] = i
+                err_output[index * size:(index + 1) * size] = e / len(window)
+            windows.append((inp, err_output))
+        return windows
+
+    def _do_test_accumulate_steps(self, count, steps, applied):
+        kwargs = {"learning_rate": 0.1, "learning_rate_bias": 0.1,
+                  "gradient_moment": 0.5}
+        minibatches = self._minibatches(count)
+        expected = self._run(NumpyDevice(),
+                             self._windows(minibatches, steps), **kwargs)
+        for device in (NumpyDevice(), self.device):
+            weights, bias, gd_apply = self._run_accumulated(
+                device, minibatches, steps, **kwargs)
+            self.assertEqual(gd_apply, applied)
+            self._compare(expected, (weights, bias),
+                          "%s accumulated" % device.__class__.__name__)
+
+    @timeout()
+    def test_accumulate_steps(self):
+        self.info("Will test the gradient accumulated over minibatches")
+        self._do_test_accumulate_steps(6, 3, [False, False, True] * 2)
+
+    @timeout()
+    def test_accumulate_steps_flush(self):
+        self.info("Will test the flush of the short accumulation window")
+        self._do_test_accumulate_steps(
+            5, 3, [False, False, True, False, True])
+
+
 @assign_backend("ocl")
 class OpenCLTestGD(TestGD):
     pass
@@ -210,5 +446,15 @@ class CUDATestGD(TestGD):
     pass
 
 
+@assign_backend("ocl")
+class OpenCLTestGDSolvers(TestGDSolvers):
+    pass
+
+
+@assign_backend("cuda")
+class CUDATestGDSolvers(TestGDSolvers):
+    pass
+
+
 if __name__ == "__main__":
     AcceleratedTest.main()
@@ -36,6 +36,7 @@ under the License.
 
 
 import numpy
+import time
 from veles.backends import NumpyDevice
 
 from veles.config import root
@@ -455,6 +456,98 @@ class TestGDConv(AcceleratedTest, GDNumDiff):
                               err_input, weights_derivative, bias_derivative,
                               self.info, self.assertLess, mean=False)
 
+    def test_err_input_fft_vs_gemm_cpu(self):
+        self.info("Will compare FFT and GEMM err_input engines on CPU")
+        device = NumpyDevice()
+        dtype = opencl_types.dtypes[root.common.engine.precision_type]
+        inp = numpy.zeros([4, 27, 27, 3], dtype=dtype)
+        prng.get().fill(inp)
+        forward = conv.Conv(self.parent, n_kernels=8, kx=11, ky=11,
+                            padding=(2, 3, 4, 5), sliding=(2, 3))
+        forward.input = Array(inp)
+        forward.initialize(device=device)
+        forward.run()
+        forward.output.map_read()
+        err_output = numpy.zeros_like(forward.output.mem)
+        prng.get().fill(err_output)
+
+        results = {}
+        for engine in GradientDescentConv.ERR_INPUT_ENGINES:
+            c = GradientDescentConv(
+                self.parent, err_input_engine=engine, unpack_size=3,
+                need_gradient_weights=False, err_input_alpha=0.5,
+                err_input_beta=0)
+            c.link_conv_attrs(forward)
+            c.link_attrs(forward, "input", "output", "weights", "bias")
+            c.err_output = Array(err_output.copy())
+            c.initialize(device)
+            time0 = time.time()
+            c.run()
+            self.info("%s engine took %.4f sec", engine, time.time() - time0)
+            c.err_input.map_read()
+            results[engine] = c.err_input.mem.copy()
+
+        max_diff = numpy.fabs(results["fft"] - results["gemm"]).max()
+        self.assertLess(max_diff, self.precision_threshold,
+                        "FFT result differs by %.2e" % max_diff)
+
+    def test_accumulate_steps(self):
+        self.info("Will test the gradient accumulated over minibatches")
+        dtype = opencl_types.dtypes[root.common.engine.precision_type]
+        steps, batch_size = 3, 2
+        inp = numpy.zeros([steps * batch_size, 9, 9, 2], dtype=dtype)
+        prng.get().fill(inp)
+        err_output = numpy.zeros([steps * batch_size, 5, 5, 3], dtype=dtype)
+        prng.get().fill(err_output)
+        weights = numpy.zeros([3, 3 * 3 * 2], dtype=dtype)
+        prng.get().fill(weights)
+        bias = numpy.zeros(3, dtype=dtype)
+        prng.get().fill(bias)
+
+        # The mean gradient over the window is the gradient over the joined
+        # minibatch with err_output divided by the window size
+        expected = self._run_accumulated(
+            NumpyDevice(), [(inp, err_output / steps)], weights, bias, 1)
+        minibatches = [
+            (inp[i * batch_size:(i + 1) * batch_size],
+             err_output[i * batch_size:(i + 1) * batch_size])
+            for i in range(steps)]
+        for device in (NumpyDevice(), self.device):
+            actual = self._run_accumulated(
+                device, minibatches, weights, bias, steps)
+            for what, e, a in zip(("Weights", "Bias"), expected, actual):
+                max_diff = numpy.fabs(e - a).max()
+                self.assertLess(max_diff, self.precision_threshold,
+                                "%s on %s differ by %.2e" % (
+                                    what, device.__class__.__name__,
+                                    max_diff))
+
+    def _run_accumulated(self, device, minibatches, weights, bias, steps):
+        c = GradientDescentConv(self.parent, learning_rate=0.1,
+                                learning_rate_bias=0.1, accumulate_steps=steps)
+        u = DummyUnit(n_kernels=3, kx=3, ky=3,
+                      padding=(1, 1, 1, 1), sliding=(2, 2),
+                      err_output=Array(minibatches[0][1].copy()),
+                      input=Array(minibatches[0][0].copy()),
+                      weights=Array(weights.copy()),
+                      bias=Array(bias.copy()),
+                      output=Array(minibatches[0][1].copy()),
+                      unpack_size=1)
+        c.link_conv_attrs(u)
+        c.link_attrs(u, "err_output", "input", "output", "weights", "bias")
+        c.initialize(device=device)
+        for index, (inp, err_output) in enumerate(minibatches):
+            c.accumulated_steps = index % steps + 1
+            c.accumulation_complete = c.accumulated_steps == steps
+            c.input.map_invalidate()
+            c.input.mem[:] = inp
+            c.err_output.map_invalidate()
+            c.err_output.mem[:] = err_output
+            c.run()
+        c.weights.map_read()
+        c.bias.map_read()
+        return c.weights.mem.copy(), c.bias.mem.copy()
+
 
 @assign_backend("ocl")
 class OpenCLTestGDConv(TestGDConv):
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+.. invisible:
+     _   _ _____ _     _____ _____
+    | | | |  ___| |   |  ___/  ___|
+    | | | | |__ | |   | |__ \ `--.
+    | | | |  __|| |   |  __| `--. \
+    \ \_/ / |___| |___| |___/\__/ /
+     \___/\____/\_____|____/\____/
+
+Created on Oct 17, 2026
+
+Unit test for RProp and iRProp- gradient descent.
+
+███████████████████████████████████████████████████████████████████████████████
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+███████████████████████████████████████████████████████████████████████████████
+"""
+
+
+import logging
+import numpy
+import unittest
+
+from veles.backends import NumpyDevice
+from veles.dummy import DummyWorkflow
+from veles.memory import Array
+from veles.znicz.rprop_gd import GDRProp
+
+
+class TestGDRProp(unittest.TestCase):
+    INITIAL = 0.01
+    INCREASE = 1.5
+    DECREASE = 0.5
+
+    def setUp(self):
+        self.parent = DummyWorkflow()
+        self.inp = numpy.array([[1.0, 2.0, -1.0]])
+        self.err_output = numpy.array([[1.0, -1.0]])
+        self.weights = numpy.array([[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]])
+        self.bias = numpy.array([0.1, -0.1])
+
+    def tearDown(self):
+        del self.parent
+
+    def _create(self, variant="rprop-", weights_transposed=False):
+        gd = GDRProp(self.parent, variant=variant,
+                     weights_transposed=weights_transposed,
+                     initial_learning_rate=self.INITIAL,
+                     increase=self.INCREASE, decrease=self.DECREASE,
+                     need_err_input=False)
+        gd.input = Array(self.inp.copy())
+        gd.err_output = Array(self.err_output.copy())
+        gd.output = Array(numpy.zeros_like(self.err_output))
+        gd.weights = Array(self.weights.T.copy() if weights_transposed
+                           else self.weights.copy())
+        gd.bias = Array(self.bias.copy())
+        gd.initialize(device=NumpyDevice())
+        return gd
+
+    def _step(self, gd, sign):
+        """Runs gd with the gradient of the specified sign.
+        """
+        gd.err_output.map_write()
+        gd.err_output.mem[:] = self.err_output * sign
+        gd.run()
+        for vec in (gd.weights, gd.bias, gd.weight_lrs, gd.bias_lrs):
+            vec.map_read()
+
+    def test_initial_learning_rate(self):
+        gd = self._create()
+        self.assertTrue(numpy.all(gd.weight_lrs.mem == self.INITIAL))
+        self.assertTrue(numpy.all(gd.bias_lrs.mem == self.INITIAL))
+        self._step(gd, 1)
+        # There is no previous gradient, so the rates are the initial ones
+        self.assertTrue(numpy.all(gd.weight_lrs.mem == self.INITIAL))
+        gradient = numpy.outer(self.err_output[0], self.inp[0])
+        numpy.testing.assert_allclose(
+            gd.weights.mem, self.weights - numpy.sign(gradient) * self.INITIAL)
+        numpy.testing.assert_allclose(
+            gd.bias.mem,
+            self.bias - numpy.sign(self.err_output[0]) * self.INITIAL)
+
+    def test_increase_decrease(self):
+        gd = self._create()
+        self._step(gd, 1)
+        self._step(gd, 1)
+        numpy.testing.assert_allclose(
+            gd.weight_lrs.mem, self.INITIAL * self.INCREASE)
+        weights = gd.weights.mem.copy()
+        self._step(gd, -1)
+        lr = self.INITIAL * self.INCREASE * self.DECREASE
+        numpy.testing.assert_allclose(gd.weight_lrs.mem, lr)
+        numpy.testing.assert_allclose(gd.bias_lrs.mem, lr)
+        # RProp- makes the step even when the sign changes
+        gradient = numpy.outer(self.err_output[0], self.inp[0])
+        numpy.testing.assert_allclose(
+            gd.weights.mem, weights + numpy.sign(gradient) * lr)
+
+    def test_irprop_skips_step(self):
+        gd = self._create("irprop-")
+        self._step(gd, 1)
+        weights = gd.weights.mem.copy()
+        bias = gd.bias.mem.copy()
+        self._step(gd, -1)
+        lr = self.INITIAL * self.DECREASE
+        numpy.testing.assert_allclose(gd.weight_lrs.mem, lr)
+        numpy.testing.assert_array_equal(gd.weights.mem, weights)
+        numpy.testing.assert_array_equal(gd.bias.mem, bias)
+        # The next step is not adapted
+        self._step(gd, -1)
+        numpy.testing.assert_allclose(gd.weight_lrs.mem, lr)
+        gradient = numpy.outer(self.err_output[0], self.inp[0])
+        numpy.testing.assert_allclose(
+            gd.weights.mem, weights + numpy.sign(gradient) * lr)
+
+    def test_old_snapshot(self):
+        gd = self._create()
+        self._step(gd, 1)
+        # The state of the units pickled before iRProp- and the gradient
+        # accumulation were added
+        for attr in ("variant", "prev_gradient_weights", "prev_gradient_bias",
+                     "accumulate_steps", "accumulated_steps",
+                     "accumulation_complete", "minibatch_ones"):
+            del gd.__dict__[attr]
+        gd.init_unpickled()
+        self.assertEqual(gd.variant, "rprop-")
+        self.assertEqual(gd.accumulate_steps, 1)
+        self.assertTrue(gd.accumulation_complete)
+        gd.initialize(device=NumpyDevice())
+        weights = gd.weights.mem.copy()
+        self._step(gd, 1)
+        # There is no previous gradient, so the rates are kept
+        numpy.testing.assert_allclose(gd.weight_lrs.mem, self.INITIAL)
+        gradient = numpy.outer(self.err_output[0], self.inp[0])
+        numpy.testing.assert_allclose(
+            gd.weights.mem, weights - numpy.sign(gradient) * self.INITIAL)
+
+    def test_weights_transposed(self):
+        gd = self._create(weights_transposed=True)
+        self._step(gd, 1)
+        gradient = numpy.outer(self.err_output[0], self.inp[0])
+        numpy.testing.assert_allclose(
+            gd.weights.mem,
+            (self.weights - numpy.sign(gradient) * self.INITIAL).T)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+.. invisible:
+     _   _ _____ _     _____ _____
+    | | | |  ___| |   |  ___/  ___|
+    | | | | |__ | |   | |__ \ `--.
+    | | | |  __|| |   |  __| `--. \
+    \ \_/ / |___| |___| |___/\__/ /
+     \___/\____/\_____|____/\____/
+
+Created on Oct 17, 2026
+
+Unit test for the sharded dataset format.
+
+███████████████████████████████████████████████████████████████████████████████
+
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+███████████████████████████████████████████████████████████████████████████████
+"""
+
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from veles.znicz.loader.sharded import ShardedDataset, convert_to_sharded
+
+
+class TestSharded(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.shape = (5, 4, 3)
+        self.class_lengths = [3, 5, 11]
+        total = sum(self.class_lengths)
+        self.samples = numpy.random.randint(
+            0, 8, (total,) + self.shape).astype(numpy.uint8)
+        self.samples_filename = os.path.join(self.path, "samples.dat")
+        self.samples.tofile(self.samples_filename)
+        self.labels = [(None, 0)] * 3 + [
+            ("n%d" % (i % 4), i % 4) for i in range(total - 3)]
+        self.mean = self.samples.mean(axis=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def check(self, compression, workers):
+        dataset_path = os.path.join(self.path, "sharded")
+        convert_to_sharded(
+            dataset_path, self.samples_filename, self.shape, numpy.uint8,
+            self.class_lengths, self.labels, (self.mean, 1 / self.mean),
+            samples_per_shard=4, compression=compression, processes=2)
+        dataset = ShardedDataset(dataset_path, workers)
+        self.assertEqual(len(dataset), len(self.samples))
+        self.assertEqual(dataset.shape, self.shape)
+        self.assertEqual(dataset.class_lengths, self.class_lengths)
+        self.assertEqual(
+            [(dataset.label_names[i], dataset.label_values[i])
+             for i in dataset.labels], self.labels)
+        numpy.testing.assert_array_equal(
+            dataset.load_matrixes()[0], self.mean)
+        indices = numpy.array([17, 2, 9, 0, 18, 9, 5])
+        samples = numpy.zeros((len(indices),) + self.shape, numpy.uint8)
+        dataset.read(indices, samples)
+        numpy.testing.assert_array_equal(samples, self.samples[indices])
+        dataset.close()
+
+    def test_raw(self):
+        self.check(None, 1)
+
+    def test_zlib(self):
+        self.check("zlib", 3)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()